@@ -0,0 +1,286 @@
+import fcntl
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Decoded audio is float32 at 48kHz.
+DECODED_BYTES_PER_SECOND = 48000 * 4
+
+# Seconds of decoded audio a streamed recording holds in memory at once.
+DEFAULT_WINDOW_SECONDS = 300
+
+# librosa holds the file's native samples, the resampled copy and the chunks
+# at the same time, so a job peaks at a few times the decoded size.
+DECODE_OVERHEAD_FACTOR = 3
+
+# Interpreter scratch space, extraction buffers and other per-job allocations.
+JOB_BASE_BYTES = 64 * 1024 * 1024
+
+# Lower bounds on bytes per second of audio for formats whose header doesn't
+# give the duration. Assuming a low bit rate overestimates the duration.
+MIN_BYTES_PER_SECOND = {
+    "wav": 16000 * 2,
+    "aiff": 16000 * 2,
+    "flac": 16000,
+}
+DEFAULT_MIN_BYTES_PER_SECOND = 8000
+
+# Share of the instance's memory available to jobs when no budget is given.
+DEFAULT_BUDGET_FRACTION = 0.8
+
+# Limits on how far calibration can move an estimate.
+MIN_CALIBRATION = 0.25
+MAX_CALIBRATION = 4.0
+
+# A job waiting for memory reserves again about every second; one not seen for
+# this long is no longer waiting (it was handed back), and one not seen for
+# WAITER_EXPIRY_SECONDS has been forgotten.
+ACTIVE_WAITER_SECONDS = 5
+WAITER_EXPIRY_SECONDS = 3600
+
+
+def return_instance_memory_bytes():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak so far (kilobytes on Linux), the best we have.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def estimate_audio_seconds(size, audio_format):
+    if audio_format.get("duration"):
+        return audio_format["duration"]
+    if audio_format.get("byte_rate"):
+        return size / audio_format["byte_rate"]
+    container = audio_format.get("container", "unknown")
+    return size / MIN_BYTES_PER_SECOND.get(container, DEFAULT_MIN_BYTES_PER_SECOND)
+
+
+def estimate_job_bytes(audio_seconds, window_seconds=None):
+    # Streamed recordings only ever decode one window.
+    if window_seconds:
+        audio_seconds = min(audio_seconds, window_seconds)
+    return int(
+        JOB_BASE_BYTES
+        + audio_seconds * DECODED_BYTES_PER_SECOND * DECODE_OVERHEAD_FACTOR
+    )
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RssSampler:
+    # Polls this process's resident memory on a background thread and keeps
+    # the peak above where it started. RSS is the whole process's, so the peak
+    # is only attributed to the job when nothing else grew the process
+    # meanwhile: a sampler that overlapped another job's sampler, or an
+    # analyzer load (which stays resident), measures nothing. Only the first
+    # job of a process is fresh: later ones may reuse memory an earlier job
+    # freed but the process kept, so their peaks above the baseline can read
+    # low.
+
+    _active = set()
+    _active_lock = threading.Lock()
+    _started = False
+
+    def __init__(self, interval_seconds=0.05):
+        self.interval_seconds = interval_seconds
+        self.attributable = True
+        with self._active_lock:
+            self.fresh = not RssSampler._started
+            RssSampler._started = True
+            if self._active:
+                self.attributable = False
+                for sampler in self._active:
+                    sampler.attributable = False
+            self._active.add(self)
+        self.baseline = current_rss_bytes()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def discard_active(cls):
+        # Something other than the running jobs is about to grow the process.
+        with cls._active_lock:
+            for sampler in cls._active:
+                sampler.attributable = False
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def stop(self):
+        # The job's peak above the baseline, or None if it can't be told apart.
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        with self._active_lock:
+            self._active.discard(self)
+        if not self.attributable:
+            return None
+        return self.peak - self.baseline
+
+
+class MemoryBudget:
+    # Instance-wide memory budget shared by every runner through a state file.
+    #
+    #   state.json          reservations of jobs in progress, jobs waiting for
+    #                       memory, calibration factor
+    #   state.lock          held while state.json is read and updated
+    #   calibration.jsonl   predicted vs. actual peak per job
+    #
+    # Reservations of processes that died are dropped the next time the state
+    # is read. The calibration factor is the smoothed ratio of actual to
+    # predicted peaks and scales later estimates. Only a job measured in a
+    # fresh process (see RssSampler) can bring it below 1.0, since other
+    # measurements may underestimate.
+    #
+    # Jobs age: one that has been waiting (across hand backs and runners) for
+    # priority_after_seconds gets priority, and while it is still waiting no
+    # other job is admitted, so running jobs drain until it fits. Otherwise a
+    # job bigger than the budget would only run when the instance happened
+    # to be idle, which on a busy fleet may be never.
+
+    def __init__(
+        self, directory, max_bytes=None, smoothing=0.2, priority_after_seconds=60
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes or int(
+            return_instance_memory_bytes() * DEFAULT_BUDGET_FRACTION
+        )
+        self.smoothing = smoothing
+        self.priority_after_seconds = priority_after_seconds
+        self.waits = 0
+        self.rejections = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _state(self):
+        with open(os.path.join(self.directory, "state.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = os.path.join(self.directory, "state.json")
+                try:
+                    with open(path) as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {}
+                state.setdefault("reservations", {})
+                state.setdefault("waiting", {})
+                state.setdefault("calibration", 1.0)
+                state["reservations"] = {
+                    token: reservation
+                    for token, reservation in state["reservations"].items()
+                    if pid_alive(reservation["pid"])
+                }
+                yield state
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as f:
+                    json.dump(state, f)
+                os.replace(temp_path, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def calibration(self):
+        with self._state() as state:
+            return state["calibration"]
+
+    @property
+    def bytes_reserved(self):
+        with self._state() as state:
+            return sum(r["bytes"] for r in state["reservations"].values())
+
+    def _priority_job(self, state, now):
+        # The longest waiting job that is still waiting and has aged enough.
+        waiting = [
+            (waiter["first"], job_id)
+            for job_id, waiter in state["waiting"].items()
+            if now - waiter["seen"] <= ACTIVE_WAITER_SECONDS
+            and now - waiter["first"] >= self.priority_after_seconds
+        ]
+        return min(waiting)[1] if waiting else None
+
+    def reserve(self, token, estimated_bytes, job_id=None):
+        # Returns the calibrated reservation, or None if it doesn't fit yet.
+        # A job that is too big for the whole budget is still admitted when
+        # nothing else is running. job_id (the queue item) identifies the job
+        # across attempts, for aging.
+        now = time.time()
+        job_id = None if job_id is None else str(job_id)
+        with self._state() as state:
+            state["waiting"] = {
+                waiting_id: waiter
+                for waiting_id, waiter in state["waiting"].items()
+                if now - waiter["seen"] <= WAITER_EXPIRY_SECONDS
+            }
+            reserved = sum(r["bytes"] for r in state["reservations"].values())
+            predicted = int(estimated_bytes * state["calibration"])
+            fits = not reserved or reserved + predicted <= self.max_bytes
+            priority_job = self._priority_job(state, now)
+            if fits and priority_job in (None, job_id):
+                state["waiting"].pop(job_id, None)
+                state["reservations"][token] = {
+                    "pid": os.getpid(),
+                    "bytes": predicted,
+                }
+                return predicted
+            if job_id is not None:
+                waiter = state["waiting"].setdefault(job_id, {"first": now})
+                waiter["seen"] = now
+            return None
+
+    def release(self, token, predicted_bytes=None, actual_bytes=None, fresh=True):
+        with self._state() as state:
+            state["reservations"].pop(token, None)
+            if predicted_bytes and actual_bytes and actual_bytes > 0:
+                ratio = actual_bytes * state["calibration"] / predicted_bytes
+                calibration = (1 - self.smoothing) * state[
+                    "calibration"
+                ] + self.smoothing * ratio
+                minimum = MIN_CALIBRATION
+                if not fresh:
+                    minimum = min(1.0, state["calibration"])
+                state["calibration"] = round(
+                    min(max(calibration, minimum), MAX_CALIBRATION), 4
+                )
+                with open(os.path.join(self.directory, "calibration.jsonl"), "a") as f:
+                    f.write(
+                        json.dumps(
+                            {
+                                "time": time.time(),
+                                "pid": os.getpid(),
+                                "token": token,
+                                "predicted_bytes": predicted_bytes,
+                                "actual_bytes": actual_bytes,
+                                "fresh": fresh,
+                                "calibration": state["calibration"],
+                            }
+                        )
+                        + "\n"
+                    )
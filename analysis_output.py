@@ -0,0 +1,123 @@
+import gzip
+import importlib
+import io
+import json
+
+
+# {format: (key suffix, Content-Type, Content-Encoding)}. "json" is the
+# original analysis file; the row formats hold one row per detection.
+OUTPUT_FORMATS = {
+    "json": ("_data.json", "application/json", None),
+    "json.gz": ("_data.json.gz", "application/json", "gzip"),
+    "ndjson": ("_detections.ndjson", "application/x-ndjson", None),
+    "ndjson.gz": ("_detections.ndjson.gz", "application/x-ndjson", "gzip"),
+    "parquet": ("_detections.parquet", "application/vnd.apache.parquet", None),
+    "arrow": ("_detections.arrow", "application/vnd.apache.arrow.file", None),
+}
+
+# Job fields repeated on every row, so files can be scanned without a join.
+ROW_CONTEXT_FIELDS = [
+    "audio_id",
+    "audio_file_path",
+    "config_id",
+    "file_checksum",
+    "analyzer_version",
+]
+
+# Always present in the columnar formats, even when no detection has them.
+DETECTION_COLUMNS = [
+    "start_time",
+    "end_time",
+    "common_name",
+    "scientific_name",
+    "label",
+    "confidence",
+    "extracted_audio_url",
+    "extracted_spectrogram_url",
+]
+
+GZIP_LEVEL = 6
+
+# Optional modules the columnar formats are written with.
+FORMAT_MODULES = {"parquet": "pyarrow.parquet", "arrow": "pyarrow.ipc"}
+
+
+def check_output_formats(formats):
+    # Raises ValueError for a format that is unknown or can't be written here,
+    # so that a misconfigured runner fails at startup rather than after
+    # analyzing its first job.
+    for format in formats:
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown analysis output format {format}.")
+        if format in FORMAT_MODULES:
+            try:
+                importlib.import_module(FORMAT_MODULES[format])
+            except ImportError:
+                raise ValueError(
+                    f"Analysis output format {format} requires pyarrow "
+                    "(pip install pyarrow)."
+                )
+
+
+def return_detection_rows(data, audio_id, audio_file_path):
+    # Local extraction paths mean nothing once the runner has cleaned up.
+    context = {
+        "audio_id": audio_id,
+        "audio_file_path": audio_file_path,
+        "config_id": data["config_id"],
+        "file_checksum": data["file_checksum"],
+        "analyzer_version": data["analyzer_version"],
+    }
+    rows = []
+    for detection in data["detections"]:
+        row = dict(context)
+        row.update({k: v for k, v in detection.items() if not k.endswith("_path")})
+        rows.append(row)
+    return rows
+
+
+def _arrow_table(data, rows):
+    import pyarrow
+
+    columns = ROW_CONTEXT_FIELDS + DETECTION_COLUMNS
+    for row in rows:
+        columns += [column for column in row if column not in columns]
+    table = pyarrow.table(
+        {column: [row.get(column) for row in rows] for column in columns}
+    )
+    # Everything but the detections (durations, analyzer_config, ...) rides
+    # along in the schema metadata.
+    metadata = {k: v for k, v in data.items() if k != "detections"}
+    return table.replace_schema_metadata({"analysis": json.dumps(metadata)})
+
+
+def encode_analysis(data, format, audio_id=None, audio_file_path=None):
+    # Body of the analysis file in format, compressed if its Content-Encoding
+    # is gzip.
+    _, _, content_encoding = OUTPUT_FORMATS[format]
+    if format == "json":
+        return json.dumps(data).encode("utf-8")
+    if format == "json.gz":
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    elif format.startswith("ndjson"):
+        rows = return_detection_rows(data, audio_id, audio_file_path)
+        body = "".join(
+            json.dumps(row, separators=(",", ":")) + "\n" for row in rows
+        ).encode("utf-8")
+    else:
+        rows = return_detection_rows(data, audio_id, audio_file_path)
+        table = _arrow_table(data, rows)
+        buffer = io.BytesIO()
+        if format == "parquet":
+            import pyarrow.parquet
+
+            pyarrow.parquet.write_table(table, buffer, compression="zstd")
+        else:
+            import pyarrow.ipc
+
+            with pyarrow.ipc.new_file(buffer, table.schema) as writer:
+                writer.write_table(table)
+        body = buffer.getvalue()
+    if content_encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
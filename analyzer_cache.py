@@ -0,0 +1,105 @@
+import gc
+import os
+from collections import OrderedDict
+
+
+# The interpreter holds a copy of the model plus its tensor arena, so budget
+# roughly twice the model file size.
+INTERPRETER_OVERHEAD_FACTOR = 2
+
+
+def estimate_analyzer_bytes(analyzer):
+    size = 0
+    for path in (
+        getattr(analyzer, "model_path", None),
+        getattr(analyzer, "classifier_model_path", None),
+    ):
+        if path and os.path.exists(path):
+            size += os.path.getsize(path) * INTERPRETER_OVERHEAD_FACTOR
+    return size
+
+
+def release_analyzer(analyzer):
+    # Drop the TFLite interpreters so their memory is freed right away.
+    for attribute in ("interpreter", "custom_interpreter"):
+        if hasattr(analyzer, attribute):
+            setattr(analyzer, attribute, None)
+
+
+class AnalyzerCache:
+    # Least recently used Analyzers, bounded by entry count and estimated memory.
+
+    def __init__(
+        self, max_entries=4, max_bytes=None, estimate_bytes=estimate_analyzer_bytes
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.estimate_bytes = estimate_bytes
+        self._entries = OrderedDict()  # key: (analyzer, estimated bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        analyzer, _ = self._entries[key]
+        self._entries.move_to_end(key)
+        return analyzer
+
+    def __setitem__(self, key, analyzer):
+        if key in self._entries:
+            del self._entries[key]
+        self._entries[key] = (analyzer, self.estimate_bytes(analyzer))
+        self._evict(keep=key)
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def items(self):
+        return [(key, analyzer) for key, (analyzer, _) in self._entries.items()]
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    @property
+    def bytes_used(self):
+        return sum(size for _, size in self._entries.values())
+
+    def _over_budget(self):
+        if self.max_entries and len(self._entries) > self.max_entries:
+            return True
+        return bool(self.max_bytes) and self.bytes_used > self.max_bytes
+
+    def _evict(self, keep=None):
+        # Never evicts the entry just added, even if it alone exceeds the budget.
+        evicted = False
+        while self._over_budget():
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            analyzer, _ = self._entries.pop(key)
+            print("evict analyzer", key)
+            release_analyzer(analyzer)
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    @property
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+# Responses worth retrying; anything else is returned to the caller as is.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+def return_never_sent(e):
+    # Connect timeouts, refused connections and DNS failures happen before the
+    # request is sent, so retrying them can't repeat anything on the api. Other
+    # connection errors (a reset or dropped connection) may come after the api
+    # got the request.
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and not isinstance(
+        e, requests.exceptions.ReadTimeout
+    ):
+        reason = getattr(e.args[0] if e.args else None, "reason", None)
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def fibonacci(n):
+    a, b = 1, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+class ApiSession:
+    # Keep-alive connection pool for api calls, with timeouts and jittered
+    # fibonacci (or exponential) backoff for retryable failures.
+
+    def __init__(
+        self,
+        pool_maxsize=4,
+        connect_timeout=5,
+        read_timeout=60,
+        max_retries=5,
+        backoff="fibonacci",
+        backoff_base_seconds=1.0,
+        backoff_max_seconds=60,
+        sleep=time.sleep,
+    ):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.sleep = sleep
+        self.requests_sent = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def backoff_seconds(self, attempt):
+        if self.backoff == "exponential":
+            delay = self.backoff_base_seconds * 2**attempt
+        else:
+            delay = self.backoff_base_seconds * fibonacci(attempt)
+        delay = min(delay, self.backoff_max_seconds)
+        # Jitter so that a fleet of runners doesn't retry in lockstep.
+        return random.uniform(delay / 2, delay)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        # Failures to connect are always retried (nothing reached the api).
+        # Other connection errors, read timeouts and 5xx/429 responses are
+        # only retried when the call is idempotent.
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                self._count("requests_sent")
+                response = self.session.request(method, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                retryable = idempotent or return_never_sent(e)
+                if not retryable or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                print("ApiSession", method, url, e)
+            else:
+                if (
+                    not idempotent
+                    or response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    return response
+                print("ApiSession", method, url, response.status_code)
+                headers = getattr(response, "headers", None) or {}
+                if str(headers.get("Retry-After", "")).isdigit():
+                    retry_after = int(headers["Retry-After"])
+
+            attempt += 1
+            self._count("retries")
+            delay = self.backoff_seconds(attempt)
+            if retry_after is not None:
+                delay = min(max(delay, retry_after), self.backoff_max_seconds)
+            self.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @property
+    def connections_opened(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    @property
+    def stats(self):
+        connections_opened = self.connections_opened
+        return {
+            "requests": self.requests_sent,
+            "retries": self.retries,
+            "failures": self.failures,
+            "connections_opened": connections_opened,
+            "connections_reused": max(0, self.requests_sent - connections_opened),
+        }
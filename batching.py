@@ -0,0 +1,112 @@
+import operator
+
+import numpy as np
+from birdnetlib.analyzer import Detection
+
+
+# Chunks per interpreter invoke.
+DEFAULT_INFERENCE_BATCH_SIZE = 32
+
+
+def _invoke(interpreter, input_index, output_index, data):
+    # Only resize (and reallocate) when the batch shape changes; birdnetlib
+    # resizes on every call.
+    shape = list(data.shape)
+    if list(interpreter.get_input_details()[0]["shape"]) != shape:
+        interpreter.resize_tensor_input(input_index, shape)
+        interpreter.allocate_tensors()
+    interpreter.set_tensor(input_index, data)
+    interpreter.invoke()
+    return interpreter.get_tensor(output_index)
+
+
+def predict_logits(analyzer, samples):
+    # Batched equivalent of Analyzer.predict / predict_with_custom_classifier,
+    # without the sigmoid.
+    data = np.asarray(samples, dtype="float32")
+    if not analyzer.use_custom_classifier:
+        return _invoke(
+            analyzer.interpreter,
+            analyzer.input_layer_index,
+            analyzer.output_layer_index,
+            data,
+        )
+    input_size = analyzer.custom_interpreter.get_input_details()[0]["shape"][-1]
+    if input_size != data.shape[-1]:
+        data = np.asarray(analyzer._return_embeddings(data), dtype="float32")
+    return _invoke(
+        analyzer.custom_interpreter,
+        analyzer.custom_input_layer_index,
+        analyzer.custom_output_layer_index,
+        data,
+    )
+
+
+def detections_from_predictions(analyzer, recording, predictions):
+    # Same results as Analyzer.analyze_recording, built from one prediction row
+    # per chunk.
+    detection_list = []
+    start = 0
+    for prediction in predictions:
+        end = start + recording.sample_secs
+        scores = sorted(
+            zip(analyzer.labels, prediction), key=operator.itemgetter(1), reverse=True
+        )
+        for label, confidence in scores:
+            if confidence < recording.minimum_confidence:
+                break
+            detection = Detection(float(start), float(end))
+            detection.scientific_name = label.split("_")[0]
+            detection.common_name = label.split("_")[1]
+            detection.confidence = float(confidence)
+            detection.label = label
+            detection_list.append(detection)
+        start += recording.sample_secs - recording.overlap
+    return detection_list
+
+
+class BatchInference:
+    # Runs inference for several recordings that share an Analyzer, packing
+    # their chunks into batches of batch_size so the interpreter isn't invoked
+    # once per 3 second chunk. Each recording gets its own detections, as if it
+    # had been analyzed alone.
+
+    def __init__(self, analyzer, batch_size=DEFAULT_INFERENCE_BATCH_SIZE):
+        self.analyzer = analyzer
+        self.batch_size = max(1, int(batch_size))
+        self.chunks_analyzed = 0
+        self.batches = 0
+
+    def analyze(self, recordings):
+        for recording in recordings:
+            if recording.week_48 != -1:
+                recording.week_48 = max(1, min(recording.week_48, 48))
+            if recording.ndarray is None:
+                recording.read_audio_data()
+
+        # (recording index, chunk) for every chunk, in recording order.
+        pending = [
+            (index, chunk)
+            for index, recording in enumerate(recordings)
+            for chunk in recording.chunks
+        ]
+        logits = [[] for _ in recordings]
+        for offset in range(0, len(pending), self.batch_size):
+            batch = pending[offset : offset + self.batch_size]
+            output = predict_logits(self.analyzer, [chunk for _, chunk in batch])
+            for (index, _), row in zip(batch, output):
+                logits[index].append(row)
+            self.batches += 1
+            self.chunks_analyzed += len(batch)
+
+        for recording, rows in zip(recordings, logits):
+            predictions = [
+                self.analyzer.flat_sigmoid(
+                    np.array(row), sensitivity=-recording.sensitivity
+                )
+                for row in rows
+            ]
+            recording.detection_list = detections_from_predictions(
+                self.analyzer, recording, predictions
+            )
+            recording.analyzed = True
@@ -0,0 +1,350 @@
+# Local stand-ins for the audiospotter-api queue and for S3, served over HTTP
+# so that runners talk to them exactly as they talk to the real services.
+import gzip
+import hashlib
+import json
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+from birdnetlib.analyzer import Analyzer
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of simulated runners may connect at once.
+    request_queue_size = 1024
+
+
+class _Server:
+    # A ThreadingHTTPServer on an ephemeral port, run from a daemon thread.
+
+    def __init__(self, handler, host="127.0.0.1", port=0):
+        handler.service = self
+        self.server = _HTTPServer((host, port), handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class FakeQueueServer(_Server):
+    # The queue, heartbeat, results and shutdown endpoints of the
+    # audiospotter-api. Items can be given an arrival time; they can't be
+    # leased before it. Leases not completed or renewed within lease_seconds
+    # return to the queue. A lease request with wait_seconds is held open
+    # until an item can be leased.
+    # Every request and item transition is timestamped for reporting.
+
+    def __init__(self, lease_seconds=900, shutdown_when_drained=True, **kwargs):
+        super().__init__(_QueueHandler, **kwargs)
+        self.lease_seconds = lease_seconds
+        self.shutdown_when_drained = shutdown_when_drained
+        self.pending = []  # [(available_at, item)], in arrival order
+        self.leased = {}  # id: (leased_at, item)
+        self.expired = 0
+        self.results = {}
+        self.timestamps = {}  # id: {"available": t, "leased": t, "completed": t}
+        self.requests = []  # (time, endpoint)
+        self.shutdown_requests = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def enqueue(self, item, available_at=None):
+        available_at = time.time() if available_at is None else available_at
+        with self._lock:
+            self.pending.append((available_at, item))
+            self.pending.sort(key=lambda pending: pending[0])
+            self.timestamps[item["id"]] = {"available": available_at}
+            self._changed.notify_all()
+
+    @property
+    def drained(self):
+        with self._lock:
+            return not self.pending and not self.leased
+
+    def _record(self, endpoint):
+        self.requests.append((time.time(), endpoint))
+
+    def lease(self, count, wait_seconds=0):
+        deadline = time.time() + wait_seconds
+        with self._lock:
+            while True:
+                leased = self._lease(count)
+                now = time.time()
+                if leased or now >= deadline:
+                    break
+                wait = deadline - now
+                if self.pending:
+                    wait = min(wait, self.pending[0][0] - now)
+                self._changed.wait(wait)
+            drained = not self.pending and not self.leased
+        return leased, drained and self.shutdown_when_drained
+
+    def _lease(self, count):
+        now = time.time()
+        for audio_id, (leased_at, item) in list(self.leased.items()):
+            if now - leased_at > self.lease_seconds:
+                del self.leased[audio_id]
+                self.pending.insert(0, (leased_at, item))
+                self.expired += 1
+        leased = []
+        while self.pending and len(leased) < count and self.pending[0][0] <= now:
+            _, item = self.pending.pop(0)
+            self.leased[item["id"]] = (now, item)
+            self.timestamps[item["id"]]["leased"] = now
+            leased.append(item)
+        return leased
+
+    def renew(self, audio_id):
+        with self._lock:
+            if audio_id not in self.leased:
+                return False
+            self.leased[audio_id] = (time.time(), self.leased[audio_id][1])
+            return True
+
+    def release(self, audio_id):
+        with self._lock:
+            _, item = self.leased.pop(audio_id)
+            self.pending.insert(0, (time.time(), item))
+            self._changed.notify_all()
+
+    def complete(self, audio_id, result):
+        with self._lock:
+            self.leased.pop(audio_id, None)
+            self.results[audio_id] = result
+            self.timestamps[audio_id]["completed"] = time.time()
+
+
+class _QueueHandler(_Handler):
+    def do_POST(self):
+        queue = self.service
+        path = urlparse(self.path).path
+        data = json.loads(self._read_body() or b"{}")
+        status, response = 404, {}
+        if path.endswith("/queues/audio/"):
+            count = data.get("count", None)
+            leased, safe_to_shutdown = queue.lease(
+                count or 1, data.get("wait_seconds", 0)
+            )
+            queue._record("lease" if leased else "empty_lease")
+            status = 200
+            if count is None:
+                response = leased[0] if leased else {}
+            else:
+                response = {"items": leased, "lease_seconds": queue.lease_seconds}
+            if not leased:
+                response["safe_to_shutdown"] = safe_to_shutdown
+        elif path.endswith("/release/"):
+            queue._record("release")
+            queue.release(int(path.rstrip("/").split("/")[-2]))
+            status = 200
+        elif path.endswith("/heartbeat/"):
+            queue._record("heartbeat")
+            status = 200 if queue.renew(int(path.rstrip("/").split("/")[-2])) else 404
+        elif path.endswith("/queues/audio/results/"):
+            queue._record("results")
+            for result in data["results"]:
+                queue.complete(result["id"], result)
+            status, response = 201, {"count": len(data["results"])}
+        elif path.endswith("/results/"):
+            queue._record("results")
+            audio_id = int(path.rstrip("/").split("/")[-2])
+            queue.complete(audio_id, data)
+            status, response = 201, {"id": audio_id}
+        elif path.endswith("/shutdown-instance/"):
+            queue._record("shutdown")
+            queue.shutdown_requests.append((time.time(), data))
+            status = 200
+        body = json.dumps(response).encode("utf-8")
+        self._respond(status, body, {"Content-Type": "application/json"})
+
+
+class FakeS3Server(_Server):
+    # Enough of the S3 REST api (path-style) for boto3's get/head/put_object,
+    # ranged downloads, multipart and aws-chunked uploads.
+
+    def __init__(self, **kwargs):
+        super().__init__(_S3Handler, **kwargs)
+        self.objects = {}  # (bucket, key): bytes
+        self.uploads = {}  # upload id: {part number: bytes}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def put(self, bucket, key, body):
+        with self._lock:
+            self.objects[(bucket, key)] = body
+
+
+def _etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def _decode_aws_chunked(body):
+    # <hex size>[;chunk-signature=...]\r\n<data>\r\n ... 0\r\n<trailers>\r\n\r\n
+    decoded = []
+    position = 0
+    while True:
+        end = body.index(b"\r\n", position)
+        size = int(body[position:end].split(b";")[0], 16)
+        if size == 0:
+            return b"".join(decoded)
+        decoded.append(body[end + 2 : end + 2 + size])
+        position = end + 2 + size + 2
+
+
+class _S3Handler(_Handler):
+    def _object(self):
+        parsed = urlparse(self.path)
+        bucket, _, key = parsed.path.lstrip("/").partition("/")
+        return bucket, unquote(key), parse_qs(parsed.query, keep_blank_values=True)
+
+    def _error(self, status, code):
+        body = f"<Error><Code>{code}</Code></Error>".encode("utf-8")
+        self._respond(status, body, {"Content-Type": "application/xml"})
+
+    def _read_object_body(self):
+        body = self._read_body_raw()
+        encoding = self.headers.get("Content-Encoding", "")
+        content_sha256 = self.headers.get("x-amz-content-sha256", "")
+        if "aws-chunked" in encoding or content_sha256.startswith("STREAMING"):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def _read_body_raw(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        s3 = self.service
+        bucket, key, _ = self._object()
+        body = s3.objects.get((bucket, key))
+        if body is None:
+            self._error(404, "NoSuchKey")
+            return
+        headers = {
+            "ETag": _etag(body),
+            "Last-Modified": formatdate(usegmt=True),
+            "Content-Type": "binary/octet-stream",
+            "Accept-Ranges": "bytes",
+        }
+        status = 200
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            start, _, end = byte_range.split("=", 1)[1].partition("-")
+            start = int(start)
+            end = min(int(end) if end else len(body) - 1, len(body) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            body = body[start : end + 1]
+            status = 206
+        if self.command == "GET":
+            s3.bytes_out += len(body)
+            self._respond(status, body, headers)
+        else:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+
+    def do_PUT(self):
+        s3 = self.service
+        bucket, key, query = self._object()
+        body = self._read_object_body()
+        s3.bytes_in += len(body)
+        if "uploadId" in query:
+            with s3._lock:
+                s3.uploads[query["uploadId"][0]][int(query["partNumber"][0])] = body
+        else:
+            s3.put(bucket, key, body)
+        self._respond(200, b"", {"ETag": _etag(body)})
+
+    def do_POST(self):
+        s3 = self.service
+        bucket, key, query = self._object()
+        self._read_body_raw()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            s3.uploads[upload_id] = {}
+            body = (
+                "<InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+        elif "uploadId" in query:
+            parts = s3.uploads.pop(query["uploadId"][0])
+            data = b"".join(parts[number] for number in sorted(parts))
+            s3.put(bucket, key, data)
+            body = (
+                "<CompleteMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<ETag>{_etag(data)}</ETag>"
+                "</CompleteMultipartUploadResult>"
+            )
+        else:
+            self._error(400, "InvalidRequest")
+            return
+        self._respond(200, body.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        bucket, key, _ = self._object()
+        self.service.objects.pop((bucket, key), None)
+        self._respond(204)
+
+
+class SimulatedAnalyzer(Analyzer):
+    # Stands in for BirdNET: each 3 second chunk takes seconds_per_chunk, and
+    # its confidence is the loudest sample in it.
+
+    def __init__(self, seconds_per_chunk=0.0):
+        self.labels = ["Turdus migratorius_American Robin", "Noise_Noise"]
+        self.custom_species_list = []
+        self.has_custom_species_list = False
+        self.use_custom_classifier = False
+        self.classifier_model_path = None
+        self.version = "simulated"
+        self.seconds_per_chunk = seconds_per_chunk
+
+    def predict(self, sample, sensitivity=1.0):
+        if self.seconds_per_chunk:
+            time.sleep(self.seconds_per_chunk)
+        loudest = min(1.0, float(np.max(np.abs(sample))))
+        return [[loudest, 1.0 - loudest]]
@@ -0,0 +1,463 @@
+# Simulates a fleet of instances, each running several runners, against the
+# local api stand-in: real Remote queue polling, result posts and shutdown
+# decisions, with every S3 transfer and inference replaced by a sleep. Reports
+# the api request rate, how long items wait in the queue, how much of the
+# fleet's time is spent idle and how long instances keep running after the
+# queue has drained.
+#
+#   python -m benchmarks.fleet_simulator --instances 50 --runners 4 --jobs 2000
+#   python -m benchmarks.fleet_simulator --arrival poisson --arrival-seconds 3600 \
+#       --mode standalone --time-scale 0.01 --set empty_queue_min_sleep_seconds=1
+#
+# All durations are given and reported in simulated seconds; --time-scale
+# sets how many real seconds one of them takes. Only the api's own latency
+# isn't scaled, so very small scales overstate the cost of each request.
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from remote import Remote
+from supervisor import IDLE_REPORT_WINDOW_SECONDS, ShutdownCoordinator, Supervisor
+
+from .fakes import FakeQueueServer
+from .throughput_benchmark import (
+    RESULTS_DIRECTORY,
+    parse_option,
+    percentiles,
+    queue_item,
+    return_commit,
+)
+
+
+ARRIVAL_PATTERNS = ("burst", "uniform", "poisson", "waves")
+
+
+class PoweredOff(Exception):
+    pass
+
+
+class _SimulatedRecording:
+    def __init__(self, duration):
+        self.duration = duration
+        self.detections = []
+
+
+class SimulatedRemote(Remote):
+    # A Remote whose download, inference and uploads only wait, so that
+    # hundreds of them fit in one process. Everything that talks to the api
+    # is the real thing. Waits end early if the instance powers off, in which
+    # case the job is lost until its lease expires.
+
+    def __init__(
+        self, instance, job_seconds, download_seconds, upload_seconds, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.instance = instance
+        self.job_seconds = job_seconds
+        self.download_seconds = download_seconds
+        self.upload_seconds = upload_seconds
+        self.analyzer = SimpleNamespace(version="simulated")
+        self.busy_seconds = 0.0
+        self.jobs_lost = 0
+
+    def _wait(self, seconds):
+        if self.instance.powered_off.wait(seconds * self.instance.time_scale):
+            raise PoweredOff()
+
+    def _retrieve_file(self):
+        self._wait(self.download_seconds)
+        self.file_checksum = "simulated"
+
+    def _analyze_file(self):
+        self.recording = _SimulatedRecording(self.queued_audio_dict["duration"])
+        self._wait(self.job_seconds(self.queued_audio_dict["id"]))
+
+    def _extract_detections(self):
+        pass
+
+    def _upload_extractions(self):
+        self._wait(self.upload_seconds)
+
+    def _upload_json(self):
+        pass
+
+    def _save_results_to_server(self):
+        if self.instance.powered_off.is_set():
+            raise PoweredOff()
+        return super()._save_results_to_server()
+
+    def _shutdown(self):
+        self._notify_shutdown()
+        self.instance.power_off()
+
+    def process(self):
+        start = time.time()
+        super().process()
+        if self.queued_audio_dict:
+            self.busy_seconds += time.time() - start
+            if self.instance.powered_off.is_set():
+                self.jobs_lost += 1
+
+
+class SimulatedInstance:
+    # One instance's runners, as threads. In "supervisor" mode the runners
+    # report idle to a Supervisor's shared array and the instance powers off
+    # once all of them are idle, as supervisor.py does; in "standalone" mode
+    # each runner is its own runner.py and the first to see safe_to_shutdown
+    # powers the instance off.
+
+    def __init__(
+        self,
+        index,
+        runner_count,
+        mode,
+        time_scale,
+        create_remote,
+        idle_report_window_seconds=IDLE_REPORT_WINDOW_SECONDS,
+    ):
+        self.index = index
+        self.mode = mode
+        self.time_scale = time_scale
+        self.powered_off = threading.Event()
+        self.started_at = None
+        self.powered_off_at = None
+        self.supervisor = None
+        coordinators = [None] * runner_count
+        if mode == "supervisor":
+            self.supervisor = Supervisor(
+                runner_count,
+                None,
+                idle_report_window_seconds=idle_report_window_seconds * time_scale,
+            )
+            coordinators = [
+                ShutdownCoordinator(self.supervisor.idle_since, runner_index)
+                for runner_index in range(runner_count)
+            ]
+        self.remotes = [
+            create_remote(
+                self,
+                pid=index * 1000 + runner_index,
+                processor_id=f"i-simulated-{index}",
+                runner_count=runner_count,
+                shutdown_on_empty_processing_queue=True,
+                shutdown_coordinator=coordinators[runner_index],
+            )
+            for runner_index in range(runner_count)
+        ]
+        self._threads = [
+            threading.Thread(target=remote.run_queue, daemon=True)
+            for remote in self.remotes
+        ]
+
+    def start(self):
+        self.started_at = time.time()
+        for thread in self._threads:
+            thread.start()
+        if self.supervisor:
+            threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _supervise(self):
+        while not self.powered_off.wait(self.time_scale):
+            if self.supervisor.all_workers_idle():
+                for remote in self.remotes:
+                    remote.stop()
+                for thread in self._threads:
+                    thread.join()
+                self.remotes[0]._shutdown()
+                return
+
+    def power_off(self):
+        if self.powered_off.is_set():
+            return
+        self.powered_off_at = time.time()
+        self.powered_off.set()
+        for remote in self.remotes:
+            remote.stop()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def return_arrival_offsets(pattern, jobs, seconds, waves=4, seed=0):
+    # Seconds after the start at which each job is queued.
+    rng = np.random.default_rng(seed)
+    if pattern == "burst" or not seconds:
+        return [0.0] * jobs
+    if pattern == "uniform":
+        return list(np.linspace(0, seconds, jobs, endpoint=False))
+    if pattern == "poisson":
+        gaps = rng.exponential(seconds / jobs, jobs)
+        return list(np.cumsum(gaps) - gaps[0])
+    if pattern == "waves":
+        starts = np.linspace(0, seconds, waves, endpoint=False)
+        return [float(starts[job % waves]) for job in range(jobs)]
+    raise ValueError(f"Unknown arrival pattern {pattern}.")
+
+
+def summarize(queue, instances, started, finished, time_scale):
+    # Every time is reported in simulated seconds from the start.
+    def simulated(t):
+        return (t - started) / time_scale
+
+    timestamps = queue.timestamps.values()
+    completed = [t["completed"] for t in timestamps if "completed" in t]
+    drained_at = max(completed) if len(completed) == len(queue.timestamps) else None
+    elapsed = simulated(finished)
+
+    endpoints = {}
+    per_second = {}
+    for t, endpoint in queue.requests:
+        endpoints[endpoint] = endpoints.get(endpoint, 0) + 1
+        second = int(simulated(t))
+        per_second[second] = per_second.get(second, 0) + 1
+
+    remotes = [remote for instance in instances for remote in instance.remotes]
+    runner_seconds = sum(
+        simulated(instance.powered_off_at or finished) * len(instance.remotes)
+        for instance in instances
+    )
+    busy_seconds = sum(remote.busy_seconds for remote in remotes) / time_scale
+
+    after_drain = []
+    for instance in instances:
+        if drained_at is None:
+            break
+        stopped_at = instance.powered_off_at or finished
+        after_drain.append(max(0.0, (stopped_at - drained_at) / time_scale))
+
+    return {
+        "jobs": len(queue.timestamps),
+        "jobs_completed": len(queue.results),
+        "jobs_lost": sum(remote.jobs_lost for remote in remotes),
+        "leases_expired": queue.expired,
+        "elapsed_seconds": round(elapsed, 2),
+        "drained_at_seconds": round(simulated(drained_at), 2) if drained_at else None,
+        "api_requests": len(queue.requests),
+        "api_requests_per_second": round(len(queue.requests) / elapsed, 2)
+        if elapsed
+        else 0,
+        "api_requests_peak_per_second": max(per_second.values(), default=0),
+        "api_requests_by_endpoint": endpoints,
+        "queue_wait_seconds": percentiles(
+            [
+                (t["leased"] - t["available"]) / time_scale
+                for t in timestamps
+                if "leased" in t
+            ]
+        ),
+        "idle_fraction": round(1 - busy_seconds / runner_seconds, 4)
+        if runner_seconds
+        else 0,
+        "idle_runner_seconds": round(runner_seconds - busy_seconds, 1),
+        "instances_running_at_end": sum(
+            1 for instance in instances if instance.powered_off_at is None
+        ),
+        "seconds_after_drain": percentiles(after_drain),
+        "instance_seconds_after_drain": round(sum(after_drain), 1),
+    }
+
+
+def print_report(summary):
+    print(
+        f"{summary['jobs_completed']}/{summary['jobs']} jobs in "
+        f"{summary['elapsed_seconds']}s, queue drained at "
+        f"{summary['drained_at_seconds']}s"
+    )
+    if summary["jobs_lost"] or summary["leases_expired"]:
+        print(
+            f"{summary['jobs_lost']} jobs lost to power off, "
+            f"{summary['leases_expired']} leases expired"
+        )
+    print(
+        f"api: {summary['api_requests']} requests, "
+        f"{summary['api_requests_per_second']}/s mean, "
+        f"{summary['api_requests_peak_per_second']}/s peak"
+    )
+    for endpoint, count in sorted(summary["api_requests_by_endpoint"].items()):
+        print(f"  {endpoint:<16}{count:>9}")
+    print(f"{'':<24}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for name in ("queue_wait_seconds", "seconds_after_drain"):
+        values = summary[name]
+        if values:
+            print(
+                f"{name:<24}"
+                + "".join(f"{values[p]:>9.1f}" for p in ("p50", "p90", "p99", "max"))
+            )
+    print(
+        f"idle: {summary['idle_fraction']:.1%} of runner time, "
+        f"{summary['instance_seconds_after_drain']} instance seconds after drain, "
+        f"{summary['instances_running_at_end']} instances never shut down"
+    )
+
+
+def simulate(
+    instances=10,
+    runners=4,
+    jobs=200,
+    arrival="burst",
+    arrival_seconds=0,
+    waves=4,
+    job_seconds=60,
+    job_sigma=0.5,
+    download_seconds=2,
+    upload_seconds=2,
+    recording_seconds=600,
+    mode="supervisor",
+    time_scale=0.05,
+    max_seconds=None,
+    idle_report_window_seconds=IDLE_REPORT_WINDOW_SECONDS,
+    remote_options=None,
+    seed=0,
+):
+    rng = np.random.default_rng(seed)
+    # Lognormal inference times with the given median, drawn per job.
+    durations = job_seconds * np.exp(rng.normal(0, job_sigma, jobs))
+    remote_options = dict(
+        {"sleep_secs_on_empty_queue": 3, "api_max_retries": 1}, **(remote_options or {})
+    )
+    for option in (
+        "sleep_secs_on_empty_queue",
+        "empty_queue_min_sleep_seconds",
+        "long_poll_seconds",
+    ):
+        if remote_options.get(option):
+            remote_options[option] *= time_scale
+    queue = FakeQueueServer(lease_seconds=900 * time_scale).start()
+
+    def create_remote(instance, **kwargs):
+        return SimulatedRemote(
+            instance,
+            lambda audio_id: durations[audio_id - 1],
+            download_seconds,
+            upload_seconds,
+            api_endpoint=queue.url,
+            api_key="simulation",
+            **dict(remote_options, **kwargs),
+        )
+
+    fleet = [
+        SimulatedInstance(
+            index,
+            runners,
+            mode,
+            time_scale,
+            create_remote,
+            idle_report_window_seconds=idle_report_window_seconds,
+        )
+        for index in range(instances)
+    ]
+    started = time.time()
+    offsets = return_arrival_offsets(arrival, jobs, arrival_seconds, waves, seed)
+    for audio_id, offset in enumerate(offsets, start=1):
+        item = queue_item(audio_id, f"SIMULATED/{audio_id}.wav")
+        item["duration"] = recording_seconds
+        queue.enqueue(item, started + offset * time_scale)
+    for instance in fleet:
+        instance.start()
+
+    if max_seconds is None:
+        # Four times the work spread evenly over the fleet, plus an hour.
+        job_total_seconds = job_seconds + download_seconds + upload_seconds
+        max_seconds = arrival_seconds + 3600
+        max_seconds += jobs * job_total_seconds * 4 / (instances * runners)
+    deadline = started + max_seconds * time_scale
+    while time.time() < deadline:
+        if all(instance.powered_off.is_set() for instance in fleet):
+            break
+        time.sleep(0.05)
+    finished = time.time()
+    for instance in fleet:
+        for remote in instance.remotes:
+            remote.stop()
+    for instance in fleet:
+        instance.join(timeout=5)
+    queue.close()
+    return summarize(queue, fleet, started, finished, time_scale)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--runners", type=int, default=4, help="per instance")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--arrival", choices=ARRIVAL_PATTERNS, default="burst")
+    parser.add_argument(
+        "--arrival-seconds",
+        type=float,
+        default=0,
+        help="period the jobs arrive over (uniform, poisson and waves)",
+    )
+    parser.add_argument("--waves", type=int, default=4)
+    parser.add_argument(
+        "--job-seconds", type=float, default=60, help="median inference time"
+    )
+    parser.add_argument("--job-sigma", type=float, default=0.5)
+    parser.add_argument("--download-seconds", type=float, default=2)
+    parser.add_argument("--upload-seconds", type=float, default=2)
+    parser.add_argument(
+        "--mode",
+        choices=("supervisor", "standalone"),
+        default="supervisor",
+        help="how instances decide to shut down",
+    )
+    parser.add_argument(
+        "--idle-report-window-seconds", type=float, default=IDLE_REPORT_WINDOW_SECONDS
+    )
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument(
+        "--max-seconds", type=float, help="simulated seconds before giving up"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="OPTION=VALUE",
+        help="Remote keyword argument, e.g. --set sleep_secs_on_empty_queue=10",
+    )
+    parser.add_argument("--output", default=RESULTS_DIRECTORY)
+    args = parser.parse_args()
+
+    config = {
+        "instances": args.instances,
+        "runners": args.runners,
+        "jobs": args.jobs,
+        "arrival": args.arrival,
+        "arrival_seconds": args.arrival_seconds,
+        "waves": args.waves,
+        "job_seconds": args.job_seconds,
+        "job_sigma": args.job_sigma,
+        "download_seconds": args.download_seconds,
+        "upload_seconds": args.upload_seconds,
+        "mode": args.mode,
+        "time_scale": args.time_scale,
+        "max_seconds": args.max_seconds,
+        "idle_report_window_seconds": args.idle_report_window_seconds,
+        "remote_options": dict(parse_option(option) for option in args.set),
+    }
+    print(
+        f"{args.instances} instances x {args.runners} runners, {args.jobs} jobs "
+        f"({args.arrival}), {args.mode}"
+    )
+    # Runners print every poll; keep the report readable.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        summary = simulate(**config)
+    print_report(summary)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(
+        args.output, f"fleet-{time.strftime('%Y%m%d-%H%M%S')}-{return_commit()}.json"
+    )
+    with open(path, "w") as f:
+        json.dump({"config": config, "summary": summary}, f, indent=2)
+    print("saved", path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Renders the spectrograms of a dense synthetic recording (a detection in every
+# 3 second chunk) with birdnetlib's matplotlib figure and with the STFT engine.
+#
+#   python -m benchmarks.spectrogram_benchmark --seconds 600
+import argparse
+import time
+
+import numpy as np
+
+from extraction import plan_spectrograms
+from spectrogram import SpectrogramEngine
+
+
+class DenseRecording:
+    def __init__(self, seconds):
+        rng = np.random.default_rng(0)
+        samples = int(seconds * 48000)
+        self.ndarray = (rng.standard_normal(samples) / 20).astype("float32")
+        # A rising chirp in every chunk.
+        t = np.arange(48000) / 48000
+        chirp = np.sin(2 * np.pi * (2000 + 3000 * t) * t).astype("float32") / 2
+        for start in range(0, samples - 48000 * 2, 48000 * 3):
+            self.ndarray[start + 48000 : start + 96000] += chirp
+        self.duration = seconds
+        self.filestem = "dense"
+        self.filename = "dense.wav"
+        self.detections = [
+            {"start_time": float(s), "end_time": float(s + 3), "confidence": 0.9}
+            for s in range(0, int(seconds) - 2, 3)
+        ]
+
+    def get_extract_array(self, start_sec, end_sec):
+        return self.ndarray[int(start_sec * 48000) : int(end_sec * 48000)]
+
+
+def time_renders(artifacts):
+    start = time.perf_counter()
+    total_bytes = sum(len(artifact.render()) for artifact in artifacts)
+    return time.perf_counter() - start, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=600)
+    parser.add_argument(
+        "--matplotlib-limit",
+        type=int,
+        default=50,
+        help="render only this many matplotlib images and extrapolate",
+    )
+    args = parser.parse_args()
+
+    recording = DenseRecording(args.seconds)
+    count = len(recording.detections)
+    print(f"{args.seconds:.0f}s recording, {count} spectrograms")
+
+    artifacts = plan_spectrograms(recording)[: args.matplotlib_limit]
+    seconds, total_bytes = time_renders(artifacts)
+    matplotlib_seconds = seconds / len(artifacts) * count
+    print(
+        f"matplotlib: {seconds / len(artifacts) * 1000:.1f}ms per image, "
+        f"{matplotlib_seconds:.2f}s per recording, "
+        f"{total_bytes / len(artifacts) / 1024:.0f}KiB per image"
+    )
+
+    engine = SpectrogramEngine(recording)
+    seconds, total_bytes = time_renders(plan_spectrograms(recording, engine=engine))
+    print(
+        f"stft:       {seconds / count * 1000:.1f}ms per image, "
+        f"{seconds:.2f}s per recording, "
+        f"{total_bytes / count / 1024:.0f}KiB per image, "
+        f"{engine.tiles_computed} tiles"
+    )
+    print(f"speedup:    {matplotlib_seconds / seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# Runs a fixed workload through real runners (Remote.run_queue, one forked
+# process per runner) against local stand-ins for the api and S3, and reports
+# jobs/hour, per-stage latency percentiles and peak RSS. Results are saved as
+# json so runs can be compared between commits.
+#
+#   python -m benchmarks.throughput_benchmark --jobs 40 --runners 2
+#   python -m benchmarks.throughput_benchmark --corpus ~/recordings \
+#       --analyzer birdnet --set pipeline_depth=1 --compare previous.json
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import soundfile
+
+from remote import Remote, return_analyzer_model_key
+
+from .fakes import FakeQueueServer, FakeS3Server, SimulatedAnalyzer
+
+
+SOURCE_BUCKET = "benchmark-audio"
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+ANALYZER_CONFIG = {
+    "id": 1,
+    "analyzer": {},
+    "minimum_detection_confidence": 0.25,
+    "minimum_detection_clip_confidence": 0.5,
+    "extraction_audio_file_destination": {"s3_bucket": "benchmark-clips"},
+    "extraction_spectrogram_file_destination": {"s3_bucket": "benchmark-spectrograms"},
+    "analysis_json_file_destination": {"s3_bucket": "benchmark-json"},
+}
+
+
+class StopWhenIdle:
+    # Shutdown coordinator that stops the runner instead of the instance once
+    # the api reports the queue is done.
+
+    def __init__(self):
+        self.remote = None
+
+    def report_busy(self):
+        pass
+
+    def report_idle(self):
+        self.remote.stop()
+
+
+def synthetic_recording(seconds, seed, calls_per_minute=10):
+    # Low noise with bird-like chirps at random times, as 16 bit wav.
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 0.01, int(seconds * 48000)).astype("float32")
+    t = np.arange(int(0.8 * 48000)) / 48000
+    chirp = np.sin(2 * np.pi * (3000 + 2000 * t) * t).astype("float32")
+    for _ in range(int(seconds / 60 * calls_per_minute)):
+        start = rng.integers(0, len(audio) - len(chirp))
+        audio[start : start + len(chirp)] += chirp * rng.uniform(0.2, 0.9)
+    buffer = tempfile.SpooledTemporaryFile()
+    soundfile.write(buffer, np.clip(audio, -1, 1), 48000, format="WAV")
+    buffer.seek(0)
+    return buffer.read()
+
+
+def build_corpus(s3, durations, corpus_directory=None):
+    # Uploads the recordings to the S3 stand-in; returns their keys.
+    keys = []
+    for index, seconds in enumerate(durations):
+        key = f"BENCHMARK/SYNTHETIC/synthetic_{index}_{seconds:g}s.wav"
+        s3.put(SOURCE_BUCKET, key, synthetic_recording(seconds, seed=index))
+        keys.append(key)
+    if corpus_directory:
+        for path in sorted(glob.glob(os.path.join(corpus_directory, "*"))):
+            key = f"BENCHMARK/CORPUS/{os.path.basename(path)}"
+            with open(path, "rb") as f:
+                s3.put(SOURCE_BUCKET, key, f.read())
+            keys.append(key)
+    return keys
+
+
+def queue_item(audio_id, key):
+    return {
+        "id": audio_id,
+        "audio": {"file_path": key, "file_source": {"s3_bucket": SOURCE_BUCKET}},
+        "group": {"analyzer_config": ANALYZER_CONFIG},
+    }
+
+
+def run_runner(index, api_url, s3_url, analyzer, remote_options):
+    # Runs in a forked child, like a supervisor worker.
+    coordinator = StopWhenIdle()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        options = dict(
+            api_endpoint=api_url,
+            api_key="benchmark",
+            pid=os.getpid(),
+            processor_id="benchmark",
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+            s3_endpoint_url=s3_url,
+            audio_directory=temp_dir,
+            extraction_audio_directory=temp_dir,
+            extraction_spectrogram_directory=temp_dir,
+            sleep_secs_on_empty_queue=0.5,
+            shutdown_on_empty_processing_queue=True,
+            shutdown_coordinator=coordinator,
+            preloaded_analyzers={return_analyzer_model_key(ANALYZER_CONFIG): analyzer},
+        )
+        options.update(remote_options)
+        remote = Remote(**options)
+        coordinator.remote = remote
+        remote.run_queue()
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.array(values)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4),
+        "mean": round(float(values.mean()), 4),
+    }
+
+
+def summarize(queue, started, finished, peak_rss_bytes):
+    results = queue.results
+    stages = {}
+    for result in results.values():
+        for stage, values in result.get("stage_metrics", {}).items():
+            stages.setdefault(stage, []).append(values["seconds"])
+    timestamps = [t for t in queue.timestamps.values() if "completed" in t]
+    elapsed = finished - started
+    return {
+        "jobs_completed": len(results),
+        "jobs_failed": len(queue.timestamps) - len(results),
+        "elapsed_seconds": round(elapsed, 2),
+        "jobs_per_hour": round(len(results) / elapsed * 3600, 1) if elapsed else 0,
+        "audio_hours_per_hour": round(
+            sum(r.get("duration_seconds", 0) for r in results.values()) / elapsed, 2
+        )
+        if elapsed
+        else 0,
+        "job_seconds": percentiles([t["completed"] - t["leased"] for t in timestamps]),
+        "queue_wait_seconds": percentiles(
+            [t["leased"] - t["available"] for t in timestamps]
+        ),
+        "stage_seconds": {stage: percentiles(v) for stage, v in stages.items()},
+        "peak_rss_bytes": peak_rss_bytes,
+        "api_requests": len(queue.requests),
+    }
+
+
+def return_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report, previous=None):
+    summary = report["summary"]
+    print(
+        f"{summary['jobs_completed']} jobs in {summary['elapsed_seconds']}s: "
+        f"{summary['jobs_per_hour']} jobs/hour, "
+        f"{summary['audio_hours_per_hour']} audio hours/hour, "
+        f"peak RSS {summary['peak_rss_bytes'] / 2**20:.0f}MiB"
+    )
+    if summary["jobs_failed"]:
+        print(f"{summary['jobs_failed']} jobs did not complete")
+    print(f"{'stage':<24}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for stage, values in summary["stage_seconds"].items():
+        line = f"{stage:<24}" + "".join(
+            f"{values[p]:>9.3f}" for p in ("p50", "p90", "p99", "max")
+        )
+        if previous:
+            before = previous["summary"]["stage_seconds"].get(stage, {}).get("p50")
+            if before:
+                line += f"   p50 {(values['p50'] - before) / before:+.0%}"
+        print(line)
+    if previous:
+        before = previous["summary"]["jobs_per_hour"]
+        if before:
+            change = (summary["jobs_per_hour"] - before) / before
+            print(f"jobs/hour vs {previous['commit']}: {change:+.1%}")
+
+
+def parse_option(option):
+    key, _, value = option.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--runners", type=int, default=1)
+    parser.add_argument(
+        "--durations",
+        default="60,300",
+        help="comma separated lengths in seconds of the synthetic recordings",
+    )
+    parser.add_argument("--corpus", help="directory of real recordings to add")
+    parser.add_argument(
+        "--analyzer",
+        choices=("simulated", "birdnet"),
+        default="simulated",
+        help="birdnet loads the real model once, before the runners fork",
+    )
+    parser.add_argument(
+        "--seconds-per-chunk",
+        type=float,
+        default=0.01,
+        help="inference time per 3 second chunk of the simulated analyzer",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="OPTION=VALUE",
+        help="Remote keyword argument, e.g. --set pipeline_depth=1",
+    )
+    parser.add_argument("--output", default=RESULTS_DIRECTORY)
+    parser.add_argument("--compare", help="a previously saved result to compare with")
+    args = parser.parse_args()
+
+    durations = [float(d) for d in args.durations.split(",") if d]
+    remote_options = dict(parse_option(option) for option in args.set)
+    if args.analyzer == "birdnet":
+        from birdnetlib.analyzer import Analyzer
+
+        analyzer = Analyzer()
+    else:
+        analyzer = SimulatedAnalyzer(args.seconds_per_chunk)
+
+    queue = FakeQueueServer().start()
+    s3 = FakeS3Server().start()
+    keys = build_corpus(s3, durations, args.corpus)
+    print(f"{len(keys)} recordings, {args.jobs} jobs, {args.runners} runners")
+
+    started = time.time()
+    for audio_id in range(1, args.jobs + 1):
+        queue.enqueue(queue_item(audio_id, keys[(audio_id - 1) % len(keys)]), started)
+    context = multiprocessing.get_context("fork")
+    runners = [
+        context.Process(
+            target=run_runner,
+            args=(index, queue.url, s3.url, analyzer, remote_options),
+        )
+        for index in range(args.runners)
+    ]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    completed = [t["completed"] for t in queue.timestamps.values() if "completed" in t]
+    finished = max(completed) if completed else time.time()
+    # ru_maxrss is in KiB on Linux: the largest runner's peak.
+    peak_rss_bytes = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    queue.close()
+    s3.close()
+
+    commit = return_commit()
+    report = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "jobs": args.jobs,
+            "runners": args.runners,
+            "durations": durations,
+            "corpus": args.corpus,
+            "analyzer": args.analyzer,
+            "seconds_per_chunk": args.seconds_per_chunk,
+            "remote_options": remote_options,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "summary": summarize(queue, started, finished, peak_rss_bytes),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(report, previous)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print("saved", path)
+
+
+if __name__ == "__main__":
+    main()
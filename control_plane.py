@@ -0,0 +1,223 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import new_job, remove_job_directories
+
+
+# Renew leases this many times per lease, so one failed renewal isn't fatal.
+HEARTBEATS_PER_LEASE = 3
+
+
+def return_io_workers(max_jobs):
+    # A lease poll, and a blocking call (download, upload, heartbeat) for each
+    # job and each job's heartbeat, with one to spare.
+    return 2 * max(1, int(max_jobs)) + 2
+
+
+class ControlPlane:
+    # Runs a Remote's jobs from an asyncio event loop. The loop polls the
+    # queue, renews the lease of every job in flight and moves each job
+    # through its downloads, uploads and results POST, while inference and
+    # extraction run one job at a time in their own executor. The api and S3
+    # clients are blocking, so their calls run in a thread pool and the loop
+    # only waits on them; up to max_jobs jobs are in flight at once.
+    #
+    #   async with ControlPlane(remote) as plane:
+    #       job = await plane.submit(item)
+    #
+    # run() is the queue loop used by Remote.run_queue.
+
+    def __init__(self, remote, max_jobs=2, heartbeat_seconds=None):
+        self.remote = remote
+        self.max_jobs = max(1, int(max_jobs))
+        # None renews HEARTBEATS_PER_LEASE times per lease.
+        self.heartbeat_seconds = heartbeat_seconds
+        self.jobs = set()
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.heartbeats = 0
+        self.heartbeat_failures = 0
+        self.loop = None
+        self._stop = None
+        self._stop_requested = False
+        self._io_executor = None
+        self._compute_executor = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+        self._io_executor = ThreadPoolExecutor(
+            max_workers=return_io_workers(self.max_jobs),
+            thread_name_prefix="control-plane-io",
+        )
+        self._compute_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="control-plane-inference"
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Jobs in flight are finished, not abandoned.
+        if self.jobs:
+            await asyncio.wait(self.jobs)
+        self._io_executor.shutdown()
+        self._compute_executor.shutdown()
+
+    def stop(self):
+        # Safe to call from any thread (or a signal handler).
+        self._stop_requested = True
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop.set)
+
+    def _io(self, function, *args):
+        return self.loop.run_in_executor(self._io_executor, function, *args)
+
+    def _compute(self, function, *args):
+        return self.loop.run_in_executor(self._compute_executor, function, *args)
+
+    async def _sleep(self, seconds):
+        # Returns early on stop().
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def lease_heartbeat_seconds(self):
+        if self.heartbeat_seconds:
+            return self.heartbeat_seconds
+        return self.remote.lease_queue.lease_seconds / HEARTBEATS_PER_LEASE
+
+    def submit(self, item, lease_start=None):
+        # Starts work on a leased queue item. The returned task resolves to the
+        # finished per-job copy of the Remote, or None if the item was handed
+        # back; it raises if the job failed.
+        job = new_job(self.remote, item)
+        job.start_time = time.time()
+        if lease_start is not None:
+            job.stage_metrics.add("lease", time.monotonic() - lease_start, items=1)
+        task = asyncio.ensure_future(self._run_job(job))
+        self.jobs.add(task)
+        task.add_done_callback(self.jobs.discard)
+        return task
+
+    async def _heartbeat(self, item):
+        while True:
+            await asyncio.sleep(self.lease_heartbeat_seconds)
+            start = time.monotonic()
+            try:
+                await self._io(self.remote._renew_lease, item)
+                self.heartbeats += 1
+            except Exception as e:
+                # The next heartbeat may still make it before the lease runs out.
+                print("lease heartbeat", item["id"], e)
+                self.heartbeat_failures += 1
+            self.remote.metrics.add("lease_renewal", time.monotonic() - start, items=1)
+
+    def _analyze(self, job):
+        # Runs in the inference executor, so the analyzer cache and the
+        # model are only used by one job at a time.
+        start = time.monotonic()
+        job._analyzers_init_count = self.remote._analyzers_init_count
+        job._analyze_file()
+        self.remote._analyzers_init_count = job._analyzers_init_count
+        self.remote.analyzer = job.analyzer
+        job._extract_detections()
+        # Keep the decoded audio only for extractions still to be rendered.
+        if not job.extraction_artifacts:
+            job.recording.ndarray = None
+        job.recording.chunks = []
+        self.remote.lease_queue.record_job(time.monotonic() - start)
+
+    async def _run_job(self, job):
+        heartbeat = asyncio.ensure_future(self._heartbeat(job.queued_audio_dict))
+        try:
+            cached = await self._io(job._lookup_cached_result, True)
+            if not cached:
+                if not await self._io(job._admit_job):
+                    item = job.queued_audio_dict
+                    await self._io(self.remote._release_queue_item, item)
+                    return None
+                await self._io(job._retrieve_file)
+                cached = await self._io(job._lookup_cached_result)
+            if not cached:
+                await self._compute(self._analyze, job)
+            # Blocking: locks the budget state file and joins the RSS sampler.
+            await self._io(job._finish_admission)
+            await self._io(job._upload_extractions)
+            await self._io(job._store_cached_result)
+            job.analyzer_duration_seconds = round(time.time() - job.start_time, 2)
+            await self._io(job._upload_json)
+            await self._io(job._cleanup_files)
+            await self._io(job._save_results_to_server)
+            self.jobs_completed += 1
+            return job
+        except Exception:
+            self.jobs_failed += 1
+            raise
+        finally:
+            heartbeat.cancel()
+            await self._io(self._clean_up_job, job)
+
+    def _clean_up_job(self, job):
+        job._finish_admission()
+        remove_job_directories(job)
+
+    def _job_finished(self, task):
+        if not task.cancelled() and task.exception():
+            print("control plane job", task.exception())
+
+    async def run(self):
+        # Polls the queue until stop(), or until the api reports the queue is
+        # done and this runner may shut down.
+        async with self:
+            shutdown = await self._poll()
+        self.remote._flush_results(flush_all=True)
+        # Hand back anything leased in a batch but not started.
+        self.remote._release_leased_items()
+        if self.remote.extraction_pool:
+            self.remote.extraction_pool.close()
+        if shutdown:
+            self.remote._request_shutdown()
+
+    async def _poll(self):
+        remote = self.remote
+        coordinator = remote.shutdown_coordinator
+        # Submit anything left over from a previous run.
+        await self._io(remote._flush_results, True)
+        while not self._stop.is_set():
+            if len(self.jobs) >= self.max_jobs:
+                await asyncio.wait(self.jobs, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            lease_start = time.monotonic()
+            try:
+                data = await self._io(remote._request_queue_item)
+            except Exception as e:
+                print("control plane lease", e)
+                await self._sleep(remote.sleep_secs_on_empty_queue)
+                continue
+
+            if "id" in data:
+                remote.empty_queue_backoff.reset()
+                if coordinator:
+                    coordinator.report_busy()
+                self.submit(data, lease_start).add_done_callback(self._job_finished)
+                continue
+
+            if data.get("safe_to_shutdown", False):
+                if remote.shutdown_on_empty_processing_queue:
+                    if not coordinator:
+                        return True
+                    if not self.jobs:
+                        # The supervisor decides once every worker is idle.
+                        await self._io(remote._request_shutdown)
+            # Idle; don't let buffered results wait for the next job.
+            await self._io(remote._flush_results, True)
+            delay = remote.empty_queue_backoff.next_delay(
+                time.monotonic() - lease_start
+            )
+            print("queue empty, sleep", round(delay, 2))
+            await self._sleep(delay)
+        return False
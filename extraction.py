@@ -0,0 +1,206 @@
+import io
+
+import numpy as np
+import soundfile
+
+
+SAMPLE_RATE = 48000
+
+# soundfile encodes these straight into a buffer; anything else goes through pydub.
+SOUNDFILE_FORMATS = {"flac": "FLAC", "wav": "WAV", "ogg": "OGG"}
+
+# Clips converted together; bounds the float32 and int16 copies held at once
+# however many detections a recording has.
+CLIP_CHUNK_SIZE = 32
+
+
+def return_extraction_windows(recording, min_conf=0.0, padding_secs=0):
+    # {detection key: (start_sec, end_sec)}, computed the way birdnetlib's
+    # extract_detections_as_* do, so file names (and urls) are unchanged.
+    windows = {}
+    for detection in recording.detections:
+        if detection["confidence"] < min_conf:
+            continue
+        start_sec = int(
+            detection["start_time"] - padding_secs
+            if detection["start_time"] > padding_secs
+            else 0
+        )
+        end_sec = int(
+            detection["end_time"] + padding_secs
+            if detection["end_time"] + padding_secs < recording.duration
+            else recording.duration
+        )
+        windows[f"{detection['start_time']}_{detection['end_time']}"] = (
+            start_sec,
+            end_sec,
+        )
+    return windows
+
+
+def encode_pcm(data, format="flac", bitrate="192k"):
+    # data is 16 bit mono at SAMPLE_RATE.
+    buffer = io.BytesIO()
+    if format in SOUNDFILE_FORMATS:
+        soundfile.write(
+            buffer,
+            data,
+            SAMPLE_RATE,
+            format=SOUNDFILE_FORMATS[format],
+            subtype="VORBIS" if format == "ogg" else "PCM_16",
+        )
+    else:
+        import pydub
+
+        audio = pydub.AudioSegment(
+            data.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=1
+        )
+        audio.export(buffer, format=format, bitrate=bitrate)
+    return buffer.getvalue()
+
+
+def render_spectrogram(samples, title, top=14000, format="jpg", dpi=144):
+    # Same figure as birdnetlib's extract_detections_as_spectrogram, drawn on
+    # a figure of its own (pyplot's global state isn't safe across threads).
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.specgram(samples, Fs=SAMPLE_RATE)
+    axes.set_ylim(top=top)
+    axes.set_ylabel("frequency kHz")
+    axes.set_title(title, fontsize=10)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=format, dpi=dpi)
+    return buffer.getvalue()
+
+
+class ClipExtractor:
+    # Cuts every clip of a recording out of the waveform decoded for analysis
+    # (an ndarray, or the memory-mapped copy a StreamingRecording keeps), so
+    # the source file is decoded once however many detections it has. Clips
+    # of the same length are faded and converted to 16 bit together, up to
+    # CLIP_CHUNK_SIZE at a time.
+
+    def __init__(self, recording, fade_seconds=0.0):
+        self.recording = recording
+        self.fade_samples = int(fade_seconds * SAMPLE_RATE)
+
+    def _slice(self, start_sec, end_sec):
+        if self.recording.ndarray is not None:
+            return self.recording.ndarray[
+                int(start_sec * SAMPLE_RATE) : int(end_sec * SAMPLE_RATE)
+            ]
+        return self.recording.get_extract_array(start_sec, end_sec)
+
+    def _envelope(self, length):
+        envelope = np.ones(length, dtype="float32")
+        fade = min(self.fade_samples, length // 2)
+        if fade:
+            ramp = np.linspace(0.0, 1.0, fade, dtype="float32")
+            envelope[:fade] = ramp
+            envelope[length - fade :] = ramp[::-1]
+        return envelope
+
+    def iter_samples(self, windows, chunk_size=None):
+        # (key, int16 samples) for {key: (start_sec, end_sec)}, converting
+        # chunk_size clips at a time.
+        chunk_size = chunk_size or CLIP_CHUNK_SIZE
+        items = list(windows.items())
+        for i in range(0, len(items), chunk_size):
+            yield from self.samples(dict(items[i : i + chunk_size])).items()
+
+    def samples(self, windows):
+        # {key: int16 samples} for {key: (start_sec, end_sec)}, all at once.
+        by_length = {}
+        for key, (start_sec, end_sec) in windows.items():
+            clip = self._slice(start_sec, end_sec)
+            by_length.setdefault(len(clip), []).append((key, clip))
+        clips = {}
+        for length, group in by_length.items():
+            stacked = np.stack([clip for _, clip in group]) * self._envelope(length)
+            # Normalized to -1, 1; clipped so full scale doesn't wrap around.
+            pcm = np.clip(stacked * 2**15, -(2**15), 2**15 - 1).astype(np.int16)
+            for (key, _), row in zip(group, pcm):
+                clips[key] = row
+        return clips
+
+    def encode(self, start_sec, end_sec, format="flac"):
+        pcm = self.samples({None: (start_sec, end_sec)})[None]
+        return encode_pcm(pcm, format=format)
+
+    def write(self, windows, directory, format="flac"):
+        # Same paths as birdnetlib's extract_detections_as_audio; {key: path}.
+        # Each chunk of clips is written before the next one is cut.
+        paths = {}
+        for key, pcm in self.iter_samples(windows):
+            start_sec, end_sec = windows[key]
+            path = f"{directory}/{self.recording.filestem}_{start_sec}s-{end_sec}s.{format}"
+            with open(path, "wb") as f:
+                f.write(encode_pcm(pcm, format=format))
+            paths[key] = path
+        return paths
+
+
+class Artifact:
+    # One clip or spectrogram, rendered only when it is uploaded so that at
+    # most one buffer per upload worker is in memory at a time.
+
+    def __init__(self, detection_key, url_field, filename, render):
+        self.detection_key = detection_key
+        self.url_field = url_field
+        self.filename = filename
+        self._render = render
+
+    def render(self):
+        return self._render()
+
+
+def plan_audio_clips(
+    recording, min_conf=0.0, padding_secs=0, format="flac", fade_seconds=0.0
+):
+    artifacts = []
+    extractor = ClipExtractor(recording, fade_seconds=fade_seconds)
+    windows = return_extraction_windows(recording, min_conf, padding_secs)
+    for key, (start_sec, end_sec) in windows.items():
+
+        def render(start_sec=start_sec, end_sec=end_sec):
+            return extractor.encode(start_sec, end_sec, format=format)
+
+        filename = f"{recording.filestem}_{start_sec}s-{end_sec}s.{format}"
+        artifacts.append(Artifact(key, "extracted_audio_url", filename, render))
+    return artifacts
+
+
+def plan_spectrograms(
+    recording,
+    min_conf=0.0,
+    padding_secs=0,
+    top=14000,
+    format="jpg",
+    dpi=144,
+    engine=None,
+):
+    # With a SpectrogramEngine, images are cropped from its STFT instead.
+    artifacts = []
+    windows = return_extraction_windows(recording, min_conf, padding_secs)
+    if engine:
+        format = engine.format
+    for key, (start_sec, end_sec) in windows.items():
+
+        def render(start_sec=start_sec, end_sec=end_sec):
+            if engine:
+                return engine.render(start_sec, end_sec)
+            return render_spectrogram(
+                recording.get_extract_array(start_sec, end_sec),
+                f"{recording.filename} ({start_sec}s - {end_sec}s)",
+                top=top,
+                format=format,
+                dpi=dpi,
+            )
+
+        filename = f"{recording.filestem}_{start_sec}s-{end_sec}s.{format}"
+        artifacts.append(Artifact(key, "extracted_spectrogram_url", filename, render))
+    return artifacts
@@ -0,0 +1,115 @@
+import hashlib
+import struct
+
+
+# md5 is what the api expects for file_checksum. sha1 and blake2b are usually
+# faster on CPUs with hardware SHA support or 64-bit SIMD respectively.
+DEFAULT_CHECKSUM_ALGORITHM = "md5"
+
+# Enough bytes for the RIFF/WAVE fmt chunk or the FLAC STREAMINFO block.
+HEADER_BYTES = 64
+
+
+def sniff_audio_format(header):
+    # Returns container, codec and (when the header carries it) stream details.
+    audio_format = {"container": "unknown", "codec": "unknown"}
+
+    if header[0:4] == b"RIFF" and header[8:12] == b"WAVE":
+        audio_format["container"] = "wav"
+        audio_format["codec"] = "pcm"
+        if header[12:16] == b"fmt " and len(header) >= 36:
+            format_tag, channels, sample_rate, byte_rate = struct.unpack(
+                "<HHII", header[20:32]
+            )
+            bits_per_sample = struct.unpack("<H", header[34:36])[0]
+            if format_tag == 3:
+                audio_format["codec"] = "pcm_float"
+            elif format_tag not in (1, 0xFFFE):
+                audio_format["codec"] = f"wav_format_{format_tag}"
+            audio_format["channels"] = channels
+            audio_format["sample_rate"] = sample_rate
+            audio_format["bits_per_sample"] = bits_per_sample
+            audio_format["byte_rate"] = byte_rate
+
+    elif header[0:4] == b"fLaC":
+        audio_format["container"] = "flac"
+        audio_format["codec"] = "flac"
+        # STREAMINFO is always the first metadata block.
+        if len(header) >= 26:
+            info = int.from_bytes(header[18:26], "big")
+            sample_rate = info >> 44
+            channels = ((info >> 41) & 0x7) + 1
+            bits_per_sample = ((info >> 36) & 0x1F) + 1
+            total_samples = info & 0xFFFFFFFFF
+            audio_format["channels"] = channels
+            audio_format["sample_rate"] = sample_rate
+            audio_format["bits_per_sample"] = bits_per_sample
+            if sample_rate and total_samples:
+                audio_format["duration"] = total_samples / sample_rate
+
+    elif header[0:4] == b"OggS":
+        audio_format["container"] = "ogg"
+        if b"OpusHead" in header:
+            audio_format["codec"] = "opus"
+        elif b"\x01vorbis" in header:
+            audio_format["codec"] = "vorbis"
+        elif b"\x7fFLAC" in header:
+            audio_format["codec"] = "flac"
+
+    elif header[0:3] == b"ID3" or (
+        len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0
+    ):
+        audio_format["container"] = "mp3"
+        audio_format["codec"] = "mp3"
+
+    elif header[4:8] == b"ftyp":
+        audio_format["container"] = "mp4"
+        audio_format["codec"] = "aac"
+
+    elif header[0:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+        audio_format["container"] = "aiff"
+        audio_format["codec"] = "pcm"
+
+    return audio_format
+
+
+class IngestWriter:
+    # Wraps the destination file for download_fileobj. Every chunk written is
+    # hashed and counted, and the first bytes are kept to sniff the format,
+    # so the file never has to be read back after the download.
+
+    def __init__(self, fileobj, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+        self.fileobj = fileobj
+        self.algorithm = algorithm
+        self._hash = hashlib.new(algorithm)
+        self._header = b""
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        if len(self._header) < HEADER_BYTES:
+            self._header += bytes(data[: HEADER_BYTES - len(self._header)])
+        return self.fileobj.write(data)
+
+    def seekable(self):
+        # Non-seekable, so s3transfer writes the parts in order and the
+        # running hash matches the file contents.
+        return False
+
+    @property
+    def checksum(self):
+        return self._hash.hexdigest()
+
+    @property
+    def audio_format(self):
+        return sniff_audio_format(self._header)
+
+
+def file_checksum(filepath, algorithm=DEFAULT_CHECKSUM_ALGORITHM, block_size=1 << 20):
+    # Fallback for files that were not downloaded through IngestWriter.
+    file_hash = hashlib.new(algorithm)
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
@@ -0,0 +1,70 @@
+import json
+import os
+
+import requests
+
+
+METADATA_URL = "http://169.254.169.254/latest/meta-data"
+
+# The metadata service answers within milliseconds on EC2; off EC2 nothing
+# answers at all, so don't wait long.
+CONNECT_TIMEOUT_SECONDS = 0.25
+READ_TIMEOUT_SECONDS = 1.0
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def return_boot_id():
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def fetch_instance_metadata(
+    keys,
+    url=METADATA_URL,
+    timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+):
+    # None for any key the service didn't return.
+    metadata = {key: None for key in keys}
+    for key in keys:
+        try:
+            response = requests.get(f"{url}/{key}", timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            # Unreachable: the remaining keys would only time out too.
+            print("instance metadata", key, e)
+            break
+        if response.status_code == 200:
+            metadata[key] = response.text
+    return metadata
+
+
+def return_instance_metadata(keys, cache_path=None, url=METADATA_URL):
+    # Instance metadata is fixed until the next boot, which may be a new
+    # instance started from an image of this one, so the cached copy is only
+    # used while the boot id matches. Incomplete metadata isn't cached.
+    boot_id = return_boot_id()
+    if cache_path and boot_id:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["boot_id"] == boot_id and all(
+                cached["metadata"].get(key) for key in keys
+            ):
+                return {key: cached["metadata"][key] for key in keys}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    metadata = fetch_instance_metadata(keys, url=url)
+    if cache_path and boot_id and all(metadata.values()):
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"boot_id": boot_id, "metadata": metadata}, f)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print("instance metadata cache", e)
+    return metadata
@@ -0,0 +1,80 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+# Used until the api tells us how long a lease lasts.
+DEFAULT_LEASE_SECONDS = 900
+
+
+class LeaseQueue:
+    # Local work queue for queue items leased in batches from the api.
+    # The next batch size is chosen so that the batch can be finished well
+    # within the lease, based on how long recent jobs took on this runner.
+
+    def __init__(
+        self,
+        max_batch_size=1,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        lease_fraction=0.5,
+        smoothing=0.3,
+    ):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.lease_seconds = lease_seconds
+        self.lease_fraction = lease_fraction
+        self.smoothing = smoothing
+        self.average_job_seconds = None
+        self.expired_count = 0
+        self._items = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, items, lease_seconds=None):
+        if lease_seconds:
+            self.lease_seconds = lease_seconds
+        deadline = time.monotonic() + self.lease_seconds
+        with self._lock:
+            for item in items:
+                self._items.append((item, deadline))
+
+    def pop(self):
+        # Returns the next item whose lease has not run out, or None.
+        now = time.monotonic()
+        with self._lock:
+            while self._items:
+                item, deadline = self._items.popleft()
+                if deadline > now:
+                    return item
+                # The api will have handed this item to someone else.
+                print("lease expired for queue item", item.get("id"))
+                self.expired_count += 1
+        return None
+
+    def drain(self):
+        # Removes and returns every unstarted item (e.g. to hand back on shutdown).
+        with self._lock:
+            items = [item for item, _ in self._items]
+            self._items.clear()
+        return items
+
+    def record_job(self, seconds):
+        with self._lock:
+            if self.average_job_seconds is None:
+                self.average_job_seconds = seconds
+            else:
+                self.average_job_seconds = (
+                    self.smoothing * seconds
+                    + (1 - self.smoothing) * self.average_job_seconds
+                )
+
+    @property
+    def next_batch_size(self):
+        # Start with a single item until this runner has timed a job.
+        if not self.average_job_seconds:
+            return 1
+        budget = self.lease_seconds * self.lease_fraction
+        size = math.floor(budget / self.average_job_seconds)
+        return max(1, min(self.max_batch_size, size))
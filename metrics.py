@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# The stages of a job, in the order they run.
+STAGES = [
+    "lease",
+    "download",
+    "checksum",
+    "analyzer",
+    "inference",
+    "audio_extraction",
+    "spectrogram_extraction",
+    "uploads",
+    "json_upload",
+    "result_post",
+]
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RunnerMetrics:
+    # Totals for every job a runner has worked on, shared by the per-job
+    # copies of its Remote (and so by every pipeline stage).
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.jobs = 0
+        self.totals = {}  # stage: [calls, seconds, items, bytes]
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds=0.0, items=0, bytes=0):
+        with self._lock:
+            totals = self.totals.setdefault(stage, [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += items
+            totals[3] += bytes
+
+    def record_job(self):
+        with self._lock:
+            self.jobs += 1
+
+    def render(self):
+        # Prometheus text exposition format.
+        with self._lock:
+            totals = {stage: list(values) for stage, values in self.totals.items()}
+            jobs = self.jobs
+        lines = [
+            "# HELP audiospotter_jobs_total Jobs completed.",
+            "# TYPE audiospotter_jobs_total counter",
+            f"audiospotter_jobs_total{_format_labels(self.labels)} {jobs}",
+        ]
+        for index, (name, help) in enumerate(
+            (
+                ("calls", "Times each stage ran."),
+                ("seconds", "Seconds spent in each stage."),
+                ("items", "Items (files, clips, results) handled by each stage."),
+                ("bytes", "Bytes moved by each stage."),
+            )
+        ):
+            metric = f"audiospotter_stage_{name}_total"
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} counter")
+            for stage in sorted(totals, key=_stage_order):
+                value = totals[stage][index]
+                if isinstance(value, float):
+                    value = round(value, 6)
+                labels = _format_labels(dict(self.labels, stage=stage))
+                lines.append(f"{metric}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def return_files_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+class StageMetrics:
+    # Monotonic time and byte/item counts per stage of one job. Everything
+    # recorded is also added to the runner's totals.
+
+    def __init__(self, runner_metrics=None):
+        self.runner_metrics = runner_metrics
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds=0.0, items=0, bytes=0):
+        with self._lock:
+            values = self.stages.setdefault(
+                stage, {"seconds": 0.0, "items": 0, "bytes": 0}
+            )
+            values["seconds"] += seconds
+            values["items"] += items
+            values["bytes"] += bytes
+        if self.runner_metrics:
+            self.runner_metrics.add(stage, seconds, items, bytes)
+
+    @contextmanager
+    def time(self, stage):
+        # Yields a dict; set "items" and "bytes" on it inside the block.
+        counts = {"items": 0, "bytes": 0}
+        start = time.monotonic()
+        try:
+            yield counts
+        finally:
+            self.add(
+                stage,
+                time.monotonic() - start,
+                items=counts["items"],
+                bytes=counts["bytes"],
+            )
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                stage: {
+                    "seconds": round(values["seconds"], 4),
+                    "items": values["items"],
+                    "bytes": values["bytes"],
+                }
+                for stage, values in sorted(
+                    self.stages.items(), key=lambda item: _stage_order(item[0])
+                )
+            }
+
+
+class MetricsServer:
+    # Serves a runner's totals at http://host:port/metrics from a daemon thread.
+
+    def __init__(self, runner_metrics, port, host="127.0.0.1"):
+        runner = runner_metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = runner.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scraped every few seconds; keep it out of the runner log.
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
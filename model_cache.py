@@ -0,0 +1,145 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+class ModelCache:
+    # Instance-wide, content-addressed cache for model and label files.
+    #
+    #   blobs/<sha256><suffix>   file contents, named by their hash
+    #   index/<url hash>.json    which blob a url resolved to, and its validators
+    #   locks/<url hash>.lock    held while a url is being downloaded
+    #
+    # Runners on the same instance share the directory; the lock makes sure only
+    # one of them downloads a given file and the others reuse it. Files survive
+    # restarts. A file may be replaced on the server under the same url, so a
+    # cached url is revalidated with a conditional GET (ETag/Last-Modified)
+    # unless the caller pins its sha256; a url served without either validator
+    # is downloaded again.
+
+    def __init__(self, directory, session, chunk_size=1 << 20):
+        self.directory = directory
+        self.session = session
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.downloads = 0
+        for name in ("blobs", "index", "locks", "tmp"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _url_key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _lock(self, url_key):
+        with open(os.path.join(self.directory, "locks", f"{url_key}.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _cached_entry(self, url_key, expected_sha256=None):
+        index_path = os.path.join(self.directory, "index", f"{url_key}.json")
+        try:
+            with open(index_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if expected_sha256 and entry["sha256"] != expected_sha256:
+            return None
+        path = self._blob_path(entry)
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return None
+        return entry
+
+    def _blob_path(self, entry):
+        return os.path.join(self.directory, "blobs", entry["blob"])
+
+    def _write_index(self, url_key, entry):
+        index_path = os.path.join(self.directory, "index", f"{url_key}.json")
+        with tempfile.NamedTemporaryFile(
+            "w", dir=os.path.join(self.directory, "tmp"), delete=False
+        ) as f:
+            json.dump(entry, f)
+        os.replace(f.name, index_path)
+
+    def _download(self, url, expected_sha256=None, suffix="", cached_entry=None):
+        # Stream to a temporary file (never holding the whole model in memory),
+        # hashing as we go, and move it into place only once it checks out.
+        # Returns None if cached_entry is still current.
+        headers = {}
+        if cached_entry and cached_entry.get("etag"):
+            headers["If-None-Match"] = cached_entry["etag"]
+        if cached_entry and cached_entry.get("last_modified"):
+            headers["If-Modified-Since"] = cached_entry["last_modified"]
+        response = self.session.get(url, stream=True, headers=headers)
+        if response.status_code == 304 and headers:
+            response.close()
+            return None
+        if response.status_code != 200:
+            raise ConnectionError(
+                f"Remote could not download model file (status {response.status_code})."
+            )
+        file_hash = hashlib.sha256()
+        size = 0
+        temp = tempfile.NamedTemporaryFile(
+            dir=os.path.join(self.directory, "tmp"), delete=False
+        )
+        try:
+            with temp as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file_hash.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            sha256 = file_hash.hexdigest()
+            expected_size = response.headers.get("Content-Length", None)
+            if expected_size is not None and int(expected_size) != size:
+                raise ConnectionError(
+                    f"Incomplete model download ({size} of {expected_size} bytes)."
+                )
+            if expected_sha256 and sha256 != expected_sha256:
+                raise ValueError(f"Model checksum mismatch for {url}.")
+
+            blob = f"{sha256}{suffix}"
+            os.replace(temp.name, os.path.join(self.directory, "blobs", blob))
+        finally:
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+        self.downloads += 1
+        return {
+            "url": url,
+            "sha256": sha256,
+            "size": size,
+            "blob": blob,
+            "etag": response.headers.get("ETag", None),
+            "last_modified": response.headers.get("Last-Modified", None),
+        }
+
+    def fetch(self, url, expected_sha256=None, suffix=""):
+        # Returns a local path for url, downloading it at most once per instance
+        # and version of the file.
+        url_key = self._url_key(url)
+        if expected_sha256:
+            # Content-addressed: a matching blob can't be stale.
+            entry = self._cached_entry(url_key, expected_sha256)
+            if entry:
+                self.hits += 1
+                return self._blob_path(entry)
+        with self._lock(url_key):
+            # Another runner may have finished the download while we waited.
+            cached_entry = self._cached_entry(url_key, expected_sha256)
+            if cached_entry and expected_sha256:
+                self.hits += 1
+                return self._blob_path(cached_entry)
+            entry = self._download(url, expected_sha256, suffix, cached_entry)
+            if entry is None:
+                self.hits += 1
+                return self._blob_path(cached_entry)
+            self._write_index(url_key, entry)
+        return self._blob_path(entry)
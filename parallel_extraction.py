@@ -0,0 +1,155 @@
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from extraction import SAMPLE_RATE, ClipExtractor, render_spectrogram
+from spectrogram import SpectrogramEngine
+
+
+# Recordings with fewer clips and spectrograms than this are extracted in the
+# runner process; starting the work elsewhere costs more than it saves.
+MIN_PARALLEL_WINDOWS = 16
+
+# A recording is split into about this many chunks per process (so one slow
+# chunk doesn't leave the others idle), of at least MIN_CHUNK_WINDOWS each so
+# the per-chunk round trip stays small next to the work in it.
+CHUNKS_PER_PROCESS = 2
+MIN_CHUNK_WINDOWS = 8
+
+
+def return_pool_size(runner_count=1, cpu_count=None):
+    # The instance's cores, shared between its runners.
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, int(runner_count)))
+
+
+def split_tasks(tasks, processes):
+    chunk_count = processes * CHUNKS_PER_PROCESS
+    size = max(MIN_CHUNK_WINDOWS, math.ceil(len(tasks) / chunk_count))
+    return [tasks[i : i + size] for i in range(0, len(tasks), size)]
+
+
+class WaveformRecording:
+    # What the extractors need from a recording, over the decoded waveform
+    # file, so workers are sent a path rather than the samples.
+
+    def __init__(self, waveform_path, filestem, filename):
+        self.ndarray = np.memmap(waveform_path, dtype="float32", mode="r")
+        self.filestem = filestem
+        self.filename = filename
+
+    def get_extract_array(self, start_sec, end_sec):
+        return self.ndarray[int(start_sec * SAMPLE_RATE) : int(end_sec * SAMPLE_RATE)]
+
+
+def extract_chunk(chunk):
+    # Runs in a worker. Returns [(kind, key, path)] in the order of the tasks.
+    recording = WaveformRecording(
+        chunk["waveform_path"], chunk["filestem"], chunk["filename"]
+    )
+    clips = ClipExtractor(recording, fade_seconds=chunk["fade_seconds"])
+    engine = None
+    if chunk["spectrogram_engine"] == "stft":
+        engine = SpectrogramEngine(recording)
+    results = []
+    for kind, key, (start_sec, end_sec) in chunk["tasks"]:
+        window = {key: (start_sec, end_sec)}
+        if kind == "audio":
+            path = clips.write(window, chunk["audio_directory"])[key]
+        elif engine:
+            path = engine.write(window, chunk["spectrogram_directory"])[key]
+        else:
+            # Same file as birdnetlib's extract_detections_as_spectrogram.
+            path = (
+                f"{chunk['spectrogram_directory']}/"
+                f"{recording.filestem}_{start_sec}s-{end_sec}s.jpg"
+            )
+            image = render_spectrogram(
+                recording.get_extract_array(start_sec, end_sec),
+                f"{recording.filename} ({start_sec}s - {end_sec}s)",
+            )
+            with open(path, "wb") as f:
+                f.write(image)
+        results.append((kind, key, path))
+    return results
+
+
+class ExtractionPool:
+    # Worker processes that write the clips and spectrograms of a recording
+    # in parallel, shared by every job of a runner. Like the supervisor's
+    # workers they are forked, so call start() before the runner starts any
+    # threads. Workers read the waveform from disk.
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.chunks_submitted = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("fork"),
+                )
+            return self._executor
+
+    def start(self):
+        # Forks every worker now rather than at the first detection-heavy job.
+        self.executor.submit(os.getpid).result()
+
+    def extract(
+        self,
+        waveform_path,
+        filestem,
+        filename,
+        audio_windows,
+        audio_directory,
+        spectrogram_windows,
+        spectrogram_directory,
+        fade_seconds=0.0,
+        spectrogram_engine="matplotlib",
+    ):
+        # Returns ({key: clip path}, {key: spectrogram path}), each in the
+        # order of its windows whatever order the chunks finish in.
+        tasks = [("audio", key, window) for key, window in audio_windows.items()]
+        tasks += [
+            ("spectrogram", key, window) for key, window in spectrogram_windows.items()
+        ]
+        # Neighbouring windows in the same chunk share STFT tiles.
+        tasks.sort(key=lambda task: task[2])
+        chunks = [
+            {
+                "waveform_path": waveform_path,
+                "filestem": filestem,
+                "filename": filename,
+                "audio_directory": audio_directory,
+                "spectrogram_directory": spectrogram_directory,
+                "fade_seconds": fade_seconds,
+                "spectrogram_engine": spectrogram_engine,
+                "tasks": chunk,
+            }
+            for chunk in split_tasks(tasks, self.processes)
+        ]
+        self.chunks_submitted += len(chunks)
+        paths = {"audio": {}, "spectrogram": {}}
+        for results in self.executor.map(extract_chunk, chunks):
+            for kind, key, path in results:
+                paths[kind][key] = path
+        audio_paths = {key: paths["audio"][key] for key in audio_windows}
+        spectrogram_paths = {
+            key: paths["spectrogram"][key] for key in spectrogram_windows
+        }
+        return audio_paths, spectrogram_paths
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,297 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+
+# Marker passed between stages when the api reports the processing queue is done.
+SHUTDOWN = "shutdown"
+
+
+def new_job(remote, item):
+    job = remote._job_copy()
+    job.queued_audio_dict = item
+    # Give each job its own directories so that two jobs with the same
+    # file name never overwrite (or clean up) each other's files.
+    prefix = f"job-{item['id']}-"
+    job.audio_directory = tempfile.mkdtemp(prefix=prefix, dir=remote.audio_directory)
+    job.extraction_audio_directory = tempfile.mkdtemp(
+        prefix=prefix, dir=remote.extraction_audio_directory
+    )
+    job.extraction_spectrogram_directory = tempfile.mkdtemp(
+        prefix=prefix, dir=remote.extraction_spectrogram_directory
+    )
+    return job
+
+
+def remove_job_directories(job):
+    for directory in (
+        job.audio_directory,
+        job.extraction_audio_directory,
+        job.extraction_spectrogram_directory,
+    ):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class Pipeline:
+    # Runs a Remote's jobs in three overlapping stages:
+    #   prefetch: lease the next queue item and download its audio
+    #   analyze:  inference and extraction (on the calling thread)
+    #   finish:   uploads, analysis json, cleanup and the results POST
+    # Each stage hands a per-job copy of the Remote to the next, so the
+    # stages never share job state. Queues between stages are bounded by depth.
+
+    def __init__(self, remote, depth=1):
+        self.remote = remote
+        self.depth = max(1, int(depth))
+        # Room for enough downloaded jobs to fill a batch of recordings.
+        self.prefetched = queue.Queue(
+            maxsize=max(self.depth, getattr(remote, "batch_recordings", 1))
+        )
+        self.finishing = queue.Queue(maxsize=self.depth)
+        self.stop_event = threading.Event()
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        # Jobs leased but not yet finished (in any stage).
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _job_done(self, job=None):
+        if job:
+            job._finish_admission()
+        with self._lock:
+            self.in_flight -= 1
+
+    def _new_job(self, item):
+        return new_job(self.remote, item)
+
+    def _remove_job_directories(self, job):
+        remove_job_directories(job)
+
+    def _put(self, stage_queue, value):
+        # Blocks while the next stage is full, but stays responsive to stop().
+        while not self.stop_event.is_set():
+            try:
+                stage_queue.put(value, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prefetch(self):
+        while not self.stop_event.is_set():
+            lease_start = time.monotonic()
+            try:
+                data = self.remote._request_queue_item()
+            except BaseException as e:
+                print("pipeline prefetch", e)
+                self.stop_event.wait(self.remote.sleep_secs_on_empty_queue)
+                continue
+
+            coordinator = self.remote.shutdown_coordinator
+            if "id" not in data:
+                if data.get("safe_to_shutdown", False):
+                    if self.remote.shutdown_on_empty_processing_queue:
+                        if not coordinator:
+                            self._put(self.prefetched, SHUTDOWN)
+                            return
+                        with self._lock:
+                            idle = self.in_flight == 0
+                        if idle:
+                            # The supervisor decides once every worker is idle.
+                            self.remote._request_shutdown()
+                # Idle; don't let buffered results wait for the next job.
+                self.remote._flush_results(flush_all=True)
+                delay = self.remote.empty_queue_backoff.next_delay(
+                    time.monotonic() - lease_start
+                )
+                print("queue empty, sleep", round(delay, 2))
+                self.stop_event.wait(delay)
+                continue
+
+            self.remote.empty_queue_backoff.reset()
+            if coordinator:
+                coordinator.report_busy()
+            with self._lock:
+                self.in_flight += 1
+            job = self._new_job(data)
+            job.start_time = time.time()
+            job.stage_metrics.add("lease", time.monotonic() - lease_start, items=1)
+            cached = False
+            try:
+                cached = job._lookup_cached_result(before_download=True)
+                admitted = cached or job._admit_job()
+                if not admitted:
+                    self.remote._release_queue_item(data)
+                elif not cached:
+                    job._retrieve_file()
+                    cached = job._lookup_cached_result()
+            except BaseException as e:
+                print("pipeline download", e)
+                admitted = False
+            if not admitted:
+                self._remove_job_directories(job)
+                self._job_done(job)
+                continue
+            # Cached results skip analysis and go straight to the finish stage.
+            if cached:
+                job._finish_admission()
+            stage_queue = self.finishing if cached else self.prefetched
+            if not self._put(stage_queue, job):
+                self._remove_job_directories(job)
+                self._job_done(job)
+
+    def _analysis_failed(self, job, e):
+        print("pipeline analyze", e)
+        with self._lock:
+            self.jobs_failed += 1
+        if job.audio_filepath and os.path.exists(job.audio_filepath):
+            os.remove(job.audio_filepath)
+        self._remove_job_directories(job)
+        self._job_done(job)
+
+    def _take_batch(self, job, held):
+        # Adds jobs with the same analyzer config that are already downloaded,
+        # up to batch_recordings. Others are held for the next round, in order.
+        batch = [job]
+        key = job.analyzer_config_key
+        for other in list(held):
+            if len(batch) >= self.remote.batch_recordings:
+                return batch
+            if other != SHUTDOWN and other.analyzer_config_key == key:
+                held.remove(other)
+                batch.append(other)
+        while len(batch) < self.remote.batch_recordings:
+            try:
+                other = self.prefetched.get_nowait()
+            except queue.Empty:
+                break
+            if other != SHUTDOWN and other.analyzer_config_key == key:
+                batch.append(other)
+            else:
+                held.append(other)
+        return batch
+
+    def _analyze(self, jobs):
+        start = time.monotonic()
+        # A single job is analyzed on its own; a batch is prepared job by job
+        # and then shares inference.
+        stage = "_analyze_file" if len(jobs) == 1 else "_prepare_recording"
+        ready = []
+        for job in jobs:
+            # Analyzer construction is counted on the parent Remote, which owns the cache.
+            job._analyzers_init_count = self.remote._analyzers_init_count
+            try:
+                getattr(job, stage)()
+            except BaseException as e:
+                self._analysis_failed(job, e)
+                continue
+            self.remote._analyzers_init_count = job._analyzers_init_count
+            self.remote.analyzer = job.analyzer
+            ready.append(job)
+
+        if len(jobs) > 1:
+            try:
+                self.remote._analyze_recordings(ready)
+            except BaseException as e:
+                for job in ready:
+                    self._analysis_failed(job, e)
+                ready = []
+
+        for job in ready:
+            try:
+                job._extract_detections()
+            except BaseException as e:
+                self._analysis_failed(job, e)
+                continue
+            # Detections and extraction paths are all the finish stage needs;
+            # drop the decoded audio so only one recording is held in memory.
+            # In-memory extractions still cut their clips from it, and release
+            # it once uploaded.
+            if not job.extraction_artifacts:
+                job.recording.ndarray = None
+            job.recording.chunks = []
+            job._finish_admission()
+            self.finishing.put(job)
+
+        # Analysis is the stage that paces a pipelined runner, so it sizes leases.
+        self.remote.lease_queue.record_job((time.monotonic() - start) / len(jobs))
+
+    def _finish(self):
+        while True:
+            job = self.finishing.get()
+            if job is None:
+                return
+            try:
+                job._upload_extractions()
+                job._store_cached_result()
+                job.analyzer_duration_seconds = round(time.time() - job.start_time, 2)
+                job._upload_json()
+                job._cleanup_files()
+                job._save_results_to_server()
+                self.jobs_completed += 1
+            except BaseException as e:
+                print("pipeline finish", e)
+                with self._lock:
+                    self.jobs_failed += 1
+            finally:
+                self._remove_job_directories(job)
+                self._job_done(job)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, max_jobs=None):
+        prefetcher = threading.Thread(target=self._prefetch, daemon=True)
+        finisher = threading.Thread(target=self._finish, daemon=True)
+        prefetcher.start()
+        finisher.start()
+
+        shutdown = False
+        jobs_started = 0
+        held = []  # Downloaded jobs set aside while batching others.
+        while not self.stop_event.is_set():
+            if held:
+                job = held.pop(0)
+            else:
+                try:
+                    job = self.prefetched.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            if job == SHUTDOWN:
+                shutdown = True
+                break
+            jobs = self._take_batch(job, held)
+            self._analyze(jobs)
+            jobs_started += len(jobs)
+            if max_jobs is not None and jobs_started >= max_jobs:
+                break
+
+        # Let in-flight uploads and result POSTs complete before returning.
+        self.stop_event.set()
+        self.finishing.put(None)
+        finisher.join()
+        prefetcher.join()
+        if self.remote.extraction_pool:
+            self.remote.extraction_pool.close()
+        self.remote._flush_results(flush_all=True)
+        # Hand back anything leased but not started.
+        unstarted = []
+        while not self.prefetched.empty():
+            held.append(self.prefetched.get())
+        # Cached results the prefetcher handed over after the finish stage ended.
+        while not self.finishing.empty():
+            job = self.finishing.get()
+            if job is not None:
+                held.append(job)
+        for job in held:
+            if job != SHUTDOWN:
+                unstarted.append(job.queued_audio_dict)
+                self._remove_job_directories(job)
+                job._finish_admission()
+        self.remote._release_leased_items(unstarted)
+
+        if shutdown:
+            self.remote._request_shutdown()
@@ -0,0 +1,40 @@
+import random
+import threading
+
+
+class EmptyQueueBackoff:
+    # How long to wait before asking an empty queue again. Starts at
+    # min_seconds and multiplies while the queue stays empty, up to
+    # max_seconds, so new work is picked up quickly while an idle fleet
+    # polls less and less. Jittered so that runners started together drift
+    # apart instead of polling in lockstep. reset() once work arrives.
+
+    def __init__(self, min_seconds, max_seconds, multiplier=2.0, jitter=True):
+        self.min_seconds = min(min_seconds, max_seconds)
+        self.max_seconds = max_seconds
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.empty_polls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def adaptive(self):
+        return self.min_seconds < self.max_seconds
+
+    def next_delay(self, elapsed_seconds=0.0):
+        # elapsed_seconds is how long the empty poll itself took; a long poll
+        # that already waited on the api needs little or no further sleep.
+        with self._lock:
+            delay = min(
+                self.max_seconds,
+                self.min_seconds * self.multiplier**self.empty_polls,
+            )
+            if delay < self.max_seconds:
+                self.empty_polls += 1
+        if self.jitter and self.adaptive:
+            delay = random.uniform(delay / 2, delay)
+        return max(0.0, delay - elapsed_seconds)
+
+    def reset(self):
+        with self._lock:
+            self.empty_polls = 0
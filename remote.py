@@ -1,18 +1,110 @@
-import requests
 from pprint import pprint
-import boto3
+import importlib
 import os
+import sys
+import threading
 from botocore.exceptions import ClientError
-from birdnetlib import Recording
-from birdnetlib.analyzer import Analyzer
 import json
 import hashlib
 import time
 from urllib.parse import urlparse
+import copy
+import gzip
+import numpy as np
+import asyncio
+
+from admission import (
+    DEFAULT_WINDOW_SECONDS,
+    MemoryBudget,
+    RssSampler,
+    estimate_audio_seconds,
+    estimate_job_bytes,
+)
+from analysis_output import OUTPUT_FORMATS, check_output_formats, encode_analysis
+from analyzer_cache import AnalyzerCache
+from api_session import ApiSession
+from control_plane import ControlPlane, return_io_workers
+from extraction import (
+    ClipExtractor,
+    plan_audio_clips,
+    plan_spectrograms,
+    return_extraction_windows,
+)
+from pipeline import Pipeline
+from uploads import ExtractionUploader, UploadTask
+from leasing import LeaseQueue
+from metrics import MetricsServer, RunnerMetrics, StageMetrics, return_files_bytes
+from model_cache import ModelCache
+from polling import EmptyQueueBackoff
+from parallel_extraction import MIN_PARALLEL_WINDOWS, ExtractionPool, return_pool_size
+from result_cache import (
+    ResultCache,
+    return_analyzer_package_version,
+    return_result_cache_key,
+)
+from results_buffer import DeadlineFlusher, ResultBuffer
+from spectrogram import SpectrogramEngine
+from ingest import (
+    DEFAULT_CHECKSUM_ALGORITHM,
+    HEADER_BYTES,
+    IngestWriter,
+    file_checksum,
+    sniff_audio_format,
+)
 
 
 UNSPECIFIED = "Not specified"
 
+# birdnetlib (and with it TensorFlow and matplotlib) takes seconds to import,
+# so it is only imported once the first recording is analyzed, not before the
+# first queue poll. Looked up through the module so tests can patch them.
+LAZY_IMPORTS = {
+    "Analyzer": ("birdnetlib.analyzer", "Analyzer"),
+    "Recording": ("birdnetlib", "Recording"),
+}
+
+
+def __getattr__(name):
+    if name not in LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attribute = LAZY_IMPORTS[name]
+    value = getattr(importlib.import_module(module_name), attribute)
+    globals()[name] = value
+    return value
+
+
+def _lazy(name):
+    return getattr(sys.modules[__name__], name)
+
+
+# BirdNET analyzes 3 second chunks at 48kHz.
+SAMPLE_RATE = 48000
+WARM_UP_SAMPLE_SECONDS = 3.0
+
+# Api connections kept alive: enough for the pipeline's threads (lease
+# prefetch, analysis, finishing) and the result flusher.
+API_POOL_SIZE = 4
+
+
+def return_analyzer_config_key(analyzer_config):
+    return hashlib.md5(
+        json.dumps(analyzer_config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def return_analyzer_model_key(analyzer_config):
+    # Identifies the parts of an analyzer config that change the Analyzer itself
+    # (model version, custom classifier, species list), ignoring thresholds and
+    # destinations. Configs with the same model key can share an Analyzer.
+    analyzer = analyzer_config.get("analyzer", {})
+    model = {
+        "base_version": analyzer.get("base_version", None),
+        "model_fp32_file": analyzer.get("model_fp32_file", None),
+        "labels_file": analyzer.get("labels_file", None),
+        "species_list": analyzer_config.get("species_list", []),
+    }
+    return hashlib.md5(json.dumps(model, sort_keys=True).encode("utf-8")).hexdigest()
+
 
 class Remote:
     def __init__(
@@ -29,8 +121,47 @@ class Remote:
         extraction_spectrogram_directory=".",
         analyzer=None,
         sleep_secs_on_empty_queue=3,
+        empty_queue_min_sleep_seconds=None,
+        long_poll_seconds=0,
         runner_count=1,
         shutdown_on_empty_processing_queue=False,
+        pipeline_depth=0,
+        async_jobs=0,
+        lease_heartbeat_seconds=None,
+        upload_workers=8,
+        checksum_algorithm=DEFAULT_CHECKSUM_ALGORITHM,
+        lease_batch_size=1,
+        result_buffer_directory=None,
+        result_buffer_max_results=10,
+        result_buffer_max_age_seconds=30,
+        result_gzip_min_bytes=64 * 1024,
+        api_connect_timeout=5,
+        api_read_timeout=60,
+        api_max_retries=5,
+        preloaded_analyzers=None,
+        shutdown_coordinator=None,
+        analyzer_cache_max_entries=4,
+        analyzer_cache_max_bytes=None,
+        model_cache_directory=None,
+        warm_up_configs_path=None,
+        warm_up_from_api=False,
+        streaming_min_duration_seconds=None,
+        streaming_window_seconds=DEFAULT_WINDOW_SECONDS,
+        memory_budget_directory=None,
+        memory_budget_bytes=None,
+        admission_wait_seconds=60,
+        inference_batch_size=1,
+        batch_recordings=1,
+        result_cache_path=None,
+        extraction_mode="disk",
+        clip_fade_seconds=0.0,
+        spectrogram_engine="matplotlib",
+        extraction_processes=0,
+        analysis_output_formats=("json",),
+        metrics_port=None,
+        metrics_host="127.0.0.1",
+        s3_endpoint_url=None,
+        startup_timer=None,
     ):
         self.api_endpoint = api_endpoint
         self.api_key = api_key
@@ -39,6 +170,8 @@ class Remote:
         self.processor_type = processor_type
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
+        # An S3-compatible service to use instead of AWS (e.g. a local stand-in).
+        self.s3_endpoint_url = s3_endpoint_url
         self.queued_audio_dict = None
         self.audio_directory = audio_directory
         self.extraction_audio_directory = extraction_audio_directory
@@ -50,14 +183,128 @@ class Remote:
         self._client = None
         self.detections = []
         self.file_checksum = None
+        self.file_size = None
+        self.audio_format = None
+        self.checksum_algorithm = checksum_algorithm
+        self._ingested_filepath = None
         self.analyzer_duration_seconds = 0
         self.sleep_secs_on_empty_queue = sleep_secs_on_empty_queue
+        # Sleeps after an empty poll start at empty_queue_min_sleep_seconds
+        # and back off to sleep_secs_on_empty_queue; None always sleeps the
+        # full sleep_secs_on_empty_queue.
+        if empty_queue_min_sleep_seconds is None:
+            empty_queue_min_sleep_seconds = sleep_secs_on_empty_queue
+        self.empty_queue_backoff = EmptyQueueBackoff(
+            empty_queue_min_sleep_seconds, sleep_secs_on_empty_queue
+        )
+        # Seconds the api may hold a queue request open until an item arrives
+        # (sent as wait_seconds); 0 polls.
+        self.long_poll_seconds = long_poll_seconds
         self.min_conf_audio_extraction = 0.0
         self.min_conf_spectrogram_extraction = 0.0
         self.shutdown_on_empty_processing_queue = shutdown_on_empty_processing_queue
         self.runner_count = runner_count
-        self._analyzers = {}
+        self._analyzers = AnalyzerCache(
+            max_entries=analyzer_cache_max_entries, max_bytes=analyzer_cache_max_bytes
+        )
         self._analyzers_init_count = 0
+        self.pipeline_depth = pipeline_depth
+        self.upload_workers = upload_workers
+        self.uploaded_extractions = {}
+        self.upload_stats = {}
+        self.lease_batch_size = lease_batch_size
+        self.lease_queue = LeaseQueue(max_batch_size=lease_batch_size)
+        # Shared with the per-job copies, so that a job waiting for admission
+        # sees stop() too.
+        self._stop_event = threading.Event()
+        self._pipeline = None
+        # Jobs in flight at once under the asyncio control plane, which also
+        # renews their leases every lease_heartbeat_seconds (None: a third of
+        # the lease). 0 runs the synchronous loop, or the pipeline.
+        self.async_jobs = async_jobs
+        self.lease_heartbeat_seconds = lease_heartbeat_seconds
+        self._control_plane = None
+        self.result_buffer = None
+        if result_buffer_directory:
+            self.result_buffer = ResultBuffer(
+                result_buffer_directory,
+                max_results=result_buffer_max_results,
+                max_age_seconds=result_buffer_max_age_seconds,
+            )
+        self.result_gzip_min_bytes = result_gzip_min_bytes
+        self.model_cache_directory = model_cache_directory
+        self.warm_up_configs_path = warm_up_configs_path
+        self.warm_up_from_api = warm_up_from_api
+        self.streaming_min_duration_seconds = streaming_min_duration_seconds
+        self.streaming_window_seconds = streaming_window_seconds
+        self.memory_budget = None
+        if memory_budget_directory:
+            self.memory_budget = MemoryBudget(
+                memory_budget_directory,
+                max_bytes=memory_budget_bytes,
+                priority_after_seconds=admission_wait_seconds,
+            )
+        self.admission_wait_seconds = admission_wait_seconds
+        self._admission = None
+        self.inference_batch_size = inference_batch_size
+        self.batch_recordings = batch_recordings
+        self.result_cache = (
+            ResultCache(result_cache_path) if result_cache_path else None
+        )
+        self.cached_result = None
+        self._source_etag = None
+        # "disk" writes clips and spectrograms to the extraction directories;
+        # "memory" renders each one into a buffer as it is uploaded.
+        self.extraction_mode = extraction_mode
+        self.extraction_artifacts = []
+        self.clip_fade_seconds = clip_fade_seconds
+        # "matplotlib" draws birdnetlib's jpg figure per detection; "stft"
+        # crops png images from one STFT of the recording.
+        self.spectrogram_engine = spectrogram_engine
+        # Processes that write the clips and spectrograms of detection-heavy
+        # recordings in disk mode. 0 extracts in the runner process; None
+        # shares the instance's cores between its runners.
+        if extraction_processes is None:
+            extraction_processes = return_pool_size(runner_count)
+        self.extraction_pool = None
+        if extraction_processes > 1:
+            self.extraction_pool = ExtractionPool(extraction_processes)
+        # Files written to the analysis json destination; see OUTPUT_FORMATS.
+        check_output_formats(analysis_output_formats)
+        self.analysis_output_formats = analysis_output_formats
+        # Stage timings and counters: per job in stage_metrics (sent with the
+        # results), totals for the runner in metrics, served in Prometheus
+        # text format on metrics_port while run_queue runs.
+        self.metrics = RunnerMetrics(labels={"pid": pid} if pid else None)
+        self.stage_metrics = StageMetrics(self.metrics)
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self._metrics_server = None
+        self._result_flusher = None
+        self.warm_up_duration_seconds = 0
+        self.warm_up_timings = {}
+        # Sent once, with the first result submitted after warm_up(). A dict
+        # rather than an attribute so the per-job copies share it.
+        self._warm_up_report = {}
+        self._model_cache = None
+        # Analyzers built before this Remote existed (e.g. by the supervisor
+        # before forking), keyed by return_analyzer_model_key.
+        self.preloaded_analyzers = preloaded_analyzers or {}
+        self.shutdown_coordinator = shutdown_coordinator
+        # Reports the time from process start to the first queue poll.
+        self.startup_timer = startup_timer
+        # One keep-alive connection pool shared by every api call (and pipeline
+        # stage), with a connection for each thread that may call the api at
+        # once: the control plane's IO threads, and the result flusher.
+        api_pool_size = API_POOL_SIZE
+        if async_jobs > 0:
+            api_pool_size = max(api_pool_size, return_io_workers(async_jobs) + 1)
+        self.session = ApiSession(
+            pool_maxsize=api_pool_size,
+            connect_timeout=api_connect_timeout,
+            read_timeout=api_read_timeout,
+            max_retries=api_max_retries,
+        )
 
     @property
     def api_headers(self):
@@ -66,41 +313,157 @@ class Remote:
             "BNL_PROCESSOR_ID": self.processor_id,
         }
 
-    def _return_queue_item(self):
-        # TODO: Handle 404 and 500 with fibonacci backoff
+    def _post_queue_request(self, data):
+        # Not idempotent: a retry after the api got the request would lease a
+        # second batch and strand the first until its lease expires. Only
+        # failures to connect, which never reached the api, are retried.
         server_id = self.processor_id
         pid = self.pid
-        data = {"server_id": server_id, "pid": pid}
+        data.update({"server_id": server_id, "pid": pid})
         data["api_key"] = self.api_key  # Add api_key to outgoing request
-        response = requests.post(
+        connect_timeout, read_timeout = self.session.timeout
+        if self.long_poll_seconds:
+            # An api without long polls ignores this and answers at once.
+            data["wait_seconds"] = self.long_poll_seconds
+            read_timeout += self.long_poll_seconds
+        response = self.session.post(
             f"{self.api_endpoint}/queues/audio/",
             json=data,
             headers=self.api_headers,
             verify=self.verify_request,
+            timeout=(connect_timeout, read_timeout),
         )
+        if self.startup_timer:
+            self.startup_timer.first_poll()
         if response.status_code != 200:
             raise ConnectionError(
                 f"Remote could not connect to API endpoint (status {response.status_code})."
             )
-        data = response.json()
+        return response.json()
+
+    def _request_queue_items(self, count):
+        # Batch lease. The api returns {"items": [...], "lease_seconds": ...};
+        # a single item response is accepted too.
+        data = self._post_queue_request({"count": count})
+        if "items" in data:
+            return data
+        if "id" in data:
+            return {"items": [data]}
+        return dict(data, items=[])
+
+    def _request_queue_item(self):
+        if self.lease_batch_size <= 1:
+            return self._post_queue_request({})
+
+        # Serve from the local work queue, leasing a new batch when it runs dry.
+        item = self.lease_queue.pop()
+        if item:
+            return item
+        data = self._request_queue_items(self.lease_queue.next_batch_size)
+        self.lease_queue.add(data["items"], data.get("lease_seconds", None))
+        item = self.lease_queue.pop()
+        if item:
+            return item
+        return {k: v for k, v in data.items() if k not in ("items", "lease_seconds")}
+
+    def _release_queue_item(self, item):
+        audio_id = item["id"]
+        release_endpoint = f"{self.api_endpoint}/queues/audio/{audio_id}/release/"
+        data = {"api_key": self.api_key}  # Add api_key to outgoing request
+        # Not retried once it may have reached the api: by then another runner
+        # may have leased the item, and a repeat could release that lease. An
+        # item that isn't released is leased again when its lease expires.
+        response = self.session.post(
+            release_endpoint,
+            json=data,
+            headers=self.api_headers,
+            verify=self.verify_request,
+        )
+        if response.status_code not in (200, 201, 204):
+            raise ConnectionError(
+                f"Remote could not connect to API endpoint (status {response.status_code})."
+            )
+
+    def _renew_lease(self, item):
+        # Extends the lease on an item that is still being worked on.
+        audio_id = item["id"]
+        heartbeat_endpoint = f"{self.api_endpoint}/queues/audio/{audio_id}/heartbeat/"
+        data = {"api_key": self.api_key}  # Add api_key to outgoing request
+        # Idempotent: a repeat only extends the same lease again.
+        response = self.session.post(
+            heartbeat_endpoint,
+            json=data,
+            headers=self.api_headers,
+            verify=self.verify_request,
+            idempotent=True,
+        )
+        if response.status_code not in (200, 201, 204):
+            raise ConnectionError(
+                f"Remote could not renew lease (status {response.status_code})."
+            )
+
+    def _release_leased_items(self, items=None):
+        # Hands unstarted items back to the api so other runners can take them.
+        items = list(items or []) + self.lease_queue.drain()
+        for item in items:
+            try:
+                self._release_queue_item(item)
+            except BaseException as e:
+                print("_release_queue_item", item.get("id"), e)
+        return len(items)
+
+    def _return_queue_item(self):
+        data = self._request_queue_item()
         if "id" in data:
             # Item returned, return this.
+            self.empty_queue_backoff.reset()
+            if self.shutdown_coordinator:
+                self.shutdown_coordinator.report_busy()
             return data
         if (
             data.get("safe_to_shutdown", False)
             and self.shutdown_on_empty_processing_queue
         ):
             # Shutdown here
-            self._shutdown()
+            self._request_shutdown()
         return None
 
+    def _request_shutdown(self):
+        # Nothing may be left unsubmitted when the instance goes down.
+        self._flush_results(flush_all=True)
+        if self.shutdown_coordinator:
+            # Other runners on this instance may be mid-job; let the supervisor decide.
+            self.shutdown_coordinator.report_idle()
+            return
+        self._shutdown()
+
     def _save_results_to_server(self):
-        # TODO: Handle 404 and 500 with fibonacci backoff
+        with self.stage_metrics.time("result_post") as result_post:
+            result_post["items"] = 1
+            response = self._post_results()
+        self.metrics.record_job()
+        return response
+
+    def _post_results(self):
         data = self._format_results_for_api()
-        data["api_key"] = self.api_key  # Add api_key to outgoing request
+        # pop() is atomic, so only one job's result carries it.
+        warm_up = self._warm_up_report.pop("warm_up", None)
+        if warm_up:
+            data["warm_up"] = warm_up
         audio_id = self.queued_audio_dict["id"]
+        if self.result_buffer:
+            # Persist first, then submit together with other buffered results.
+            self.result_buffer.add(audio_id, data)
+            if self.result_buffer.should_flush():
+                self._flush_results()
+                return self.result_buffer.last_response
+            return None
+
+        data["api_key"] = self.api_key  # Add api_key to outgoing request
         results_endpoint = f"{self.api_endpoint}/queues/audio/{audio_id}/results/"
-        response = requests.post(
+        # Not retried once it may have reached the api, which doesn't dedupe
+        # results: a repeat could record them twice.
+        response = self.session.post(
             results_endpoint,
             json=data,
             headers=self.api_headers,
@@ -115,6 +478,56 @@ class Remote:
             return None
         return data
 
+    def _submit_results(self, results):
+        # One result goes to its own endpoint, several go to the batch endpoint.
+        # Large bodies are gzipped.
+        if len(results) == 1:
+            audio_id, data = results[0]
+            results_endpoint = f"{self.api_endpoint}/queues/audio/{audio_id}/results/"
+            data = dict(data)
+        else:
+            results_endpoint = f"{self.api_endpoint}/queues/audio/results/"
+            data = {"results": [dict(data, id=audio_id) for audio_id, data in results]}
+        data["api_key"] = self.api_key  # Add api_key to outgoing request
+
+        body = json.dumps(data).encode("utf-8")
+        headers = dict(self.api_headers)
+        headers["Content-Type"] = "application/json"
+        if len(body) >= self.result_gzip_min_bytes:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        # As in _post_results, not retried once it may have reached the api.
+        # Results left unacknowledged stay buffered for the next flush.
+        response = self.session.post(
+            results_endpoint,
+            data=body,
+            headers=headers,
+            verify=self.verify_request,
+        )
+        if response.status_code != 201:
+            raise ConnectionError(
+                f"Remote could not connect to API endpoint (status {response.status_code})."
+            )
+        data = response.json()
+        if data == {}:
+            return None
+        return data
+
+    def _flush_results(self, flush_all=False):
+        # Returns the number of results submitted by a single flush.
+        if not self.result_buffer:
+            return 0
+        try:
+            if flush_all:
+                self.result_buffer.flush_all(self._submit_results)
+            else:
+                return self.result_buffer.flush(self._submit_results)
+        except BaseException as e:
+            # Results stay on disk and are retried on the next flush.
+            print("_flush_results", e)
+        return 0
+
     @property
     def instance_id(self):
         return self.processor_id if self.processor_id else UNSPECIFIED
@@ -129,25 +542,56 @@ class Remote:
 
     def _format_results_for_api(self):
         config_id = self.queued_audio_dict["group"]["analyzer_config"]["id"]
+        # A cached result stands in for both the recording and the analyzer.
+        recording = self.cached_result or self.recording
+        if self.cached_result:
+            analyzer_version = self.cached_result.analyzer_version
+        else:
+            analyzer_version = self.analyzer.version
         data = {
             "detections": self.detections,
             "config_id": config_id,
-            "duration_seconds": self.recording.duration,
+            "duration_seconds": recording.duration,
             "analyzer_instance_id": self.instance_id,
             "analyzer_instance_type": self.instance_type,
             "analyzer_duration_seconds": self.analyzer_duration_seconds,
-            "analyzer_version": self.analyzer.version,
+            "analyzer_version": analyzer_version,
             "file_checksum": self.file_checksum,
         }
+        if self.checksum_algorithm != DEFAULT_CHECKSUM_ALGORITHM:
+            data["file_checksum_algorithm"] = self.checksum_algorithm
+        if self.result_cache:
+            data["result_cache"] = {
+                "hit": self.cached_result is not None,
+                **self.result_cache.stats,
+            }
+        # Stages finished so far; the analysis json is written before its own
+        # upload and the result POST, so those appear in the results only.
+        data["stage_metrics"] = self.stage_metrics.as_dict()
         return data
 
+    @property
+    def model_cache(self):
+        if not self._model_cache:
+            directory = self.model_cache_directory or os.path.join(
+                self.audio_directory, "models"
+            )
+            self._model_cache = ModelCache(directory, self.session)
+        return self._model_cache
+
     @property
     def client(self):
         if not self._client:
+            import boto3
+            from botocore.config import Config
+
             self._client = boto3.client(
                 "s3",
                 aws_access_key_id=self.aws_access_key_id,
                 aws_secret_access_key=self.aws_secret_access_key,
+                endpoint_url=self.s3_endpoint_url,
+                # Enough pooled connections for the concurrent extraction uploads.
+                config=Config(max_pool_connections=max(10, self.upload_workers)),
             )
         return self._client
 
@@ -158,9 +602,17 @@ class Remote:
         self.audio_filepath = os.path.join(self.audio_directory, filename)
         bucket = data["file_source"]["s3_bucket"]
         object_key = data["file_path"]
+        self.file_checksum = None
+        self._ingested_filepath = None
         try:
-            with open(self.audio_filepath, "wb") as f:
-                self.client.download_fileobj(bucket, object_key, f)
+            with open(self.audio_filepath, "wb") as f, self.stage_metrics.time(
+                "download"
+            ) as download:
+                # Checksum, size and format header are taken from the stream.
+                writer = IngestWriter(f, algorithm=self.checksum_algorithm)
+                self.client.download_fileobj(bucket, object_key, writer)
+                download["items"] = 1
+                download["bytes"] = writer.size
         except ClientError as e:
             self.audio_file_obj = None
             self._cleanup_files()
@@ -169,9 +621,83 @@ class Remote:
             )
 
         self.audio_file_obj = f
+        self.file_checksum = writer.checksum
+        self.file_size = writer.size
+        self.audio_format = writer.audio_format
+        self._ingested_filepath = self.audio_filepath
+
+    def _estimate_job_bytes(self):
+        # Sizes the job from the object's first bytes, before it is downloaded.
+        data = self.queued_audio_dict["audio"]
+        response = self.client.get_object(
+            Bucket=data["file_source"]["s3_bucket"],
+            Key=data["file_path"],
+            Range=f"bytes=0-{HEADER_BYTES - 1}",
+        )
+        header = response["Body"].read()
+        content_range = response.get("ContentRange", "")
+        if "/" in content_range:
+            size = int(content_range.split("/")[-1])
+        else:
+            size = response.get("ContentLength", len(header))
+        audio_seconds = estimate_audio_seconds(size, sniff_audio_format(header))
+        window_seconds = None
+        if (
+            self.streaming_min_duration_seconds is not None
+            and audio_seconds >= self.streaming_min_duration_seconds
+        ):
+            window_seconds = self.streaming_window_seconds
+        return estimate_job_bytes(audio_seconds, window_seconds)
+
+    def _admit_job(self):
+        # Waits until the job's estimated peak memory fits in the instance
+        # budget shared by all runners. Returns False if it never did, in which
+        # case the caller hands the item back; the next runner to lease it
+        # gives it priority.
+        if not self.memory_budget:
+            return True
+        try:
+            estimated = self._estimate_job_bytes()
+        except ClientError as e:
+            print("_admit_job", e)
+            return True  # _retrieve_file reports the missing file.
+        token = f"{os.getpid()}-{self.queued_audio_dict['id']}"
+        deadline = time.monotonic() + self.admission_wait_seconds
+        while True:
+            predicted = self.memory_budget.reserve(
+                token, estimated, job_id=self.queued_audio_dict["id"]
+            )
+            if predicted is not None:
+                self._admission = (token, predicted, RssSampler())
+                return True
+            if time.monotonic() >= deadline or self.stop_requested:
+                self.memory_budget.rejections += 1
+                print("_admit_job: not enough memory for", token)
+                return False
+            self.memory_budget.waits += 1
+            self._stop_event.wait(1)
+
+    def _finish_admission(self):
+        # Frees the job's reservation and records its actual peak memory.
+        if not self._admission:
+            return
+        token, predicted, sampler = self._admission
+        self._admission = None
+        actual = sampler.stop()
+        print("job memory", token, "predicted", predicted, "actual", actual)
+        self.memory_budget.release(token, predicted, actual, fresh=sampler.fresh)
+
+    @property
+    def waveform_filepath(self):
+        # Decoded copy of a streamed recording, kept on disk for clip extraction.
+        return f"{self.audio_filepath}.waveform.f32"
 
     def _cleanup_files(self):
-        os.remove(self.audio_filepath)
+        # Nothing was downloaded for a result cached under the object's ETag.
+        if self.audio_filepath:
+            for path in (self.audio_filepath, self.waveform_filepath):
+                if os.path.exists(path):
+                    os.remove(path)
         detections = self.detections
         for detection in detections:
             if "extracted_audio_path" in detection:
@@ -183,32 +709,120 @@ class Remote:
 
     def _set_checksum(self):
         print("_set_checksum")
-        self.file_checksum = hashlib.md5(
-            open(self.audio_filepath, "rb").read()
-        ).hexdigest()
+        if self.file_checksum and self._ingested_filepath == self.audio_filepath:
+            # Already computed while the file was downloaded.
+            return
+        with self.stage_metrics.time("checksum") as checksum:
+            self.file_checksum = file_checksum(
+                self.audio_filepath, algorithm=self.checksum_algorithm
+            )
+            checksum["items"] = 1
+            checksum["bytes"] = os.path.getsize(self.audio_filepath)
 
     @property
     def analyzer_config_key(self):
         data = self.queued_audio_dict
-        return hashlib.md5(
-            json.dumps(data["group"]["analyzer_config"], sort_keys=True).encode("utf-8")
-        ).hexdigest()
+        return return_analyzer_config_key(data["group"]["analyzer_config"])
+
+    def _result_cache_keys(self):
+        # (checksum key, source key). Only the parts of the analyzer config that
+        # change detections or extractions count, so groups with otherwise
+        # different configs share results. Upgrading the analyzer library
+        # starts over.
+        analyzer_config = self.queued_audio_dict["group"]["analyzer_config"]
+        settings = (
+            return_analyzer_package_version(),
+            return_analyzer_model_key(analyzer_config),
+            analyzer_config.get("minimum_detection_confidence", None),
+            analyzer_config.get("minimum_detection_clip_confidence", 0.0),
+        )
+        checksum_key = None
+        if self.file_checksum:
+            checksum_key = return_result_cache_key(
+                self.checksum_algorithm, self.file_checksum, *settings
+            )
+        source_key = None
+        if self._source_etag:
+            data = self.queued_audio_dict["audio"]
+            source_key = return_result_cache_key(
+                self.checksum_algorithm,
+                data["file_source"]["s3_bucket"],
+                data["file_path"],
+                self._source_etag,
+                *settings,
+            )
+        return checksum_key, source_key
+
+    def _lookup_cached_result(self, before_download=False):
+        # Before the download, looks the object up by ETag; after it, by the
+        # checksum computed while downloading. Returns True on a hit, with
+        # self.detections set to the stored detections and urls.
+        if not self.result_cache:
+            return False
+        if before_download:
+            data = self.queued_audio_dict["audio"]
+            try:
+                response = self.client.head_object(
+                    Bucket=data["file_source"]["s3_bucket"], Key=data["file_path"]
+                )
+            except ClientError as e:
+                print("_lookup_cached_result", e)
+                return False
+            self._source_etag = response.get("ETag", None)
+            _, source_key = self._result_cache_keys()
+            if not source_key:
+                return False
+            result = self.result_cache.get(source_key=source_key)
+            if result is None:
+                # Counted once the checksum lookup after the download misses too.
+                return False
+        else:
+            checksum_key, _ = self._result_cache_keys()
+            if not checksum_key:
+                return False
+            result = self.result_cache.get(checksum_key=checksum_key)
+        self.result_cache.record_lookup(result, time.time() - self.start_time)
+        if result is None:
+            return False
+        print("result cache hit", self.queued_audio_dict["id"])
+        self.cached_result = result
+        self.detections = copy.deepcopy(result.detections)
+        if not self.file_checksum:
+            self.file_checksum = result.file_checksum
+        return True
+
+    def _store_cached_result(self):
+        # Only complete results are cached: every extraction must have uploaded.
+        if not self.result_cache or self.cached_result:
+            return
+        if not all(self.uploaded_extractions.values()):
+            return
+        checksum_key, source_key = self._result_cache_keys()
+        if not checksum_key:
+            return
+        self.result_cache.put(
+            checksum_key,
+            source_key,
+            self.file_checksum,
+            self.detections,
+            self.recording.duration,
+            self.analyzer.version,
+            round(time.time() - self.start_time, 2),
+        )
 
-    def _create_analyzer(self):
+    def _create_analyzer(self, analyzer_config=None):
         # Currently, only Birdnet-Analyzer is supported.
         # TODO: Add additional analyzers.
 
-        data = self.queued_audio_dict
-        analyzer_config = data["group"]["analyzer_config"]
+        if analyzer_config is None:
+            analyzer_config = self.queued_audio_dict["group"]["analyzer_config"]
 
         species_list = analyzer_config.get("species_list", [])
 
         analyzer_kwargs = {}
 
-        if "base_version" in data["group"]["analyzer_config"]["analyzer"]:
-            analyzer_kwargs["version"] = data["group"]["analyzer_config"]["analyzer"][
-                "base_version"
-            ]
+        if "base_version" in analyzer_config["analyzer"]:
+            analyzer_kwargs["version"] = analyzer_config["analyzer"]["base_version"]
 
         if len(species_list) != 0:
             analyzer_kwargs["custom_species_list"] = species_list
@@ -218,44 +832,133 @@ class Remote:
         custom_labels_file = analyzer_config["analyzer"].get("labels_file", None)
 
         if custom_model_file:
-            # Check to see if the file already exists.
             api_server_root = (
                 urlparse(self.api_endpoint).scheme
                 + "://"
                 + urlparse(self.api_endpoint).hostname
             )
 
-            model_filename = os.path.basename(custom_model_file)
-            model_filepath = os.path.join(self.audio_directory, model_filename)
-
-            if not os.path.exists(model_filepath):
-                # Download the model file.
-                url = f"{api_server_root}{custom_model_file}"
-                r = requests.get(url)
-                with open(model_filepath, "wb") as f:
-                    f.write(r.content)
-
-            labels_filename = os.path.basename(custom_labels_file)
-            labels_filepath = os.path.join(self.audio_directory, labels_filename)
-
-            if not os.path.exists(labels_filepath):
-                # Download the labels file.
-                url = f"{api_server_root}{custom_labels_file}"
-                r = requests.get(url)
-                with open(labels_filepath, "wb") as f:
-                    f.write(r.content)
+            # Shared, content-addressed cache; only one runner downloads each file.
+            model_filepath = self.model_cache.fetch(
+                f"{api_server_root}{custom_model_file}",
+                expected_sha256=analyzer_config["analyzer"].get("model_fp32_sha256"),
+                suffix=os.path.splitext(custom_model_file)[1],
+            )
+            labels_filepath = self.model_cache.fetch(
+                f"{api_server_root}{custom_labels_file}",
+                expected_sha256=analyzer_config["analyzer"].get("labels_sha256"),
+                suffix=os.path.splitext(custom_labels_file)[1],
+            )
 
             analyzer_kwargs["classifier_model_path"] = model_filepath
             analyzer_kwargs["classifier_labels_path"] = labels_filepath
 
-        analyzer = Analyzer(**analyzer_kwargs)
+        # The model stays resident, so it isn't counted against running jobs.
+        RssSampler.discard_active()
+        analyzer = _lazy("Analyzer")(**analyzer_kwargs)
         self.analyzer = analyzer
 
         # Store the Analyzer instance for later use.
-        self._analyzers[self.analyzer_config_key] = analyzer
+        self._analyzers[return_analyzer_config_key(analyzer_config)] = analyzer
         self._analyzers_init_count = self._analyzers_init_count + 1
 
-    def _analyze_file(self):
+    def _get_analyzer(self, analyzer_config):
+        # Sets self.analyzer from the cache, the supervisor's preloaded
+        # analyzers, or a newly created one.
+        model_key = return_analyzer_model_key(analyzer_config)
+        analyzer = self._analyzers.get(return_analyzer_config_key(analyzer_config))
+        if analyzer is not None:
+            self.analyzer = analyzer
+        elif model_key in self.preloaded_analyzers:
+            # Already loaded (and shared copy-on-write) by the supervisor. Kept out
+            # of the LRU cache so that it is never evicted and released.
+            self.analyzer = self.preloaded_analyzers[model_key]
+        else:
+            # Create analyzer if it doesn't already exist.
+            self._create_analyzer(analyzer_config)
+        return self.analyzer
+
+    def _return_warm_up_configs(self):
+        # Analyzer configs the api expects this runner to need.
+        configs = []
+        if self.warm_up_configs_path:
+            with open(self.warm_up_configs_path) as f:
+                configs.extend(json.load(f))
+        if self.warm_up_from_api:
+            # The api key goes in the headers only; never in the url.
+            response = self.session.get(
+                f"{self.api_endpoint}/analyzer-configs/active/",
+                headers=self.api_headers,
+                verify=self.verify_request,
+            )
+            if response.status_code == 200:
+                configs.extend(response.json())
+            else:
+                print("_return_warm_up_configs", response.status_code)
+        # Queue items are accepted as well as bare analyzer configs.
+        return [c["group"]["analyzer_config"] if "group" in c else c for c in configs]
+
+    def warm_up(self, analyzer_configs=None):
+        # Build each analyzer and run one dummy inference before the first lease,
+        # so that cold-start cost isn't counted in any job's analyzer_duration_seconds.
+        if analyzer_configs is None:
+            analyzer_configs = self._return_warm_up_configs()
+        start = time.monotonic()
+        for analyzer_config in analyzer_configs:
+            config_start = time.monotonic()
+            try:
+                analyzer = self._get_analyzer(analyzer_config)
+                sample = np.zeros(int(WARM_UP_SAMPLE_SECONDS * SAMPLE_RATE))
+                if analyzer.use_custom_classifier:
+                    analyzer.predict_with_custom_classifier(sample)
+                else:
+                    analyzer.predict(sample)
+            except BaseException as e:
+                print("warm_up", analyzer_config.get("id", None), e)
+                continue
+            self.warm_up_timings[return_analyzer_config_key(analyzer_config)] = round(
+                time.monotonic() - config_start, 3
+            )
+        self.warm_up_duration_seconds = round(time.monotonic() - start, 3)
+        # Reported apart from the jobs, whose stages don't include it.
+        self.metrics.add(
+            "warm_up", self.warm_up_duration_seconds, items=len(self.warm_up_timings)
+        )
+        self._warm_up_report["warm_up"] = {
+            "duration_seconds": self.warm_up_duration_seconds,
+            "analyzer_seconds": dict(self.warm_up_timings),
+        }
+        print(
+            "warm_up",
+            len(self.warm_up_timings),
+            "analyzers in",
+            self.warm_up_duration_seconds,
+            "s",
+        )
+
+    def _create_recording(self, min_conf):
+        # Long recordings are decoded and analyzed one window at a time so the
+        # whole waveform is never in memory.
+        if self.streaming_min_duration_seconds is not None:
+            from streaming import StreamingRecording, return_duration
+
+            duration = return_duration(self.audio_filepath)
+            if duration is not None and duration >= self.streaming_min_duration_seconds:
+                print("streaming analysis", round(duration, 1), "seconds")
+                return StreamingRecording(
+                    self.analyzer,
+                    self.audio_filepath,
+                    window_seconds=self.streaming_window_seconds,
+                    min_conf=min_conf,
+                    waveform_path=self.waveform_filepath,
+                )
+        return _lazy("Recording")(
+            self.analyzer,
+            self.audio_filepath,
+            min_conf=min_conf,
+        )
+
+    def _prepare_recording(self):
         data = self.queued_audio_dict
 
         analyzer_config = data["group"]["analyzer_config"]
@@ -267,39 +970,168 @@ class Remote:
             "minimum_detection_clip_confidence", 0.0
         )
 
-        if not self.analyzer_config_key in self._analyzers:
-            # Create analyzer if it doesn't already exist.
-            self._create_analyzer()
-        else:
-            self.analyzer = self._analyzers[self.analyzer_config_key]
+        with self.stage_metrics.time("analyzer") as analyzer:
+            self._get_analyzer(analyzer_config)
+            analyzer["items"] = 1
 
-        self.recording = Recording(
-            self.analyzer,
-            self.audio_filepath,
-            min_conf=min_conf,
-        )
-        self.recording.analyze()
-        pprint(self.recording.detections)
+        self.recording = self._create_recording(min_conf)
 
-        self._set_checksum()
+    def _analyze_recordings(self, jobs):
+        # With inference_batch_size > 1, the chunks of every recording that
+        # shares an Analyzer are packed into batches together. Streamed
+        # recordings are analyzed window by window on their own.
+        # A batch's inference time is shared equally between its recordings.
+        from batching import BatchInference
+        from streaming import StreamingRecording
+
+        groups = {}
+        for job in jobs:
+            if self.inference_batch_size > 1 and not isinstance(
+                job.recording, StreamingRecording
+            ):
+                groups.setdefault(id(job.analyzer), []).append(job)
+            else:
+                with job.stage_metrics.time("inference") as inference:
+                    job.recording.analyze()
+                    inference["items"] = len(job.recording.detections)
+        for group in groups.values():
+            start = time.monotonic()
+            inference = BatchInference(group[0].analyzer, self.inference_batch_size)
+            inference.analyze([job.recording for job in group])
+            seconds = (time.monotonic() - start) / len(group)
+            for job in group:
+                job.stage_metrics.add(
+                    "inference", seconds, items=len(job.recording.detections)
+                )
+        for job in jobs:
+            pprint(job.recording.detections)
+            job._set_checksum()
+
+    def _analyze_file(self):
+        self._prepare_recording()
+        self._analyze_recordings([self])
 
     def _extract_detections_as_audio(self):
         print("_extract_detections_as_audio")
+        if self.extraction_mode == "memory":
+            self.extraction_artifacts += plan_audio_clips(
+                self.recording,
+                min_conf=self.min_conf_audio_extraction,
+                fade_seconds=self.clip_fade_seconds,
+            )
+            return
+        # Clips are cut from the waveform decoded for analysis and encoded in
+        # process, instead of birdnetlib's ffmpeg export per clip.
         export_dir = self.extraction_audio_directory
-        self.recording.extract_detections_as_audio(
-            directory=export_dir, min_conf=self.min_conf_audio_extraction
+        windows = return_extraction_windows(
+            self.recording, min_conf=self.min_conf_audio_extraction
         )
+        extractor = ClipExtractor(self.recording, fade_seconds=self.clip_fade_seconds)
+        self.recording.extracted_audio_paths = extractor.write(windows, export_dir)
 
     def _extract_detections_as_spectrogram(self):
         print("_extract_detections_as_spectrogram")
+        engine = None
+        if self.spectrogram_engine == "stft":
+            engine = SpectrogramEngine(self.recording)
+        if self.extraction_mode == "memory":
+            self.extraction_artifacts += plan_spectrograms(
+                self.recording,
+                min_conf=self.min_conf_spectrogram_extraction,
+                engine=engine,
+            )
+            return
         export_dir = self.extraction_spectrogram_directory
+        if engine:
+            windows = return_extraction_windows(
+                self.recording, min_conf=self.min_conf_spectrogram_extraction
+            )
+            self.recording.extracted_spectrogram_paths = engine.write(
+                windows, export_dir
+            )
+            return
         self.recording.extract_detections_as_spectrogram(
             directory=export_dir, min_conf=self.min_conf_spectrogram_extraction
         )
 
+    def _extract_detections(self):
+        if self.extraction_pool and self.extraction_mode == "disk":
+            audio_windows = return_extraction_windows(
+                self.recording, min_conf=self.min_conf_audio_extraction
+            )
+            spectrogram_windows = return_extraction_windows(
+                self.recording, min_conf=self.min_conf_spectrogram_extraction
+            )
+            windows = len(audio_windows) + len(spectrogram_windows)
+            if windows >= MIN_PARALLEL_WINDOWS:
+                start = time.monotonic()
+                self._extract_detections_in_pool(audio_windows, spectrogram_windows)
+                # Both kinds are written at once; the time is split by count.
+                seconds = time.monotonic() - start
+                recording = self.recording
+                for stage, paths in (
+                    ("audio_extraction", recording.extracted_audio_paths),
+                    ("spectrogram_extraction", recording.extracted_spectrogram_paths),
+                ):
+                    self.stage_metrics.add(
+                        stage,
+                        seconds * len(paths) / windows,
+                        items=len(paths),
+                        bytes=return_files_bytes(paths.values()),
+                    )
+                return
+        for stage, extract, paths_field in (
+            (
+                "audio_extraction",
+                self._extract_detections_as_audio,
+                "extracted_audio_paths",
+            ),
+            (
+                "spectrogram_extraction",
+                self._extract_detections_as_spectrogram,
+                "extracted_spectrogram_paths",
+            ),
+        ):
+            # In memory mode artifacts are only planned here; rendering is
+            # counted with the uploads.
+            planned = len(self.extraction_artifacts)
+            with self.stage_metrics.time(stage) as extraction:
+                extract()
+                paths = getattr(self.recording, paths_field, None) or {}
+                extraction["items"] = (
+                    len(paths) + len(self.extraction_artifacts) - planned
+                )
+                extraction["bytes"] = return_files_bytes(paths.values())
+
+    def _extract_detections_in_pool(self, audio_windows, spectrogram_windows):
+        print("_extract_detections_in_pool")
+        # Workers read the waveform from disk: the copy a streamed recording
+        # already keeps, or one written now.
+        waveform = self.recording.ndarray
+        if isinstance(waveform, np.memmap):
+            waveform_path = waveform.filename
+        else:
+            waveform_path = self.waveform_filepath
+            np.asarray(waveform, dtype="float32").tofile(waveform_path)
+        audio_paths, spectrogram_paths = self.extraction_pool.extract(
+            waveform_path,
+            self.recording.filestem,
+            self.recording.filename,
+            audio_windows,
+            self.extraction_audio_directory,
+            spectrogram_windows,
+            self.extraction_spectrogram_directory,
+            fade_seconds=self.clip_fade_seconds,
+            spectrogram_engine=self.spectrogram_engine,
+        )
+        self.recording.extracted_audio_paths = audio_paths
+        self.recording.extracted_spectrogram_paths = spectrogram_paths
+
     def _upload_extractions(self):
         # Audio and spectrograms.
         print("_upload_extractions")
+        if self.cached_result:
+            return  # The cached detections already carry their urls.
         self.detections = self.recording.detections.copy()
 
         audio_bucket = self.queued_audio_dict["group"]["analyzer_config"][
@@ -310,35 +1142,78 @@ class Remote:
             "extraction_spectrogram_file_destination"
         ]["s3_bucket"]
 
-        _uploaded_extractions = {}
+        source_file_path = self.queued_audio_dict["audio"]["file_path"]
+        source_file_dir = os.path.dirname(source_file_path)
+
+        # Collect every clip and spectrogram, then upload them concurrently.
+        # Detections that share an extraction window share its files, so each
+        # file is uploaded once and its url given to all of them.
+        tasks = []
+        tasks_by_key = {}
+
+        def add_task(detection, filepath, bucket, url_field):
+            key = f"{source_file_dir}/{os.path.basename(filepath)}"
+            if (bucket, key) in tasks_by_key:
+                tasks_by_key[(bucket, key)][0].append(detection)
+                return
+            tasks_by_key[(bucket, key)] = (
+                [detection],
+                url_field,
+                UploadTask(filepath, bucket, key),
+            )
+            tasks.append(tasks_by_key[(bucket, key)])
+
         for detection in self.detections:
-            source_file_path = self.queued_audio_dict["audio"]["file_path"]
-            source_file_dir = os.path.dirname(source_file_path)
             if "extracted_audio_path" in detection:
-                extract_file_name = os.path.basename(detection["extracted_audio_path"])
-                key = f"{source_file_dir}/{extract_file_name}"
-                success = self._upload_file_to_s3(
-                    detection["extracted_audio_path"], audio_bucket, key
+                add_task(
+                    detection,
+                    detection["extracted_audio_path"],
+                    audio_bucket,
+                    "extracted_audio_url",
                 )
-                if success:
-                    detection[
-                        "extracted_audio_url"
-                    ] = f"https://{audio_bucket}.s3.amazonaws.com/{key}"
-
             if "extracted_spectrogram_path" in detection:
-                extract_file_name = os.path.basename(
-                    detection["extracted_spectrogram_path"]
-                )
-                key = f"{source_file_dir}/{extract_file_name}"
-                success = self._upload_file_to_s3(
-                    detection["extracted_spectrogram_path"], spectro_bucket, key
+                add_task(
+                    detection,
+                    detection["extracted_spectrogram_path"],
+                    spectro_bucket,
+                    "extracted_spectrogram_url",
                 )
-                if success:
-                    detection[
-                        "extracted_spectrogram_url"
-                    ] = f"https://{spectro_bucket}.s3.amazonaws.com/{key}"
+
+        # In-memory artifacts are likewise uploaded once per detection window.
+        detections_by_key = {}
+        for detection in self.detections:
+            key = f"{detection['start_time']}_{detection['end_time']}"
+            detections_by_key.setdefault(key, []).append(detection)
+        for artifact in self.extraction_artifacts:
+            if artifact.url_field == "extracted_audio_url":
+                bucket = audio_bucket
+            else:
+                bucket = spectro_bucket
+            key = f"{source_file_dir}/{artifact.filename}"
+            task = UploadTask(None, bucket, key, render=artifact.render)
+            detections = detections_by_key.get(artifact.detection_key, [])
+            tasks.append((detections, artifact.url_field, task))
+
+        uploader = ExtractionUploader(
+            self._upload_file_to_s3,
+            max_workers=self.upload_workers,
+            upload_fileobj_function=self._upload_fileobj_to_s3,
+        )
+        with self.stage_metrics.time("uploads") as uploads:
+            uploader.upload([task for _, _, task in tasks])
+            uploads["items"] = uploader.files_uploaded
+            uploads["bytes"] = uploader.bytes_uploaded
+
+        _uploaded_extractions = {}
+        for detections, url_field, task in tasks:
+            _uploaded_extractions[task.key] = task.success
+            if task.success:
+                for detection in detections:
+                    detection[url_field] = task.url
 
         self.uploaded_extractions = _uploaded_extractions
+        self.upload_stats = uploader.stats
+        print("_upload_extractions", self.upload_stats)
 
     def _upload_json(self):
         # Includes config (algo, min_conf, etc) and extractions
@@ -349,9 +1224,26 @@ class Remote:
             "analysis_json_file_destination"
         ]["s3_bucket"]
         source_file_path = self.queued_audio_dict["audio"]["file_path"]
-        key = f"{source_file_path}_data.json"
-        body = json.dumps(data)
-        self.client.put_object(Body=body, Bucket=bucket, Key=key)
+        with self.stage_metrics.time("json_upload") as json_upload:
+            for format in self.analysis_output_formats:
+                suffix, content_type, content_encoding = OUTPUT_FORMATS[format]
+                body = encode_analysis(
+                    data,
+                    format,
+                    audio_id=self.queued_audio_dict.get("id"),
+                    audio_file_path=source_file_path,
+                )
+                extra_args = {"ContentType": content_type}
+                if content_encoding:
+                    extra_args["ContentEncoding"] = content_encoding
+                self.client.put_object(
+                    Body=body,
+                    Bucket=bucket,
+                    Key=f"{source_file_path}{suffix}",
+                    **extra_args,
+                )
+                json_upload["items"] += 1
+                json_upload["bytes"] += len(body)
 
     def _upload_file_to_s3(self, filepath, bucket, key):
         # Upload S3 file.
@@ -366,21 +1258,63 @@ class Remote:
             print(e)
             return False
 
+    def _upload_fileobj_to_s3(self, fileobj, bucket, key):
+        # Same as _upload_file_to_s3, for extractions rendered in memory.
+        print("_upload_fileobj_to_s3", key)
+        try:
+            self.client.upload_fileobj(
+                fileobj, bucket, key, ExtraArgs={"ACL": "public-read"}
+            )
+            return True
+        except ClientError as e:
+            print(e)
+            return False
+
     def _shutdown(self):
+        self._notify_shutdown()
+        os.system("sudo shutdown now -h")
+
+    def _notify_shutdown(self):
         results_endpoint = f"{self.api_endpoint}/shutdown-instance/"
         data = {
             "analyzer_instance_id": self.instance_id,
             "number_of_runners": self.runner_count,
         }
         data["api_key"] = self.api_key  # Add api_key to outgoing request
-        response = requests.post(
+        # Idempotent: a repeat reports the same instance going down again.
+        response = self.session.post(
             results_endpoint,
             json=data,
             headers=self.api_headers,
             verify=self.verify_request,
+            idempotent=True,
         )
         print(response)
-        os.system("sudo shutdown now -h")
+        return response
+
+    def _job_copy(self):
+        # Shallow copy sharing the S3 client and analyzer cache, with fresh job state.
+        # Used by the pipeline so that several jobs can be in flight at once.
+        self.client  # Create the client once so every copy shares it.
+        job = copy.copy(self)
+        job.queued_audio_dict = None
+        job.audio_file_obj = None
+        job.audio_filepath = None
+        job.recording = None
+        job.detections = []
+        job.file_checksum = None
+        job.file_size = None
+        job.audio_format = None
+        job._ingested_filepath = None
+        job.analyzer_duration_seconds = 0
+        job.uploaded_extractions = {}
+        job.upload_stats = {}
+        job._admission = None
+        job.cached_result = None
+        job._source_etag = None
+        job.extraction_artifacts = []
+        job.stage_metrics = StageMetrics(self.metrics)
+        return job
 
     def process(self):
         # Retrieves item from queue, downloads, evaluates and returns as defined.
@@ -390,25 +1324,112 @@ class Remote:
         try:
             self.analyzer_duration_seconds = 0
             self.start_time = time.time()
-            self.queued_audio_dict = self._return_queue_item()
+            self.cached_result = None
+            self._source_etag = None
+            self.extraction_artifacts = []
+            self.stage_metrics = StageMetrics(self.metrics)
+            with self.stage_metrics.time("lease") as lease:
+                self.queued_audio_dict = self._return_queue_item()
+                lease["items"] = 1 if self.queued_audio_dict else 0
             if self.queued_audio_dict:
-                self._retrieve_file()
-                self._analyze_file()
-                self._extract_detections_as_audio()
-                self._extract_detections_as_spectrogram()
+                job_start = time.monotonic()
+                # Work already done for identical audio is reused, before or
+                # after the download.
+                if not self._lookup_cached_result(before_download=True):
+                    if not self._admit_job():
+                        self._release_queue_item(self.queued_audio_dict)
+                        return
+                    self._retrieve_file()
+                    if not self._lookup_cached_result():
+                        self._analyze_file()
+                        self._extract_detections()
+                    self._finish_admission()
                 self._upload_extractions()
+                self._store_cached_result()
                 self.analyzer_duration_seconds = round(time.time() - self.start_time, 2)
                 # Processing complete, timer stopped.
                 self._upload_json()
                 self._cleanup_files()
                 self._save_results_to_server()
+                self.lease_queue.record_job(time.monotonic() - job_start)
         except BaseException as e:
             print(e)
             # TODO: Report back to the api.
+        finally:
+            self._finish_admission()
+
+    @property
+    def stop_requested(self):
+        return self._stop_event.is_set()
+
+    def stop(self):
+        # Finish the current job, then leave run_queue.
+        self._stop_event.set()
+        if self._pipeline:
+            self._pipeline.stop()
+        if self._control_plane:
+            self._control_plane.stop()
+
+    def _startup_phase(self, name):
+        if self.startup_timer:
+            self.startup_timer.phase(name)
 
     def run_queue(self):
-        while True:
-            self.process()
-            if self.queued_audio_dict is None:
-                print("queue empty, sleep")
-                time.sleep(self.sleep_secs_on_empty_queue)
+        if self.extraction_pool:
+            self.extraction_pool.start()
+            self._startup_phase("extraction_pool")
+        if self.metrics_port:
+            self._metrics_server = MetricsServer(
+                self.metrics, self.metrics_port, host=self.metrics_host
+            ).start()
+            self._startup_phase("metrics_server")
+        if self.result_buffer:
+            # Buffered results go out by their deadline, even mid-job.
+            self._result_flusher = DeadlineFlusher(
+                self.result_buffer, self._flush_results
+            ).start()
+        try:
+            self._run_queue()
+        finally:
+            if self._metrics_server:
+                self._metrics_server.close()
+                self._metrics_server = None
+            if self._result_flusher:
+                self._result_flusher.stop()
+                self._result_flusher = None
+
+    def _run_queue(self):
+        if self.warm_up_configs_path or self.warm_up_from_api:
+            self.warm_up()
+            self._startup_phase("warm_up")
+        if self.pipeline_depth > 0:
+            self._pipeline = Pipeline(self, depth=self.pipeline_depth)
+            self._pipeline.run()
+            return
+        if self.async_jobs > 0:
+            self._control_plane = ControlPlane(
+                self,
+                max_jobs=self.async_jobs,
+                heartbeat_seconds=self.lease_heartbeat_seconds,
+            )
+            asyncio.run(self._control_plane.run())
+            return
+        # Submit anything left over from a previous run.
+        self._flush_results(flush_all=True)
+        try:
+            while not self.stop_requested:
+                poll_start = time.monotonic()
+                self.process()
+                if self.queued_audio_dict is None and not self.stop_requested:
+                    # Idle; don't let buffered results wait for the next job.
+                    self._flush_results(flush_all=True)
+                    delay = self.empty_queue_backoff.next_delay(
+                        time.monotonic() - poll_start
+                    )
+                    print("queue empty, sleep", round(delay, 2))
+                    time.sleep(delay)
+        finally:
+            self._release_leased_items()
+            self._flush_results(flush_all=True)
+            if self.extraction_pool:
+                self.extraction_pool.close()
@@ -0,0 +1,149 @@
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Detection fields that only make sense on the runner that extracted them.
+LOCAL_DETECTION_FIELDS = ("extracted_audio_path", "extracted_spectrogram_path")
+
+
+# Detections can change with the analyzer library even when the model version
+# is the same, and base_version is usually unset (the library default).
+ANALYZER_PACKAGE = "birdnetlib"
+
+
+@functools.lru_cache(maxsize=None)
+def return_analyzer_package_version():
+    try:
+        return importlib.metadata.version(ANALYZER_PACKAGE)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def return_result_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    # Stands in for the Recording and Analyzer of a job whose result was cached.
+
+    def __init__(
+        self, detections, duration, analyzer_version, analyzer_seconds, file_checksum
+    ):
+        self.detections = detections
+        self.duration = duration
+        self.analyzer_version = analyzer_version
+        self.analyzer_seconds = analyzer_seconds
+        self.file_checksum = file_checksum
+
+
+class ResultCache:
+    # Detections (with their extraction urls) of recordings already analyzed,
+    # in a SQLite database shared by every runner on the instance. Entries are
+    # found by file checksum, or before downloading by the S3 object's ETag.
+    # Both keys include the analyzer settings that affect the detections and
+    # the analyzer library version.
+
+    def __init__(self, path):
+        self.path = path
+        self.lookups = 0
+        self.hits = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " checksum_key TEXT PRIMARY KEY,"
+                " source_key TEXT,"
+                " file_checksum TEXT,"
+                " detections TEXT NOT NULL,"
+                " duration REAL,"
+                " analyzer_version TEXT,"
+                " analyzer_seconds REAL,"
+                " created REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_source_key ON results (source_key)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call, so pipeline threads never share one.
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, checksum_key=None, source_key=None):
+        if checksum_key:
+            query, key = "checksum_key = ?", checksum_key
+        else:
+            query, key = "source_key = ?", source_key
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT detections, duration, analyzer_version, analyzer_seconds,"
+                f" file_checksum FROM results WHERE {query} ORDER BY created DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        detections, *fields = row
+        return CachedResult(json.loads(detections), *fields)
+
+    def record_lookup(self, result, elapsed_seconds=0):
+        # Called once per job, hit or miss, for the hit rate.
+        with self._lock:
+            self.lookups += 1
+            if result is not None:
+                self.hits += 1
+                self.seconds_saved += max(
+                    0.0, (result.analyzer_seconds or 0) - elapsed_seconds
+                )
+
+    def put(
+        self,
+        checksum_key,
+        source_key,
+        file_checksum,
+        detections,
+        duration,
+        analyzer_version,
+        analyzer_seconds,
+    ):
+        detections = [
+            {k: v for k, v in detection.items() if k not in LOCAL_DETECTION_FIELDS}
+            for detection in detections
+        ]
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    checksum_key,
+                    source_key,
+                    file_checksum,
+                    json.dumps(detections),
+                    duration,
+                    analyzer_version,
+                    analyzer_seconds,
+                    time.time(),
+                ),
+            )
+
+    @property
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "seconds_saved": round(self.seconds_saved, 2),
+        }
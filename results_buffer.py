@@ -0,0 +1,155 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+class ResultBuffer:
+    # Completed results waiting to be submitted to the api.
+    # Every result is written to its own file before it is submitted, and the
+    # file is only removed once the api has acknowledged it, so finished work
+    # survives a crash or restart. Runners may share a directory; a lock file
+    # makes sure only one of them flushes at a time.
+
+    def __init__(
+        self,
+        directory,
+        max_results=10,
+        max_bytes=256 * 1024,
+        max_age_seconds=30,
+        max_latency_samples=100,
+    ):
+        self.directory = directory
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.max_latency_samples = max_latency_samples
+        self.flush_latencies = []
+        self.last_response = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, audio_id):
+        return os.path.join(self.directory, f"{audio_id}.json")
+
+    def add(self, audio_id, data):
+        path = self._path(audio_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"id": audio_id, "result": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def pending(self):
+        # (audio_id, path) for every unacknowledged result, oldest first.
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), name[: -len(".json")], path))
+            except FileNotFoundError:
+                continue  # Acknowledged by another runner.
+        return [(audio_id, path) for _, audio_id, path in sorted(entries)]
+
+    def should_flush(self):
+        pending = self.pending()
+        if not pending:
+            return False
+        if len(pending) >= self.max_results:
+            return True
+        sizes = [os.path.getsize(path) for _, path in pending if os.path.exists(path)]
+        if sum(sizes) >= self.max_bytes:
+            return True
+        oldest = os.path.getmtime(pending[0][1])
+        return time.time() - oldest >= self.max_age_seconds
+
+    def seconds_until_due(self):
+        # Until the oldest pending result reaches max_age_seconds; None if
+        # nothing is pending.
+        for _, path in self.pending():
+            try:
+                oldest = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            return max(0.0, oldest + self.max_age_seconds - time.time())
+        return None
+
+    def flush(self, submit):
+        # submit([(audio_id, data), ...]) posts the results and raises if the
+        # api did not accept them. Returns the number of results acknowledged.
+        # last_response is only set by a flush that was acknowledged.
+        with self._lock, open(os.path.join(self.directory, ".lock"), "w") as lock:
+            self.last_response = None
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Another runner is flushing.
+
+            results = []
+            paths = []
+            for _, path in self.pending()[: self.max_results]:
+                try:
+                    with open(path) as f:
+                        record = json.load(f)
+                    results.append((record["id"], record["result"]))
+                    paths.append(path)
+                except (FileNotFoundError, KeyError, ValueError) as e:
+                    print("ResultBuffer", path, e)
+            if not results:
+                return 0
+
+            start = time.monotonic()
+            self.last_response = submit(results)
+            latency = round(time.monotonic() - start, 3)
+            self.flush_latencies = (self.flush_latencies + [latency])[
+                -self.max_latency_samples :
+            ]
+            print("ResultBuffer flushed", len(results), "results in", latency, "s")
+
+            # Acknowledged.
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            return len(results)
+
+    def flush_all(self, submit):
+        while self.pending():
+            if not self.flush(submit):
+                break
+
+
+class DeadlineFlusher:
+    # Flushes a ResultBuffer from a background thread once its oldest result
+    # is max_age_seconds old. Otherwise results only go out when another job
+    # finishes, and a long job could hold back the result before it past its
+    # lease, so that the item is leased again and processed twice.
+    # flush() returns the number of results submitted; after a failed flush
+    # the next attempt waits max_age_seconds.
+
+    def __init__(self, buffer, flush, min_interval_seconds=1.0):
+        self.buffer = buffer
+        self.flush = flush
+        self.min_interval_seconds = min_interval_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        wait = 0
+        while not self._stop.wait(max(wait, self.min_interval_seconds)):
+            wait = self.buffer.seconds_until_due()
+            if wait is None:
+                wait = self.buffer.max_age_seconds
+            elif wait == 0:
+                wait = 0 if self.flush() else self.buffer.max_age_seconds
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
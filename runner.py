@@ -1,10 +1,18 @@
+# Started before anything else is imported, to time the whole startup.
+from startup import StartupTimer
+
+STARTUP_TIMER = StartupTimer()
+
 from dotenv import load_dotenv
 import os
-import requests
 import tempfile
+import signal
 
+from instance_metadata import return_instance_metadata
 from remote import Remote
 
+STARTUP_TIMER.phase("imports")
+
 load_dotenv(".env")
 
 API_ENDPOINT = os.environ.get("API_ENDPOINT")
@@ -14,31 +22,195 @@ S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY")
 S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY")
 RUNNER_COUNT = os.environ.get("RUNNER_COUNT", 4)
 
-response = requests.get("http://169.254.169.254/latest/meta-data/instance-type")
-INSTANCE_TYPE = response.text
+# Instance metadata is fetched once per boot and kept here for restarts.
+INSTANCE_METADATA_CACHE_PATH = os.environ.get(
+    "INSTANCE_METADATA_CACHE_PATH",
+    os.path.expanduser("~/.cache/audiospotter/instance-metadata.json"),
+)
+INSTANCE_METADATA = return_instance_metadata(
+    ["instance-type", "instance-id"], cache_path=INSTANCE_METADATA_CACHE_PATH
+)
+INSTANCE_TYPE = INSTANCE_METADATA["instance-type"]
+INSTANCE_ID = INSTANCE_METADATA["instance-id"]
+STARTUP_TIMER.phase("instance_metadata")
+
+# Sleeps after an empty queue response start at the minimum and back off, with
+# jitter, to SLEEP_AFTER_EMPTY_QUEUE_SECONDS while the queue stays empty.
+SLEEP_AFTER_EMPTY_QUEUE_SECONDS = float(
+    os.environ.get("SLEEP_AFTER_EMPTY_QUEUE_SECONDS", 30)
+)
+MIN_SLEEP_AFTER_EMPTY_QUEUE_SECONDS = float(
+    os.environ.get("MIN_SLEEP_AFTER_EMPTY_QUEUE_SECONDS", 1)
+)
+
+# Seconds the api may hold a queue request open waiting for work, for apis
+# that support long polls; 0 polls.
+LONG_POLL_SECONDS = float(os.environ.get("LONG_POLL_SECONDS", 0))
+
+# Number of jobs that may be prefetched (and finishing) while another is analyzed.
+# 0 runs jobs strictly one after another.
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH", 0))
+
+# Jobs in flight at once under the asyncio control plane, which overlaps queue
+# polls, downloads, uploads and result POSTs with inference and renews each
+# job's lease every LEASE_HEARTBEAT_SECONDS (0: a third of the lease).
+# 0 runs jobs without it.
+ASYNC_JOBS = int(os.environ.get("ASYNC_JOBS", 0))
+LEASE_HEARTBEAT_SECONDS = float(os.environ.get("LEASE_HEARTBEAT_SECONDS", 0)) or None
+
+# Concurrent S3 uploads for extracted clips and spectrograms.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+
+# Algorithm for file_checksum; md5 unless the api has been told otherwise.
+CHECKSUM_ALGORITHM = os.environ.get("CHECKSUM_ALGORITHM", "md5")
+
+# Maximum queue items to lease per request; 1 leases one item at a time.
+LEASE_BATCH_SIZE = int(os.environ.get("LEASE_BATCH_SIZE", 1))
+
+# Buffer results on disk and submit them in batches. Must outlive the process
+# (not the temporary audio directory) so unsubmitted results survive a restart.
+RESULT_BUFFER_DIRECTORY = os.environ.get("RESULT_BUFFER_DIRECTORY", None)
+
+# Analyzers kept loaded at once; least recently used ones are released.
+ANALYZER_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYZER_CACHE_MAX_ENTRIES", 4))
+ANALYZER_CACHE_MAX_BYTES = int(os.environ.get("ANALYZER_CACHE_MAX_BYTES", 0)) or None
+
+# Custom models and labels, shared by every runner on the instance and kept
+# across restarts.
+MODEL_CACHE_DIRECTORY = os.environ.get(
+    "MODEL_CACHE_DIRECTORY", os.path.expanduser("~/.cache/audiospotter/models")
+)
 
-response = requests.get("http://169.254.169.254/latest/meta-data/instance-id")
-INSTANCE_ID = response.text
+# Analyzer configs to build and warm up before the first lease: a JSON file
+# and/or the api's list of active configs.
+WARM_UP_CONFIGS_PATH = os.environ.get("WARM_UP_CONFIGS_PATH", None)
+WARM_UP_FROM_API = os.environ.get("WARM_UP_FROM_API", "") == "1"
 
-SLEEP_AFTER_EMPTY_QUEUE_SECONDS = 30
+# Recordings at least this long (seconds) are analyzed in windows of
+# STREAMING_WINDOW_SECONDS instead of being decoded whole; empty disables.
+STREAMING_MIN_DURATION_SECONDS = os.environ.get("STREAMING_MIN_DURATION_SECONDS", "")
+STREAMING_MIN_DURATION_SECONDS = (
+    float(STREAMING_MIN_DURATION_SECONDS) if STREAMING_MIN_DURATION_SECONDS else None
+)
+STREAMING_WINDOW_SECONDS = float(os.environ.get("STREAMING_WINDOW_SECONDS", 300))
+
+# Memory budget shared by every runner on the instance; a job only starts once
+# its estimated peak memory fits. Off unless MEMORY_BUDGET_DIRECTORY is set
+# (e.g. ~/.cache/audiospotter/memory), as sizing a job costs an S3 ranged GET.
+# MEMORY_BUDGET_BYTES=0 uses 80% of the instance's memory. Jobs that wait
+# ADMISSION_WAIT_SECONDS are handed back, and get priority once re-leased.
+MEMORY_BUDGET_DIRECTORY = os.path.expanduser(
+    os.environ.get("MEMORY_BUDGET_DIRECTORY", "")
+)
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_BYTES", 0)) or None
+ADMISSION_WAIT_SECONDS = int(os.environ.get("ADMISSION_WAIT_SECONDS", 60))
+
+# Chunks per TFLite invoke (1 keeps birdnetlib's chunk by chunk inference), and
+# how many downloaded recordings with the same analyzer config a pipelined
+# runner analyzes together.
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 1))
+BATCH_RECORDINGS = int(os.environ.get("BATCH_RECORDINGS", 1))
+
+# SQLite database of finished results, shared by the runners on the instance.
+# Audio that was already analyzed with the same settings isn't analyzed again.
+# Off unless set, e.g. to ~/.cache/audiospotter/results.sqlite3; the lookup costs
+# an S3 HEAD per job, and a deliberate re-run gets the cached answer.
+RESULT_CACHE_PATH = os.path.expanduser(os.environ.get("RESULT_CACHE_PATH", ""))
+
+# "memory" renders clips and spectrograms into buffers and uploads them
+# without writing to disk; "disk" keeps birdnetlib's files.
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "disk")
+
+# Linear fade in and out applied to extracted clips, in seconds.
+CLIP_FADE_SECONDS = float(os.environ.get("CLIP_FADE_SECONDS", 0))
+
+# "stft" renders spectrograms as png crops of one STFT per recording instead
+# of a matplotlib figure per detection.
+SPECTROGRAM_ENGINE = os.environ.get("SPECTROGRAM_ENGINE", "matplotlib")
+
+# Processes that write clips and spectrograms of detection-heavy recordings.
+# 0 extracts in the runner process; "auto" shares the instance's cores
+# between its RUNNER_COUNT runners.
+EXTRACTION_PROCESSES = os.environ.get("EXTRACTION_PROCESSES", "0")
+EXTRACTION_PROCESSES = (
+    None if EXTRACTION_PROCESSES == "auto" else int(EXTRACTION_PROCESSES)
+)
+
+# Comma separated files written for each analysis: json (the original
+# _data.json), json.gz, ndjson, ndjson.gz, parquet or arrow. The last two
+# need pyarrow, or the runner refuses to start.
+ANALYSIS_OUTPUT_FORMATS = os.environ.get("ANALYSIS_OUTPUT_FORMATS", "json").split(",")
+
+# Each runner serves its stage metrics in Prometheus text format at
+# http://METRICS_HOST:port/metrics, where port is METRICS_PORT plus the
+# runner's index under the supervisor. 0 disables the endpoint.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# An S3-compatible endpoint to use instead of AWS; empty uses AWS.
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "") or None
 
 PID = os.getpid()
 
 
+def create_remote(
+    audio_directory, pid=PID, runner_index=0, startup_timer=STARTUP_TIMER, **kwargs
+):
+    # Shared by the supervisor, which creates one Remote per forked worker.
+    return Remote(
+        api_endpoint=API_ENDPOINT,
+        api_key=API_KEY,
+        aws_access_key_id=S3_ACCESS_KEY,
+        aws_secret_access_key=S3_SECRET_KEY,
+        pid=pid,
+        processor_id=INSTANCE_ID,
+        processor_type=INSTANCE_TYPE,
+        audio_directory=audio_directory,
+        runner_count=RUNNER_COUNT,
+        sleep_secs_on_empty_queue=SLEEP_AFTER_EMPTY_QUEUE_SECONDS,
+        empty_queue_min_sleep_seconds=MIN_SLEEP_AFTER_EMPTY_QUEUE_SECONDS,
+        long_poll_seconds=LONG_POLL_SECONDS,
+        shutdown_on_empty_processing_queue=True,
+        pipeline_depth=PIPELINE_DEPTH,
+        async_jobs=ASYNC_JOBS,
+        lease_heartbeat_seconds=LEASE_HEARTBEAT_SECONDS,
+        upload_workers=UPLOAD_WORKERS,
+        checksum_algorithm=CHECKSUM_ALGORITHM,
+        lease_batch_size=LEASE_BATCH_SIZE,
+        result_buffer_directory=RESULT_BUFFER_DIRECTORY,
+        analyzer_cache_max_entries=ANALYZER_CACHE_MAX_ENTRIES,
+        analyzer_cache_max_bytes=ANALYZER_CACHE_MAX_BYTES,
+        model_cache_directory=MODEL_CACHE_DIRECTORY,
+        warm_up_configs_path=WARM_UP_CONFIGS_PATH,
+        warm_up_from_api=WARM_UP_FROM_API,
+        streaming_min_duration_seconds=STREAMING_MIN_DURATION_SECONDS,
+        streaming_window_seconds=STREAMING_WINDOW_SECONDS,
+        memory_budget_directory=MEMORY_BUDGET_DIRECTORY,
+        memory_budget_bytes=MEMORY_BUDGET_BYTES,
+        admission_wait_seconds=ADMISSION_WAIT_SECONDS,
+        inference_batch_size=INFERENCE_BATCH_SIZE,
+        batch_recordings=BATCH_RECORDINGS,
+        result_cache_path=RESULT_CACHE_PATH or None,
+        extraction_mode=EXTRACTION_MODE,
+        clip_fade_seconds=CLIP_FADE_SECONDS,
+        spectrogram_engine=SPECTROGRAM_ENGINE,
+        extraction_processes=EXTRACTION_PROCESSES,
+        analysis_output_formats=ANALYSIS_OUTPUT_FORMATS,
+        metrics_port=METRICS_PORT + runner_index if METRICS_PORT else None,
+        metrics_host=METRICS_HOST,
+        s3_endpoint_url=S3_ENDPOINT_URL,
+        startup_timer=startup_timer,
+        **kwargs,
+    )
+
+
 def main():
     with tempfile.TemporaryDirectory() as temp_dir:
-        remote = Remote(
-            api_endpoint=API_ENDPOINT,
-            api_key=API_KEY,
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-            pid=PID,
-            processor_id=INSTANCE_ID,
-            processor_type=INSTANCE_TYPE,
-            audio_directory=temp_dir,
-            runner_count=RUNNER_COUNT,
-            shutdown_on_empty_processing_queue=True,
-        )
+        remote = create_remote(temp_dir)
+        STARTUP_TIMER.phase("remote")
+        # systemd stops the service with SIGTERM; finish the current job and
+        # hand back any leased items before exiting.
+        signal.signal(signal.SIGTERM, lambda signum, frame: remote.stop())
         remote.run_queue()
 
 
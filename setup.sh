@@ -51,6 +51,15 @@ mkdir extractions
 
 # Start services
 
+if [ "$RUNNER_MODE" = "supervisor" ]; then
+    # One service that loads the model once and forks $RUNNER_COUNT workers.
+    sudo cp /home/ubuntu/audiospotter-aws-ec2/supervisor.service /etc/systemd/system/supervisor.service
+    sudo systemctl enable supervisor
+    sudo systemctl daemon-reload
+    sudo systemctl start supervisor
+    RUNNER_COUNT=0
+fi
+
 for (( c=1; c<=$RUNNER_COUNT; c++ ))
 do
     sudo cp /home/ubuntu/audiospotter-aws-ec2/runner.service /etc/systemd/system/runner_$c.service
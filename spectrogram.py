@@ -0,0 +1,167 @@
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+SAMPLE_RATE = 48000
+
+# Frames of 512 samples every 256: ~94Hz per row, ~5.3ms per column.
+NFFT = 512
+HOP = 256
+
+# Pixels more than this far below the loudest one in the image are black.
+DYNAMIC_RANGE_DB = 80
+
+# The STFT of a recording is computed in tiles of this many seconds, on
+# demand, and the most recently used MAX_TILES are kept.
+TILE_SECONDS = 60
+MAX_TILES = 4
+
+# zlib level; higher levels are several times slower for ~15% smaller files.
+PNG_COMPRESSION = 1
+
+# Viridis at 9 evenly spaced points; interpolated into a 256 entry table.
+VIRIDIS_ANCHORS = [
+    (68, 1, 84),
+    (71, 45, 123),
+    (59, 82, 139),
+    (44, 114, 142),
+    (33, 145, 140),
+    (40, 174, 128),
+    (94, 201, 98),
+    (173, 220, 48),
+    (253, 231, 37),
+]
+
+
+def return_colormap_lut(anchors=VIRIDIS_ANCHORS):
+    anchors = np.array(anchors, dtype="float32")
+    positions = np.linspace(0, 255, len(anchors))
+    levels = np.arange(256)
+    lut = [np.interp(levels, positions, anchors[:, channel]) for channel in range(3)]
+    return np.round(np.stack(lut, axis=1)).astype(np.uint8)
+
+
+COLORMAP_LUT = return_colormap_lut()
+
+
+def _png_chunk(tag, data):
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    )
+
+
+def encode_png(rgb, compression=PNG_COMPRESSION):
+    # rgb is a (height, width, 3) uint8 array; every row uses filter type 0.
+    height, width, _ = rgb.shape
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), compression))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+class SpectrogramEngine:
+    # Renders every spectrogram of a recording from one STFT of the waveform
+    # decoded for analysis, instead of a matplotlib figure per detection. An
+    # image is the columns of the detection's window, up to top Hz, scaled to
+    # DYNAMIC_RANGE_DB below its loudest pixel and colored through a lookup
+    # table. Safe to render from several upload workers at once.
+
+    format = "png"
+
+    def __init__(
+        self,
+        recording,
+        top=14000,
+        nfft=NFFT,
+        hop=HOP,
+        tile_seconds=TILE_SECONDS,
+        max_tiles=MAX_TILES,
+        dynamic_range_db=DYNAMIC_RANGE_DB,
+    ):
+        self.recording = recording
+        self.nfft = nfft
+        self.hop = hop
+        self.rows = int(top * nfft / SAMPLE_RATE) + 1
+        self.tile_frames = max(1, int(tile_seconds * SAMPLE_RATE) // hop)
+        self.max_tiles = max_tiles
+        self.dynamic_range_db = dynamic_range_db
+        self.window = np.hanning(nfft).astype("float32")
+        self.tiles_computed = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _samples(self, start, end):
+        if self.recording.ndarray is not None:
+            return np.asarray(self.recording.ndarray[start:end], dtype="float32")
+        return self.recording.get_extract_array(start / SAMPLE_RATE, end / SAMPLE_RATE)
+
+    def _compute_tile(self, index):
+        # Power in dB, (rows, frames), for frames index * tile_frames onwards.
+        start = index * self.tile_frames * self.hop
+        samples = self._samples(
+            start, start + (self.tile_frames - 1) * self.hop + self.nfft
+        )
+        if len(samples) < self.nfft:
+            samples = np.pad(samples, (0, self.nfft - len(samples)))
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.nfft)[
+            :: self.hop
+        ]
+        spectrum = np.fft.rfft(frames * self.window, axis=1)[:, : self.rows]
+        power = spectrum.real**2 + spectrum.imag**2
+        return (10 * np.log10(power + 1e-12)).T.astype("float32")
+
+    def _tile(self, index):
+        with self._lock:
+            if index in self._tiles:
+                self._tiles.move_to_end(index)
+                return self._tiles[index]
+            tile = self._compute_tile(index)
+            self.tiles_computed += 1
+            self._tiles[index] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+            return tile
+
+    def power_db(self, start_sec, end_sec):
+        # The frames that lie entirely within start_sec, end_sec.
+        first = int(np.ceil(start_sec * SAMPLE_RATE / self.hop))
+        last = max(first + 1, int((end_sec * SAMPLE_RATE - self.nfft) // self.hop) + 1)
+        columns = []
+        tiles = range(first // self.tile_frames, (last - 1) // self.tile_frames + 1)
+        for index in tiles:
+            offset = index * self.tile_frames
+            tile = self._tile(index)
+            columns.append(tile[:, max(first - offset, 0) : last - offset])
+        return np.concatenate(columns, axis=1)
+
+    def image(self, start_sec, end_sec):
+        # (rows, columns, 3) uint8, low frequencies at the bottom.
+        db = self.power_db(start_sec, end_sec)
+        floor = db.max() - self.dynamic_range_db
+        levels = (db - floor) * (255 / self.dynamic_range_db)
+        return COLORMAP_LUT[np.clip(levels, 0, 255).astype(np.uint8)[::-1]]
+
+    def render(self, start_sec, end_sec):
+        return encode_png(self.image(start_sec, end_sec))
+
+    def write(self, windows, directory):
+        # Same paths as birdnetlib's extract_detections_as_spectrogram, as png.
+        paths = {}
+        for key, (start_sec, end_sec) in windows.items():
+            path = f"{directory}/{self.recording.filestem}_{start_sec}s-{end_sec}s.png"
+            with open(path, "wb") as f:
+                f.write(self.render(start_sec, end_sec))
+            paths[key] = path
+        return paths
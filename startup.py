@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+
+
+# A runner restarted by systemd should be polling again within this long.
+TARGET_SECONDS = 1.0
+
+
+def return_process_start_time():
+    # Wall clock time this process started, so that interpreter startup is
+    # counted too; None where /proc isn't available.
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces; the
+            # start time (field 22) is the 20th of them.
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - age
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    # Times each phase from process start to the first queue poll, and prints
+    # the breakdown once that poll is answered. phase() ends the named phase.
+
+    def __init__(self, target_seconds=TARGET_SECONDS):
+        self.target_seconds = target_seconds
+        self.started = return_process_start_time() or time.time()
+        self.phases = []  # (name, seconds)
+        self.reported = False
+        self._last = self.started
+        self._lock = threading.Lock()
+        self.phase("interpreter")
+
+    def phase(self, name):
+        with self._lock:
+            if self.reported:
+                return
+            now = time.time()
+            self.phases.append((name, max(0.0, now - self._last)))
+            self._last = now
+
+    @property
+    def total_seconds(self):
+        return self._last - self.started
+
+    def first_poll(self):
+        self.phase("first_poll")
+        with self._lock:
+            if self.reported:
+                return
+            self.reported = True
+        total = self.total_seconds
+        print(
+            "startup",
+            os.getpid(),
+            f"first queue poll after {total:.3f}s",
+            "(over target)" if total > self.target_seconds else "",
+        )
+        for name, seconds in self.phases:
+            print(f"  {name:<20}{seconds:>8.3f}s")
@@ -0,0 +1,163 @@
+import numpy as np
+import soundfile
+import soxr
+from os import path
+from pathlib import Path
+
+from birdnetlib.main import RecordingBase
+
+from admission import DEFAULT_WINDOW_SECONDS
+
+
+SAMPLE_RATE = 48000
+
+# Same as birdnetlib: a trailing chunk shorter than this is dropped.
+MIN_CHUNK_SECONDS = 1.5
+
+
+def return_duration(filepath):
+    # Reads the duration from the header only; None if soundfile can't open it.
+    try:
+        return soundfile.info(filepath).duration
+    except RuntimeError:
+        return None
+
+
+def to_mono(block):
+    if block.ndim > 1:
+        return block.mean(axis=1)
+    return block
+
+
+class StreamingRecording(RecordingBase):
+    # A birdnetlib Recording that decodes and analyzes the file one window at a
+    # time, so peak memory depends on window_seconds rather than on the length
+    # of the recording. Windows are aligned to the 3 second chunk grid and any
+    # samples not yet covered by a chunk are carried into the next window, so
+    # for 48kHz input the detections match a whole-file analysis exactly.
+    # Other rates are resampled with soxr as they stream, where birdnetlib uses
+    # librosa's kaiser_fast on the whole file; the chunks and detections are
+    # the same, but samples (and so confidences) differ slightly.
+
+    def __init__(
+        self,
+        analyzer,
+        path,
+        window_seconds=DEFAULT_WINDOW_SECONDS,
+        min_conf=0.1,
+        overlap=0.0,
+        waveform_path=None,
+    ):
+        self.path = path
+        self.filestem = Path(self.path).stem
+        self.window_seconds = window_seconds
+        # If set, the decoded 48kHz waveform is written here during analysis and
+        # memory-mapped afterwards, so clips are cut without decoding again.
+        self.waveform_path = waveform_path
+        super().__init__(analyzer, min_conf=min_conf, overlap=overlap)
+
+    @property
+    def filename(self):
+        return path.basename(self.path)
+
+    def _read_windows(self, window_samples):
+        # Yields float32 mono blocks at SAMPLE_RATE; the resampler keeps its
+        # state between blocks so there are no discontinuities at the edges.
+        with soundfile.SoundFile(self.path) as f:
+            rate = f.samplerate
+            resampler = None
+            if rate != SAMPLE_RATE:
+                resampler = soxr.ResampleStream(rate, SAMPLE_RATE, 1, dtype="float32")
+            frames = int(np.ceil(window_samples * rate / SAMPLE_RATE))
+            while True:
+                block = to_mono(f.read(frames, dtype="float32"))
+                last = len(block) < frames
+                if resampler:
+                    block = resampler.resample_chunk(block, last=last)
+                yield block, last
+                if last:
+                    return
+
+    def _chunk(self, buffer, last):
+        # Splits buffer like RecordingBase.process_audio_data, but only into
+        # complete chunks unless this is the end of the file. Returns the chunks
+        # and the number of samples consumed.
+        chunk_samples = int(self.sample_secs * SAMPLE_RATE)
+        step_samples = int((self.sample_secs - self.overlap) * SAMPLE_RATE)
+        min_samples = int(MIN_CHUNK_SECONDS * SAMPLE_RATE)
+
+        chunks = []
+        start = 0
+        while start < len(buffer):
+            split = buffer[start : start + chunk_samples]
+            if len(split) < chunk_samples:
+                if not last or len(split) < min_samples:
+                    break
+                padded = np.zeros(chunk_samples)
+                padded[: len(split)] = split
+                split = padded
+            chunks.append(split)
+            start += step_samples
+        return chunks, min(start, len(buffer))
+
+    def read_audio_data(self):
+        # Decoding happens window by window inside analyze().
+        pass
+
+    def analyze(self):
+        if self.week_48 != -1:
+            self.week_48 = max(1, min(self.week_48, 48))
+
+        step_samples = int((self.sample_secs - self.overlap) * SAMPLE_RATE)
+        chunks_per_window = max(
+            1, int(self.window_seconds * SAMPLE_RATE // step_samples)
+        )
+
+        detection_list = []
+        buffer = np.zeros(0, dtype="float32")
+        offset_samples = 0
+        total_samples = 0
+        waveform_file = open(self.waveform_path, "wb") if self.waveform_path else None
+        for block, last in self._read_windows(chunks_per_window * step_samples):
+            total_samples += len(block)
+            if waveform_file:
+                waveform_file.write(np.asarray(block, dtype="float32").tobytes())
+            buffer = np.concatenate([buffer, block])
+            chunks, consumed = self._chunk(buffer, last)
+            if chunks:
+                self.chunks = chunks
+                self.analyzer.analyze_recording(self)
+                offset = offset_samples / SAMPLE_RATE
+                for detection in self.detection_list:
+                    detection.start_time += offset
+                    detection.end_time += offset
+                detection_list.extend(self.detection_list)
+            buffer = buffer[consumed:]
+            offset_samples += consumed
+
+        if waveform_file:
+            waveform_file.close()
+            if total_samples:
+                self.ndarray = np.memmap(
+                    self.waveform_path,
+                    dtype="float32",
+                    mode="r",
+                    shape=(total_samples,),
+                )
+
+        self.chunks = []
+        self.detection_list = detection_list
+        self.duration = total_samples / SAMPLE_RATE
+        self.analyzed = True
+
+    def get_extract_array(self, start_sec, end_sec):
+        if self.ndarray is not None:
+            return super().get_extract_array(start_sec, end_sec)
+        # Decodes only the requested segment instead of the whole recording.
+        with soundfile.SoundFile(self.path) as f:
+            rate = f.samplerate
+            f.seek(int(start_sec * rate))
+            block = to_mono(f.read(int((end_sec - start_sec) * rate), dtype="float32"))
+        if rate != SAMPLE_RATE:
+            block = soxr.resample(block, rate, SAMPLE_RATE)
+        return block
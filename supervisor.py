@@ -0,0 +1,206 @@
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from startup import StartupTimer
+
+
+# Comma separated model versions to load before forking; empty loads the
+# birdnetlib default model.
+PRELOAD_ANALYZER_VERSIONS = os.environ.get("PRELOAD_ANALYZER_VERSIONS", "")
+
+# Seconds between restarts of a worker that keeps crashing.
+RESTART_DELAY_SECONDS = 5
+MAX_RESTART_DELAY_SECONDS = 300
+
+# A worker that hasn't reported an empty queue within this window is treated as busy.
+IDLE_REPORT_WINDOW_SECONDS = 120
+
+
+class ShutdownCoordinator:
+    # Passed to each worker's Remote. Workers record when they last saw an empty
+    # processing queue (0 while busy) in an array shared with the supervisor.
+
+    def __init__(self, idle_since, index):
+        self.idle_since = idle_since
+        self.index = index
+
+    def report_idle(self):
+        self.idle_since[self.index] = time.time()
+
+    def report_busy(self):
+        self.idle_since[self.index] = 0
+
+
+class Supervisor:
+    # Loads analyzers once, then forks worker processes that share the loaded
+    # model pages copy-on-write. Crashed workers are re-forked from the same
+    # parent, so TensorFlow and the models are never loaded again.
+
+    def __init__(
+        self,
+        worker_count,
+        create_remote,
+        preload_versions=None,
+        idle_report_window_seconds=IDLE_REPORT_WINDOW_SECONDS,
+        startup_timer=None,
+    ):
+        self.worker_count = worker_count
+        self.create_remote = create_remote
+        self.preload_versions = preload_versions if preload_versions else [None]
+        self.idle_report_window_seconds = idle_report_window_seconds
+        self.preloaded_analyzers = {}
+        self.idle_since = multiprocessing.Array("d", worker_count, lock=False)
+        self.workers = {}  # pid: index
+        self.restarts = [0] * worker_count
+        self.restart_at = {}  # index: time a crashed worker is due to restart
+        self.stopping = False
+        # Each worker reports its own first queue poll, from a forked copy.
+        self.startup_timer = startup_timer
+
+    def preload(self):
+        from birdnetlib.analyzer import Analyzer
+        from remote import return_analyzer_model_key
+
+        for version in self.preload_versions:
+            analyzer_config = {"analyzer": {}}
+            analyzer_kwargs = {}
+            if version:
+                analyzer_config["analyzer"]["base_version"] = version
+                analyzer_kwargs["version"] = version
+            key = return_analyzer_model_key(analyzer_config)
+            print("preload analyzer", version or "default")
+            self.preloaded_analyzers[key] = Analyzer(**analyzer_kwargs)
+
+    def _run_worker(self, index):
+        # Runs in the forked child; drop the supervisor's view of its siblings.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.workers = {}
+        kwargs = {}
+        if self.startup_timer:
+            # A restarted worker only times its own startup, from the fork.
+            kwargs["startup_timer"] = (
+                StartupTimer() if self.restarts[index] else self.startup_timer
+            )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            remote = self.create_remote(
+                temp_dir,
+                pid=os.getpid(),
+                runner_index=index,
+                preloaded_analyzers=self.preloaded_analyzers,
+                shutdown_coordinator=ShutdownCoordinator(self.idle_since, index),
+                **kwargs,
+            )
+            signal.signal(signal.SIGTERM, lambda signum, frame: remote.stop())
+            remote.run_queue()
+
+    def _start_worker(self, index):
+        self.idle_since[index] = 0
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(index)
+            except BaseException as e:
+                print("worker", index, e)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        print("started worker", index, "pid", pid)
+        self.workers[pid] = index
+
+    def all_workers_idle(self):
+        now = time.time()
+        return all(
+            0 < self.idle_since[index]
+            and now - self.idle_since[index] <= self.idle_report_window_seconds
+            for index in range(self.worker_count)
+        )
+
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self):
+        # Schedule a restart of any worker that exited, backing off if it keeps
+        # crashing. The restart itself is left to run(), so that other workers
+        # are still reaped and a stop() during the backoff cancels it.
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            index = self.workers.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            print("worker", index, "exited with status", status)
+            # A dead worker isn't idle.
+            self.idle_since[index] = 0
+            self.restarts[index] += 1
+            delay = min(
+                RESTART_DELAY_SECONDS * self.restarts[index], MAX_RESTART_DELAY_SECONDS
+            )
+            self.restart_at[index] = time.time() + delay
+
+    def _restart_due_workers(self):
+        now = time.time()
+        for index, restart_at in list(self.restart_at.items()):
+            # stop() may have been called from the SIGTERM handler meanwhile.
+            if restart_at <= now and not self.stopping:
+                del self.restart_at[index]
+                self._start_worker(index)
+
+    def shutdown_instance(self):
+        # Only one process posts the shutdown, on behalf of every worker.
+        remote = self.create_remote(".", pid=os.getpid())
+        remote.runner_count = self.worker_count
+        remote._shutdown()
+
+    def run(self, poll_seconds=1):
+        self.preload()
+        if self.startup_timer:
+            self.startup_timer.phase("preload")
+        for index in range(self.worker_count):
+            self._start_worker(index)
+
+        while self.workers or self.restart_at:
+            self._reap()
+            if self.stopping:
+                self.restart_at.clear()
+                time.sleep(poll_seconds)
+                continue
+            self._restart_due_workers()
+            if self.all_workers_idle():
+                print("all workers idle, shutting down instance")
+                self.stop()
+                while self.workers:
+                    pid, _ = os.wait()
+                    self.workers.pop(pid, None)
+                self.shutdown_instance()
+                return
+            time.sleep(poll_seconds)
+
+
+def main():
+    from runner import RUNNER_COUNT, STARTUP_TIMER, create_remote
+
+    versions = [v.strip() for v in PRELOAD_ANALYZER_VERSIONS.split(",")]
+    supervisor = Supervisor(
+        int(RUNNER_COUNT),
+        create_remote,
+        preload_versions=[v for v in versions if v],
+        startup_timer=STARTUP_TIMER,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from remote import Remote
+from admission import MemoryBudget, RssSampler, estimate_job_bytes, JOB_BASE_BYTES
+
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from io import BytesIO
+from unittest.mock import patch
+import boto3
+import json
+import os
+import threading
+import time
+
+from .utils import FakeQueueAPI
+
+
+def make_item(item_id=1, file_path="PROJECT/GROUP/file.flac"):
+    return {
+        "id": item_id,
+        "audio": {
+            "file_path": file_path,
+            "file_source": {"s3_bucket": "non-existant-bucket"},
+        },
+        "group": {"analyzer_config": {"id": 2, "analyzer": {}}},
+    }
+
+
+def make_flac_header(sample_rate, total_samples):
+    info = (sample_rate << 44) | (0 << 41) | (15 << 36) | total_samples
+    return b"fLaC" + b"\x00" * 14 + info.to_bytes(8, "big") + b"\x00" * 38
+
+
+def stub_header_request(header, size, key="PROJECT/GROUP/file.flac"):
+    s3_client = boto3.client("s3")
+    stubber = Stubber(s3_client)
+    stubber.add_response(
+        "get_object",
+        {
+            "Body": StreamingBody(BytesIO(header), len(header)),
+            "ContentLength": len(header),
+            "ContentRange": f"bytes 0-{len(header) - 1}/{size}",
+        },
+        {"Bucket": "non-existant-bucket", "Key": key, "Range": "bytes=0-63"},
+    )
+    stubber.activate()
+    return s3_client
+
+
+def test_estimate_uses_header_duration(tmp_path):
+    remote = Remote(memory_budget_directory=str(tmp_path))
+    remote.queued_audio_dict = make_item()
+    # An hour of 48kHz FLAC, whatever its compressed size.
+    remote._client = stub_header_request(make_flac_header(48000, 48000 * 3600), 10**6)
+    assert remote._estimate_job_bytes() == estimate_job_bytes(3600)
+
+    # Streamed recordings are sized by their window.
+    remote.streaming_min_duration_seconds = 600
+    remote._client = stub_header_request(make_flac_header(48000, 48000 * 3600), 10**6)
+    assert remote._estimate_job_bytes() == estimate_job_bytes(
+        remote.streaming_window_seconds
+    )
+
+    # No duration in the header: assume a low bit rate for the size.
+    remote.streaming_min_duration_seconds = None
+    remote.queued_audio_dict = make_item(file_path="PROJECT/GROUP/file.mp3")
+    remote._client = stub_header_request(
+        b"ID3" + b"\x00" * 61, 8000 * 60, key="PROJECT/GROUP/file.mp3"
+    )
+    assert remote._estimate_job_bytes() == estimate_job_bytes(60)
+
+
+def test_memory_budget_reserve_release_and_calibrate(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=1000)
+    # The first job always fits, even if it is over budget on its own.
+    assert budget.reserve("a", 1500) == 1500
+    assert budget.reserve("b", 100) is None
+    budget.release("a")
+    assert budget.reserve("b", 600) == 600
+    assert budget.reserve("c", 300) == 300
+    assert budget.reserve("d", 200) is None
+    assert budget.bytes_reserved == 900
+
+    # Another runner sharing the directory sees the same reservations.
+    other = MemoryBudget(str(tmp_path), max_bytes=1000)
+    assert other.reserve("e", 200) is None
+
+    # Reservations of processes that are gone don't hold memory.
+    state_path = os.path.join(str(tmp_path), "state.json")
+    with open(state_path) as f:
+        state = json.load(f)
+    state["reservations"]["b"]["pid"] = 2**22 + 1
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+    assert budget.bytes_reserved == 300
+
+    # Jobs that use twice the prediction raise later estimates.
+    budget.release("c", predicted_bytes=300, actual_bytes=600)
+    assert budget.calibration == 1.2
+    assert budget.reserve("f", 100) == 120
+    with open(os.path.join(str(tmp_path), "calibration.jsonl")) as f:
+        record = json.loads(f.readline())
+    assert record["predicted_bytes"] == 300
+    assert record["actual_bytes"] == 600
+
+
+def test_job_that_does_not_fit_is_handed_back(tmp_path):
+    api = FakeQueueAPI(items=[make_item()])
+    remote = Remote(
+        api_endpoint="http://example.com",
+        memory_budget_directory=str(tmp_path),
+        memory_budget_bytes=JOB_BASE_BYTES * 2,
+        admission_wait_seconds=0,
+    )
+    remote.memory_budget.reserve("other-runner", JOB_BASE_BYTES * 2)
+
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(
+        Remote, "_estimate_job_bytes", return_value=JOB_BASE_BYTES
+    ), patch.object(
+        Remote, "_retrieve_file"
+    ) as mocked_retrieve:
+        remote.process()
+
+    mocked_retrieve.assert_not_called()
+    assert api.released == [1]
+    assert remote.memory_budget.rejections == 1
+
+    # Once memory is free the job is admitted, and its reservation is
+    # released after analysis with the measured peak recorded.
+    remote.memory_budget.release("other-runner")
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(
+        Remote, "_estimate_job_bytes", return_value=JOB_BASE_BYTES
+    ), patch.object(
+        Remote, "_retrieve_file"
+    ) as mocked_retrieve, patch.object(
+        Remote, "_analyze_file", side_effect=ValueError("analysis failed")
+    ):
+        remote.process()
+    mocked_retrieve.assert_called_once()
+    assert remote._admission is None
+    assert remote.memory_budget.bytes_reserved == 0
+
+
+def test_job_waiting_longest_gets_priority(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=1000, priority_after_seconds=0)
+    assert budget.reserve("a", 600, job_id=1) == 600
+    # Too big to fit beside anything; it has to wait for the instance to drain.
+    assert budget.reserve("big", 1500, job_id=2) is None
+    # A job that would fit isn't admitted ahead of it.
+    assert budget.reserve("c", 100, job_id=3) is None
+    budget.release("a")
+    assert budget.reserve("big", 1500, job_id=2) == 1500
+    budget.release("big")
+    assert budget.reserve("c", 100, job_id=3) == 100
+
+    # A waiter that was handed back and isn't waiting any more blocks nothing.
+    assert budget.reserve("big", 1500, job_id=2) is None
+    with patch("admission.ACTIVE_WAITER_SECONDS", -1):
+        assert budget.reserve("d", 100, job_id=4) == 100
+
+
+def test_rss_is_only_attributed_to_a_job_running_alone():
+    alone = RssSampler()
+    assert alone.stop() is not None
+
+    first = RssSampler()
+    second = RssSampler()
+    assert second.stop() is None
+    assert first.stop() is None
+
+    # Loading an analyzer isn't counted against the job that triggered it.
+    loading = RssSampler()
+    RssSampler.discard_active()
+    assert loading.stop() is None
+    assert RssSampler().stop() is not None
+
+
+def test_calibration_only_drops_below_one_for_a_fresh_process(tmp_path):
+    budget = MemoryBudget(str(tmp_path), max_bytes=1000)
+    # A job in a long-lived process read a quarter of its prediction.
+    budget.release("a", predicted_bytes=400, actual_bytes=100, fresh=False)
+    assert budget.calibration == 1.0
+    budget.release("b", predicted_bytes=400, actual_bytes=100, fresh=True)
+    assert budget.calibration == 0.85
+    # Later stale readings don't take it further down.
+    budget.release("c", predicted_bytes=400, actual_bytes=100, fresh=False)
+    assert budget.calibration == 0.85
+
+
+def test_stop_interrupts_a_job_waiting_for_admission(tmp_path):
+    remote = Remote(
+        memory_budget_directory=str(tmp_path),
+        memory_budget_bytes=JOB_BASE_BYTES * 2,
+        admission_wait_seconds=60,
+    )
+    remote.memory_budget.reserve("other-runner", JOB_BASE_BYTES * 2)
+    job = remote._job_copy()
+    job.queued_audio_dict = make_item()
+    threading.Timer(0.2, remote.stop).start()
+    start = time.monotonic()
+    with patch.object(Remote, "_estimate_job_bytes", return_value=JOB_BASE_BYTES):
+        assert job._admit_job() is False
+    assert time.monotonic() - start < 5
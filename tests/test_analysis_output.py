@@ -0,0 +1,101 @@
+from remote import Remote
+from analysis_output import encode_analysis
+
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+import gzip
+import json
+import pytest
+
+
+def make_remote(formats):
+    remote = Remote(analysis_output_formats=formats)
+    remote._client = MagicMock()
+    remote.analyzer = MagicMock(version="2.4")
+    remote.recording = MagicMock(duration=60.0)
+    remote.file_checksum = "abc"
+    remote.queued_audio_dict = {
+        "id": 7,
+        "audio": {"file_path": "PROJECT/GROUP/file.wav"},
+        "group": {
+            "analyzer_config": {
+                "id": 3,
+                "analysis_json_file_destination": {"s3_bucket": "json-bucket"},
+            }
+        },
+    }
+    remote.detections = [
+        {
+            "common_name": "American Robin",
+            "confidence": 0.9,
+            "start_time": 3.0,
+            "end_time": 6.0,
+            "extracted_audio_path": "/tmp/clip.flac",
+            "extracted_audio_url": "https://clip-bucket/clip.flac",
+        },
+        {"common_name": "Wren", "confidence": 0.5, "start_time": 9.0, "end_time": 12.0},
+    ]
+    return remote
+
+
+def uploads(remote):
+    return {
+        call.kwargs["Key"]: call.kwargs for call in remote._client.put_object.mock_calls
+    }
+
+
+def test_json_and_ndjson_outputs():
+    remote = make_remote(["json", "json.gz", "ndjson.gz"])
+    remote._upload_json()
+    uploaded = uploads(remote)
+
+    plain = uploaded["PROJECT/GROUP/file.wav_data.json"]
+    assert plain["Bucket"] == "json-bucket"
+    assert plain["ContentType"] == "application/json"
+    assert "ContentEncoding" not in plain
+    data = json.loads(plain["Body"])
+    assert data["analyzer_config"]["id"] == 3
+
+    compressed = uploaded["PROJECT/GROUP/file.wav_data.json.gz"]
+    assert compressed["ContentEncoding"] == "gzip"
+    assert json.loads(gzip.decompress(compressed["Body"])) == data
+
+    rows = uploaded["PROJECT/GROUP/file.wav_detections.ndjson.gz"]
+    assert rows["ContentType"] == "application/x-ndjson"
+    lines = gzip.decompress(rows["Body"]).decode("utf-8").splitlines()
+    robin, wren = map(json.loads, lines)
+    assert robin["audio_id"] == 7
+    assert robin["file_checksum"] == "abc"
+    assert robin["extracted_audio_url"] == "https://clip-bucket/clip.flac"
+    assert "extracted_audio_path" not in robin
+    assert wren["common_name"] == "Wren"
+
+    with pytest.raises(ValueError):
+        Remote(analysis_output_formats=["csv"])
+
+
+def test_parquet_output():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    remote = make_remote(["parquet"])
+    remote._upload_json()
+    upload = uploads(remote)["PROJECT/GROUP/file.wav_detections.parquet"]
+    assert upload["ContentType"] == "application/vnd.apache.parquet"
+
+    table = pyarrow.parquet.read_table(BytesIO(upload["Body"]))
+    assert table.column("confidence").to_pylist() == [0.9, 0.5]
+    assert table.column("extracted_audio_url").to_pylist()[1] is None
+    analysis = json.loads(table.schema.metadata[b"analysis"])
+    assert analysis["duration_seconds"] == 60.0
+    assert encode_analysis({"detections": [], **analysis}, "arrow")[:6] == b"ARROW1"
+
+
+def test_columnar_formats_without_pyarrow_fail_at_startup():
+    with patch("analysis_output.importlib.import_module", side_effect=ImportError):
+        with pytest.raises(ValueError, match="requires pyarrow"):
+            Remote(analysis_output_formats=["json", "parquet"])
+        # Formats that don't need it are unaffected.
+        Remote(analysis_output_formats=["json", "ndjson.gz"])
+    with pytest.raises(ValueError, match="Unknown"):
+        Remote(analysis_output_formats=["csv"])
@@ -0,0 +1,77 @@
+from remote import Remote
+from analyzer_cache import AnalyzerCache
+
+from unittest.mock import patch
+
+
+class FakeAnalyzer:
+    def __init__(self, name):
+        self.name = name
+        self.interpreter = object()
+        self.custom_interpreter = None
+
+
+def test_lru_eviction_by_entry_count():
+    cache = AnalyzerCache(max_entries=2, estimate_bytes=lambda analyzer: 0)
+    a, b, c = FakeAnalyzer("a"), FakeAnalyzer("b"), FakeAnalyzer("c")
+    cache["a"] = a
+    cache["b"] = b
+    assert cache.get("a") is a  # a is now the most recently used.
+    cache["c"] = c
+
+    assert cache.keys() == ["a", "c"]
+    assert cache.evictions == 1
+    # The evicted analyzer's interpreter is released.
+    assert b.interpreter is None
+    assert a.interpreter is not None
+    assert cache.get("b") is None
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_lru_eviction_by_memory_budget():
+    sizes = {"a": 60, "b": 30, "c": 50}
+    cache = AnalyzerCache(
+        max_entries=10,
+        max_bytes=100,
+        estimate_bytes=lambda analyzer: sizes[analyzer.name],
+    )
+    cache["a"] = FakeAnalyzer("a")
+    cache["b"] = FakeAnalyzer("b")
+    assert cache.bytes_used == 90
+    cache["c"] = FakeAnalyzer("c")
+    assert cache.keys() == ["b", "c"]
+    assert cache.bytes_used == 80
+
+    # A single analyzer over budget is still kept.
+    sizes["d"] = 500
+    cache["d"] = FakeAnalyzer("d")
+    assert cache.keys() == ["d"]
+
+
+def test_remote_uses_bounded_cache():
+    remote = Remote(analyzer_cache_max_entries=1)
+    built = []
+
+    def create_analyzer(self, analyzer_config=None):
+        self.analyzer = FakeAnalyzer(self.analyzer_config_key)
+        self._analyzers[self.analyzer_config_key] = self.analyzer
+        self._analyzers_init_count += 1
+        built.append(self.analyzer)
+
+    configs = [
+        {"id": 1, "analyzer": {"base_version": "2.4"}},
+        {"id": 2, "analyzer": {"base_version": "2.3"}},
+        {"id": 1, "analyzer": {"base_version": "2.4"}},
+    ]
+    with patch.object(Remote, "_create_analyzer", create_analyzer), patch(
+        "remote.Recording"
+    ), patch.object(Remote, "_set_checksum"), patch("remote.pprint"):
+        for config in configs:
+            remote.queued_audio_dict = {"group": {"analyzer_config": config}}
+            remote._analyze_file()
+
+    assert remote._analyzers_init_count == 3
+    assert len(remote._analyzers.items()) == 1
+    assert remote._analyzers.evictions == 2
+    assert built[0].interpreter is None
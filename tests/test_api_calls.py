@@ -45,7 +45,7 @@ LIVE_TEST = False
 
 def test_mocked_queue_request():
     # Test empty queue response.
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {}
         mocked_response = Response(
@@ -72,7 +72,7 @@ def test_mocked_queue_request():
 
     # Test non-200 response.
     # TODO: Handle timeouts and retries.
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {}
         mocked_response = Response(
@@ -88,7 +88,7 @@ def test_mocked_queue_request():
         assert str(e.value) == expected_error_text
 
     # Test queue item response.
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = dict(VALID_QUEUE_RESPONSE)
         mocked_response = Response(
@@ -283,7 +283,7 @@ def test_live_analyze():
     assert len(results["detections"]) == 25
     assert results["analyzer_version"] == "2.4"
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -340,7 +340,7 @@ def test_live_analyze():
     assert len(results["detections"]) == 12
     assert results["analyzer_version"] == "2.3"
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -410,7 +410,7 @@ def test_live_multi_analyze():
     assert len(results["detections"]) == 25
     assert results["analyzer_version"] == "2.4"
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -452,7 +452,7 @@ def test_live_multi_analyze():
     assert len(results["detections"]) == 12
     assert results["analyzer_version"] == "2.3"
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -494,7 +494,7 @@ def test_live_multi_analyze():
     assert len(results["detections"]) == 25
     assert results["analyzer_version"] == "2.4"
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -552,7 +552,7 @@ def test_live_species_list_analyze():
     assert results["file_checksum"] == "cfe5e3e09026b622f98c3572f82091f8"
     assert len(results["detections"]) == 3
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
@@ -604,7 +604,7 @@ def test_live_analyze_custom_classifier():
     assert results["file_checksum"] == "cfe5e3e09026b622f98c3572f82091f8"
     assert len(results["detections"]) == 39
 
-    with patch("remote.requests.post") as mocked_queue_response:
+    with patch("api_session.requests.Session.request") as mocked_queue_response:
         Response = namedtuple("Response", ["status_code", "json"])
         expected_queue_response = {"id": remote.queued_audio_dict["id"]}
         mocked_response = Response(
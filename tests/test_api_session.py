@@ -0,0 +1,108 @@
+from api_session import ApiSession, fibonacci
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+import threading
+
+import pytest
+import requests
+
+from .utils import FakeResponse
+
+
+def test_retries_idempotent_calls_with_backoff():
+    sleeps = []
+    session = ApiSession(max_retries=3, backoff_base_seconds=1, sleep=sleeps.append)
+    responses = [FakeResponse(503), FakeResponse(500), FakeResponse(201, {"id": 1})]
+    with patch("api_session.requests.Session.request", side_effect=responses):
+        response = session.post("https://example.com/results/", idempotent=True)
+    assert response.status_code == 201
+    assert session.stats["retries"] == 2
+    assert session.stats["requests"] == 3
+    # Jittered between half and all of the fibonacci delay.
+    assert 0.5 <= sleeps[0] <= 1
+    assert 1 <= sleeps[1] <= 2
+    assert [fibonacci(n) for n in range(6)] == [1, 1, 2, 3, 5, 8]
+
+
+def test_non_idempotent_calls_are_not_retried_on_errors():
+    session = ApiSession(max_retries=3, sleep=lambda seconds: None)
+    with patch("api_session.requests.Session.request", return_value=FakeResponse(500)):
+        response = session.post("https://example.com/queues/audio/")
+    assert response.status_code == 500
+    assert session.stats["retries"] == 0
+
+    with patch(
+        "api_session.requests.Session.request",
+        side_effect=requests.exceptions.ReadTimeout("timed out"),
+    ):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            session.post("https://example.com/queues/audio/")
+    assert session.stats["failures"] == 1
+
+
+def test_connection_errors_are_retried_then_raised():
+    session = ApiSession(max_retries=2, sleep=lambda seconds: None)
+    with patch(
+        "api_session.requests.Session.request",
+        side_effect=requests.exceptions.ConnectTimeout("no route"),
+    ):
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            session.post("https://example.com/queues/audio/")
+    assert session.stats["retries"] == 2
+    assert session.stats["failures"] == 1
+
+
+def test_refused_connections_are_retried_for_any_call():
+    session = ApiSession(max_retries=2, sleep=lambda seconds: None)
+    refused = requests.exceptions.ConnectionError(
+        MaxRetryError(None, "/queues/audio/", NewConnectionError(None, "refused"))
+    )
+    with patch(
+        "api_session.requests.Session.request",
+        side_effect=[refused, FakeResponse(200)],
+    ):
+        response = session.post("https://example.com/queues/audio/")
+    assert response.status_code == 200
+    assert session.stats["retries"] == 1
+
+    # A dropped connection may have reached the api.
+    session = ApiSession(max_retries=2, sleep=lambda seconds: None)
+    with patch(
+        "api_session.requests.Session.request",
+        side_effect=requests.exceptions.ConnectionError("Connection aborted."),
+    ):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            session.post("https://example.com/queues/audio/")
+    assert session.stats["retries"] == 0
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_connections_are_reused():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        session = ApiSession()
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        for _ in range(3):
+            assert session.get(url).status_code == 200
+        assert session.stats["connections_opened"] == 1
+        assert session.stats["connections_reused"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
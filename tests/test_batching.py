@@ -0,0 +1,110 @@
+from remote import Remote
+from pipeline import Pipeline, SHUTDOWN
+from batching import BatchInference
+
+from birdnetlib import Recording
+from birdnetlib.analyzer import Analyzer
+import numpy as np
+import soundfile
+
+
+class FakeInterpreter:
+    # Logits derived from each chunk's loudest sample, for any batch size.
+    def __init__(self):
+        self.shape = [1, 144000]
+        self.invocations = 0
+        self.resizes = 0
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.shape)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+        self.resizes += 1
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, data):
+        assert list(data.shape) == self.shape
+        self.data = data
+
+    def invoke(self):
+        self.invocations += 1
+
+    def get_tensor(self, index):
+        loudest = np.max(np.abs(self.data), axis=1)
+        return np.stack([loudest * 10 - 5, 5 - loudest * 10], axis=1)
+
+
+class FakeAnalyzer(Analyzer):
+    def __init__(self):
+        self.labels = ["Turdus migratorius_American Robin", "Noise_Noise"]
+        self.custom_species_list = []
+        self.has_custom_species_list = False
+        self.use_custom_classifier = False
+        self.classifier_model_path = None
+        self.interpreter = FakeInterpreter()
+        self.input_layer_index = 0
+        self.output_layer_index = 1
+
+
+def write_recording(path, seconds, tones):
+    audio = np.zeros(48000 * seconds, dtype="float32")
+    for start, amplitude in tones:
+        audio[start * 48000 : (start + 1) * 48000] = amplitude
+    soundfile.write(path, audio, 48000, subtype="FLOAT")
+
+
+def as_tuples(detections):
+    return [
+        (d["start_time"], d["end_time"], d["label"], round(d["confidence"], 5))
+        for d in detections
+    ]
+
+
+def test_batched_inference_matches_per_chunk_inference(tmp_path):
+    paths = [str(tmp_path / "a.wav"), str(tmp_path / "b.wav")]
+    write_recording(paths[0], 20, [(1, 0.9), (10, 0.4)])
+    write_recording(paths[1], 14, [(4, 0.7), (12, 0.8)])
+
+    expected = []
+    for path in paths:
+        recording = Recording(FakeAnalyzer(), path, min_conf=0.1)
+        recording.analyze()
+        expected.append(as_tuples(recording.detections))
+
+    analyzer = FakeAnalyzer()
+    recordings = [Recording(analyzer, path, min_conf=0.1) for path in paths]
+    inference = BatchInference(analyzer, batch_size=4)
+    inference.analyze(recordings)
+
+    assert [as_tuples(r.detections) for r in recordings] == expected
+    # 7 + 5 chunks (the last zero padded), packed across both recordings into batches of 4.
+    assert inference.chunks_analyzed == 12
+    assert analyzer.interpreter.invocations == 3
+    assert analyzer.interpreter.resizes == 1
+
+
+class FakeJob:
+    def __init__(self, item_id, analyzer_config_key):
+        self.id = item_id
+        self.analyzer_config_key = analyzer_config_key
+
+
+def test_pipeline_batches_jobs_with_the_same_analyzer_config():
+    remote = Remote(pipeline_depth=1, batch_recordings=4)
+    pipeline = Pipeline(remote, depth=1)
+    for job in (FakeJob(2, "b"), FakeJob(3, "a"), SHUTDOWN, FakeJob(4, "a")):
+        pipeline.prefetched.put(job)
+
+    held = []
+    batch = pipeline._take_batch(FakeJob(1, "a"), held)
+    assert [job.id for job in batch] == [1, 3, 4]
+    # Everything else keeps its order for the next round.
+    assert held[0].id == 2
+    assert held[1] == SHUTDOWN
+
+    batch = pipeline._take_batch(held.pop(0), held)
+    assert [job.id for job in batch] == [2]
+    assert held == [SHUTDOWN]
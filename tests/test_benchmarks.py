@@ -0,0 +1,58 @@
+from remote import Remote, return_analyzer_model_key
+from benchmarks.fakes import FakeQueueServer, FakeS3Server, SimulatedAnalyzer
+from benchmarks.throughput_benchmark import (
+    ANALYZER_CONFIG,
+    SOURCE_BUCKET,
+    StopWhenIdle,
+    queue_item,
+    summarize,
+    synthetic_recording,
+)
+
+import json
+
+
+def test_runner_against_local_api_and_s3(tmp_path):
+    queue = FakeQueueServer().start()
+    s3 = FakeS3Server().start()
+    try:
+        s3.put(SOURCE_BUCKET, "P/G/a.wav", synthetic_recording(9, seed=1))
+        for audio_id in (1, 2):
+            queue.enqueue(queue_item(audio_id, "P/G/a.wav"))
+
+        coordinator = StopWhenIdle()
+        remote = Remote(
+            api_endpoint=queue.url,
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+            s3_endpoint_url=s3.url,
+            audio_directory=str(tmp_path),
+            extraction_audio_directory=str(tmp_path),
+            extraction_spectrogram_directory=str(tmp_path),
+            sleep_secs_on_empty_queue=0.1,
+            shutdown_on_empty_processing_queue=True,
+            shutdown_coordinator=coordinator,
+            preloaded_analyzers={
+                return_analyzer_model_key(ANALYZER_CONFIG): SimulatedAnalyzer()
+            },
+            spectrogram_engine="stft",
+        )
+        coordinator.remote = remote
+        remote.run_queue()
+    finally:
+        queue.close()
+        s3.close()
+
+    assert sorted(queue.results) == [1, 2]
+    detections = queue.results[1]["detections"]
+    assert detections
+    # Clips, spectrograms and the analysis json went to the S3 stand-in.
+    analysis = json.loads(s3.objects[("benchmark-json", "P/G/a.wav_data.json")])
+    assert analysis["detections"] == detections
+    assert any(bucket == "benchmark-clips" for bucket, _ in s3.objects)
+    assert any(bucket == "benchmark-spectrograms" for bucket, _ in s3.objects)
+
+    summary = summarize(queue, 0, 3600, 0)
+    assert summary["jobs_completed"] == 2
+    assert summary["jobs_per_hour"] == 2
+    assert summary["stage_seconds"]["download"]["p50"] > 0
@@ -0,0 +1,135 @@
+from remote import Remote
+from control_plane import ControlPlane
+
+from unittest.mock import patch
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from .test_pipeline import FakeRecording, make_item
+from .utils import FakeQueueAPI
+
+
+def patch_job_stages(events, analyze_seconds=0.0):
+    running = []
+
+    def retrieve_file(self):
+        events.append(("download", self.queued_audio_dict["id"]))
+        self.audio_filepath = os.path.join(self.audio_directory, "file.wav")
+        with open(self.audio_filepath, "wb") as f:
+            f.write(b"audio")
+
+    def analyze_file(self):
+        item_id = self.queued_audio_dict["id"]
+        running.append(item_id)
+        try:
+            # Inference runs one job at a time.
+            assert len(running) == 1
+            if item_id == 2:
+                raise ValueError("unreadable audio")
+            time.sleep(analyze_seconds)
+            events.append(("analyze", item_id))
+            self.recording = FakeRecording()
+        finally:
+            running.remove(item_id)
+
+    def save_results(self):
+        events.append(("saved", self.queued_audio_dict["id"]))
+
+    patches = [
+        patch.object(Remote, "_retrieve_file", retrieve_file),
+        patch.object(Remote, "_analyze_file", analyze_file),
+        patch.object(Remote, "_extract_detections", lambda self: None),
+        patch.object(Remote, "_upload_extractions", lambda self: None),
+        patch.object(Remote, "_upload_json", lambda self: None),
+        patch.object(Remote, "_save_results_to_server", save_results),
+    ]
+    for p in patches:
+        p.start()
+    return patches
+
+
+def test_run_queue_overlaps_jobs_and_renews_leases(tmp_path):
+    api = FakeQueueAPI(items=[make_item(1), make_item(3)], safe_to_shutdown=True)
+    events = []
+    remote = Remote(
+        api_endpoint="http://example.com",
+        audio_directory=str(tmp_path),
+        extraction_audio_directory=str(tmp_path),
+        extraction_spectrogram_directory=str(tmp_path),
+        sleep_secs_on_empty_queue=0,
+        shutdown_on_empty_processing_queue=True,
+        async_jobs=2,
+        lease_heartbeat_seconds=0.05,
+    )
+    patches = patch_job_stages(events, analyze_seconds=0.3)
+    try:
+        with patch(
+            "api_session.requests.Session.request", side_effect=api.request
+        ), patch.object(Remote, "_shutdown") as mocked_shutdown:
+            remote.run_queue()
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert {e[1] for e in events if e[0] == "saved"} == {1, 3}
+    # The second item was leased and downloaded while the first was analyzed.
+    assert events.index(("download", 3)) < events.index(("analyze", 1))
+    # The long inference kept the lease alive.
+    assert api.heartbeats.count(1) >= 3
+    assert remote._control_plane.jobs_completed == 2
+    mocked_shutdown.assert_called_once()
+    assert os.listdir(tmp_path) == []
+
+
+def test_submit_and_await(tmp_path):
+    api = FakeQueueAPI(items=[make_item(1), make_item(2)])
+    events = []
+    remote = Remote(
+        api_endpoint="http://example.com",
+        audio_directory=str(tmp_path),
+        extraction_audio_directory=str(tmp_path),
+        extraction_spectrogram_directory=str(tmp_path),
+    )
+
+    async def main():
+        async with ControlPlane(remote) as plane:
+            first = plane.submit(remote._request_queue_item())
+            second = plane.submit(remote._request_queue_item())
+            job = await first
+            assert job.queued_audio_dict["id"] == 1
+            with pytest.raises(ValueError):
+                await second
+        return plane
+
+    # Blocking job steps never run on the event loop's thread.
+    loop_thread = threading.current_thread()
+    blocking_threads = []
+
+    def finish_admission(self):
+        blocking_threads.append(threading.current_thread())
+
+    def cleanup_files(self):
+        blocking_threads.append(threading.current_thread())
+
+    patches = patch_job_stages(events)
+    try:
+        with patch(
+            "api_session.requests.Session.request", side_effect=api.request
+        ), patch.object(Remote, "_finish_admission", finish_admission), patch.object(
+            Remote, "_cleanup_files", cleanup_files
+        ):
+            plane = asyncio.run(main())
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert blocking_threads and loop_thread not in blocking_threads
+    assert plane.jobs_completed == 1
+    assert plane.jobs_failed == 1
+    assert events[-1] == ("saved", 1)
+    assert os.listdir(tmp_path) == []
+    assert not [t for t in threading.enumerate() if t.name.startswith("control-plane")]
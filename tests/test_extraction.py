@@ -0,0 +1,167 @@
+from remote import Remote
+from extraction import plan_spectrograms
+
+from birdnetlib.analyzer import Detection
+from birdnetlib.main import RecordingBase
+from io import BytesIO
+from unittest.mock import patch
+import numpy as np
+import os
+import soundfile
+
+
+class FakeAnalyzer:
+    custom_species_list = []
+
+
+def make_detection(start_time, end_time, common_name, confidence):
+    detection = Detection(start_time, end_time)
+    detection.common_name = common_name
+    detection.scientific_name = common_name
+    detection.confidence = confidence
+    detection.label = f"{common_name}_{common_name}"
+    return detection
+
+
+class FakeRecording(RecordingBase):
+    # An analyzed 10.5 second recording.
+    def __init__(self):
+        super().__init__(FakeAnalyzer())
+        self.filestem = "recording"
+        self.ndarray = np.sin(np.arange(int(48000 * 10.5)) / 10).astype("float32") / 2
+        self.duration = 10.5
+        self.analyzed = True
+        self.detection_list = [
+            make_detection(0.0, 3.0, "Robin", 0.9),
+            make_detection(0.0, 3.0, "Wren", 0.6),
+            make_detection(6.0, 9.0, "Robin", 0.3),
+            make_detection(9.0, 12.0, "Jay", 0.8),
+        ]
+
+    @property
+    def filename(self):
+        return "recording.wav"
+
+
+def test_spectrogram_names_match_birdnetlib(tmp_path):
+    recording = FakeRecording()
+    recording.extract_detections_as_spectrogram(str(tmp_path), min_conf=0.5)
+    expected = sorted(os.listdir(tmp_path))
+
+    artifacts = plan_spectrograms(recording, min_conf=0.5)
+    assert sorted(artifact.filename for artifact in artifacts) == expected
+    assert expected == ["recording_0s-3s.jpg", "recording_9s-10s.jpg"]
+    assert artifacts[0].render()[:2] == b"\xff\xd8"
+
+
+def test_memory_extraction_uploads_buffers(tmp_path):
+    remote = Remote(
+        extraction_mode="memory",
+        extraction_audio_directory=str(tmp_path),
+        extraction_spectrogram_directory=str(tmp_path),
+    )
+    remote.recording = FakeRecording()
+    remote.min_conf_audio_extraction = 0.5
+    remote.min_conf_spectrogram_extraction = 0.5
+    remote.queued_audio_dict = {
+        "audio": {"file_path": "PROJECT/GROUP/recording.wav"},
+        "group": {
+            "analyzer_config": {
+                "extraction_audio_file_destination": {"s3_bucket": "audio-bucket"},
+                "extraction_spectrogram_file_destination": {
+                    "s3_bucket": "spectro-bucket"
+                },
+            }
+        },
+    }
+    uploaded = {}
+
+    def upload_fileobj_to_s3(self, fileobj, bucket, key):
+        uploaded[(bucket, key)] = fileobj.read()
+        return True
+
+    with patch.object(Remote, "_upload_fileobj_to_s3", upload_fileobj_to_s3):
+        remote._extract_detections_as_audio()
+        remote._extract_detections_as_spectrogram()
+        remote._upload_extractions()
+
+    # Nothing touched the extraction directories.
+    assert os.listdir(tmp_path) == []
+    assert sorted(uploaded) == [
+        ("audio-bucket", "PROJECT/GROUP/recording_0s-3s.flac"),
+        ("audio-bucket", "PROJECT/GROUP/recording_9s-10s.flac"),
+        ("spectro-bucket", "PROJECT/GROUP/recording_0s-3s.jpg"),
+        ("spectro-bucket", "PROJECT/GROUP/recording_9s-10s.jpg"),
+    ]
+    clip, rate = soundfile.read(
+        BytesIO(uploaded[("audio-bucket", "PROJECT/GROUP/recording_0s-3s.flac")])
+    )
+    assert rate == 48000
+    assert np.allclose(clip, remote.recording.ndarray[: 48000 * 3], atol=1e-4)
+
+    robin, wren, quiet_robin, jay = remote.detections
+    url = "https://audio-bucket.s3.amazonaws.com/PROJECT/GROUP/recording_0s-3s.flac"
+    assert robin["extracted_audio_url"] == url
+    assert wren["extracted_audio_url"] == url
+    assert (
+        jay["extracted_spectrogram_url"]
+        == "https://spectro-bucket.s3.amazonaws.com/PROJECT/GROUP/recording_9s-10s.jpg"
+    )
+    assert "extracted_audio_url" not in quiet_robin
+    assert remote.upload_stats["files_uploaded"] == 4
+    assert remote.upload_stats["bytes_uploaded"] == sum(map(len, uploaded.values()))
+
+
+def test_clips_are_cut_from_the_decoded_waveform(tmp_path):
+    recording = FakeRecording()
+    remote = Remote(extraction_audio_directory=str(tmp_path), clip_fade_seconds=0.01)
+    remote.recording = recording
+    remote.min_conf_audio_extraction = 0.5
+
+    # Never decodes again, whatever the number of detections.
+    with patch.object(FakeRecording, "get_extract_array", side_effect=AssertionError):
+        remote._extract_detections_as_audio()
+
+    paths = {
+        d["extracted_audio_path"]
+        for d in recording.detections
+        if d["confidence"] >= 0.5
+    }
+    assert sorted(os.listdir(tmp_path)) == [
+        "recording_0s-3s.flac",
+        "recording_9s-10s.flac",
+    ]
+    assert paths == {str(tmp_path / name) for name in os.listdir(tmp_path)}
+
+    clip, _ = soundfile.read(str(tmp_path / "recording_0s-3s.flac"), dtype="int16")
+    expected = np.int16(recording.ndarray[: 48000 * 3] * 2**15)
+    assert len(clip) == 48000 * 3
+    # 10ms fades at both ends, untouched in between.
+    assert clip[0] == 0 and clip[-1] == 0
+    assert abs(int(clip[240]) - int(expected[240]) * 240 / 479) <= 1
+    assert np.array_equal(clip[480:-480], expected[480:-480])
+
+
+def test_disk_clips_are_16_bit_flac_written_in_chunks(tmp_path):
+    recording = FakeRecording()
+    # A full scale peak is clipped rather than wrapped around (birdnetlib's
+    # pydub export wrapped it to -32768).
+    recording.ndarray[48000] = 1.0
+    remote = Remote(extraction_audio_directory=str(tmp_path))
+    remote.recording = recording
+
+    with patch("extraction.CLIP_CHUNK_SIZE", 1), patch(
+        "extraction.np.stack", wraps=np.stack
+    ) as mocked_stack:
+        remote._extract_detections_as_audio()
+
+    # One clip converted at a time.
+    assert all(len(call.args[0]) == 1 for call in mocked_stack.call_args_list)
+    assert mocked_stack.call_count == 3
+    # Encoded with soundfile (libsndfile) rather than ffmpeg: 16 bit mono FLAC
+    # at 48kHz, the same layout birdnetlib wrote.
+    info = soundfile.info(str(tmp_path / "recording_0s-3s.flac"))
+    assert (info.format, info.subtype) == ("FLAC", "PCM_16")
+    assert (info.samplerate, info.channels) == (48000, 1)
+    clip, _ = soundfile.read(str(tmp_path / "recording_0s-3s.flac"), dtype="int16")
+    assert clip[48000] == 2**15 - 1
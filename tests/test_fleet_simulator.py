@@ -0,0 +1,35 @@
+from benchmarks.fleet_simulator import return_arrival_offsets, simulate
+
+
+def test_arrival_offsets():
+    assert return_arrival_offsets("burst", 3, 60) == [0.0, 0.0, 0.0]
+    assert return_arrival_offsets("uniform", 4, 60) == [0, 15, 30, 45]
+    assert return_arrival_offsets("waves", 4, 60, waves=2) == [0, 30, 0, 30]
+    poisson = return_arrival_offsets("poisson", 50, 60)
+    assert poisson[0] == 0 and poisson == sorted(poisson)
+
+
+def test_fleet_drains_and_shuts_down():
+    for mode in ("supervisor", "standalone"):
+        summary = simulate(
+            instances=3,
+            runners=2,
+            jobs=12,
+            arrival="uniform",
+            arrival_seconds=20,
+            job_seconds=5,
+            job_sigma=0,
+            download_seconds=1,
+            upload_seconds=1,
+            mode=mode,
+            time_scale=0.005,
+            idle_report_window_seconds=10,
+            max_seconds=600,
+        )
+        assert summary["jobs_completed"] == 12
+        assert summary["instances_running_at_end"] == 0
+        assert summary["api_requests_by_endpoint"]["lease"] == 12
+        assert summary["api_requests_by_endpoint"]["shutdown"] >= 3
+        assert summary["queue_wait_seconds"]["max"] < 60
+        assert len(summary["seconds_after_drain"]) == 5
+        assert 0 < summary["idle_fraction"] < 1
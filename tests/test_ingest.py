@@ -0,0 +1,81 @@
+from remote import Remote
+from ingest import sniff_audio_format
+
+from io import BytesIO
+from unittest.mock import patch
+import hashlib
+import struct
+
+from .utils import return_stubber_client_for_filedownload
+
+
+def make_wav_bytes(sample_rate=48000, seconds=1):
+    data = b"\x00\x00" * sample_rate * seconds
+    header = b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+    header += b"fmt " + struct.pack(
+        "<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16
+    )
+    header += b"data" + struct.pack("<I", len(data))
+    return header + data
+
+
+def test_download_computes_checksum_size_and_format(tmp_path):
+    bucket_name = "non-existant-bucket"
+    key = "PROJECT/GROUP/file.wav"
+    contents = make_wav_bytes()
+    mocked_s3_client = return_stubber_client_for_filedownload(
+        bucket_name, key, bcontents=BytesIO(contents)
+    )
+
+    remote = Remote(audio_directory=str(tmp_path))
+    remote._client = mocked_s3_client
+    remote.queued_audio_dict = {
+        "audio": {"file_path": key, "file_source": {"s3_bucket": bucket_name}}
+    }
+    remote._retrieve_file()
+
+    assert remote.file_checksum == hashlib.md5(contents).hexdigest()
+    assert remote.file_size == len(contents)
+    assert remote.audio_format["container"] == "wav"
+    assert remote.audio_format["sample_rate"] == 48000
+    assert remote.audio_format["channels"] == 1
+
+    # The checksum comes from the download; the file is not read again.
+    with patch("remote.file_checksum") as mocked_file_checksum:
+        remote._set_checksum()
+        mocked_file_checksum.assert_not_called()
+    assert remote.file_checksum == hashlib.md5(contents).hexdigest()
+
+
+def test_alternate_checksum_algorithm(tmp_path):
+    bucket_name = "non-existant-bucket"
+    key = "PROJECT/GROUP/file.wav"
+    contents = make_wav_bytes()
+    mocked_s3_client = return_stubber_client_for_filedownload(
+        bucket_name, key, bcontents=BytesIO(contents)
+    )
+
+    remote = Remote(audio_directory=str(tmp_path), checksum_algorithm="blake2b")
+    remote._client = mocked_s3_client
+    remote.queued_audio_dict = {
+        "audio": {"file_path": key, "file_source": {"s3_bucket": bucket_name}}
+    }
+    remote._retrieve_file()
+    assert remote.file_checksum == hashlib.blake2b(contents).hexdigest()
+
+
+def test_sniff_flac_header():
+    # fLaC + STREAMINFO block header + 34 byte STREAMINFO.
+    sample_rate = 48000
+    total_samples = sample_rate * 60
+    info = (sample_rate << 44) | ((1 - 1) << 41) | ((16 - 1) << 36) | total_samples
+    header = b"fLaC" + b"\x00\x00\x00\x22" + b"\x00" * 10 + info.to_bytes(8, "big")
+    audio_format = sniff_audio_format(header + b"\x00" * 16)
+    assert audio_format["container"] == "flac"
+    assert audio_format["sample_rate"] == 48000
+    assert audio_format["channels"] == 1
+    assert audio_format["bits_per_sample"] == 16
+    assert audio_format["duration"] == 60
+
+    assert sniff_audio_format(b"ID3\x03\x00")["container"] == "mp3"
+    assert sniff_audio_format(b"not audio")["container"] == "unknown"
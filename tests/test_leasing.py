@@ -0,0 +1,91 @@
+from remote import Remote
+from leasing import LeaseQueue
+
+from unittest.mock import patch
+import time
+
+import pytest
+
+from .utils import FakeQueueAPI
+
+
+def make_items(count):
+    return [
+        {"id": i, "audio": {"file_path": f"P/G/file_{i}.wav"}} for i in range(count)
+    ]
+
+
+def test_batch_lease_adapts_to_job_duration():
+    api = FakeQueueAPI(items=make_items(20), lease_seconds=100)
+    remote = Remote(api_endpoint="http://example.com", lease_batch_size=8)
+
+    with patch("api_session.requests.Session.request", side_effect=api.request):
+        # No jobs timed yet, so only one item is leased.
+        item = remote._return_queue_item()
+        assert item["id"] == 0
+        assert api.lease_requests[-1]["count"] == 1
+
+        # 20 second jobs with a 100 second lease: 50 seconds budget, 2 items.
+        remote.lease_queue.record_job(20)
+        item = remote._return_queue_item()
+        assert item["id"] == 1
+        assert api.lease_requests[-1]["count"] == 2
+        assert len(remote.lease_queue) == 1
+
+        # The second item is served locally without a round trip.
+        item = remote._return_queue_item()
+        assert item["id"] == 2
+        assert len(api.lease_requests) == 2
+
+        # Fast jobs lease up to the configured maximum.
+        remote.lease_queue.average_job_seconds = 1
+        item = remote._return_queue_item()
+        assert api.lease_requests[-1]["count"] == 8
+        assert len(remote.lease_queue) == 7
+
+        # Unstarted items are handed back on shutdown.
+        released = remote._release_leased_items()
+        assert released == 7
+        assert len(api.released) == 7
+        assert len(remote.lease_queue) == 0
+
+
+def test_batch_lease_empty_queue_and_shutdown():
+    api = FakeQueueAPI(items=[], safe_to_shutdown=True)
+    remote = Remote(
+        api_endpoint="http://example.com",
+        lease_batch_size=4,
+        shutdown_on_empty_processing_queue=True,
+    )
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(Remote, "_shutdown") as mocked_shutdown:
+        assert remote._return_queue_item() is None
+        mocked_shutdown.assert_called_once()
+
+
+def test_lease_deadline_skips_expired_items():
+    lease_queue = LeaseQueue(max_batch_size=4)
+    lease_queue.add([{"id": 1}, {"id": 2}], lease_seconds=0.01)
+    time.sleep(0.02)
+    lease_queue.add([{"id": 3}], lease_seconds=60)
+    assert lease_queue.pop()["id"] == 3
+    assert lease_queue.expired_count == 2
+    assert lease_queue.pop() is None
+
+
+def test_lease_request_is_not_retried_after_reaching_the_api():
+    # A retried lease could lease a second batch and strand the first.
+    remote = Remote(api_endpoint="http://example.com", lease_batch_size=8)
+    with patch("api_session.requests.Session.request") as mocked_request:
+        mocked_request.return_value.status_code = 503
+        with pytest.raises(ConnectionError):
+            remote._return_queue_item()
+    assert mocked_request.call_count == 1
+
+
+def test_api_connection_pool_covers_concurrent_jobs():
+    remote = Remote(api_endpoint="http://example.com", async_jobs=4)
+    # Ten control plane IO threads and the result flusher.
+    assert remote.session.adapter._pool_maxsize == 11
+    assert Remote(api_endpoint="http://example.com").session.adapter._pool_maxsize == 4
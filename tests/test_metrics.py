@@ -0,0 +1,85 @@
+from remote import Remote
+from metrics import MetricsServer, STAGES
+
+from unittest.mock import MagicMock, patch
+import json
+import urllib.request
+
+from .test_result_cache import make_item
+from .utils import FakeQueueAPI
+
+
+class FakeRecording:
+    duration = 60.0
+
+    def __init__(self):
+        self.detections = []
+
+    def analyze(self):
+        self.detections = [
+            {"common_name": "Robin", "confidence": 0.9, "start_time": 0, "end_time": 3}
+        ]
+
+
+def test_stage_metrics_in_results_and_endpoint(tmp_path):
+    api = FakeQueueAPI(items=[make_item(1)])
+    remote = Remote(
+        api_endpoint="http://example.com",
+        pid=1234,
+        audio_directory=str(tmp_path),
+        analysis_output_formats=["json", "ndjson"],
+    )
+    remote._client = MagicMock()
+    remote._client.download_fileobj.side_effect = lambda bucket, key, f: f.write(
+        b"RIFF" + b"\0" * 996
+    )
+
+    def get_analyzer(self, analyzer_config):
+        self.analyzer = MagicMock(version="2.4")
+
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(Remote, "_get_analyzer", get_analyzer), patch.object(
+        Remote, "_create_recording", lambda self, min_conf: FakeRecording()
+    ), patch.object(
+        Remote, "_extract_detections_as_audio"
+    ), patch.object(
+        Remote, "_extract_detections_as_spectrogram"
+    ):
+        remote.process()
+        remote.process()  # Empty queue.
+
+    stages = api.results[1]["stage_metrics"]
+    assert list(stages) == [
+        "lease",
+        "download",
+        "analyzer",
+        "inference",
+        "audio_extraction",
+        "spectrogram_extraction",
+        "uploads",
+        "json_upload",
+    ]
+    assert stages["download"]["bytes"] == 1000
+    assert stages["inference"]["items"] == 1
+    assert stages["json_upload"]["items"] == 2
+    assert all(stage["seconds"] >= 0 for stage in stages.values())
+
+    # The analysis json was written before its own upload.
+    body = remote._client.put_object.mock_calls[0].kwargs["Body"]
+    assert "json_upload" not in json.loads(body)["stage_metrics"]
+
+    server = MetricsServer(remote.metrics, 0).start()
+    try:
+        url = f"http://127.0.0.1:{server.port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            text = response.read().decode("utf-8")
+    finally:
+        server.close()
+    assert 'audiospotter_jobs_total{pid="1234"} 1' in text
+    assert 'audiospotter_stage_calls_total{pid="1234",stage="lease"} 2' in text
+    assert 'audiospotter_stage_items_total{pid="1234",stage="result_post"} 1' in text
+    assert 'audiospotter_stage_bytes_total{pid="1234",stage="download"} 1000' in text
+    for stage in set(STAGES) - {"checksum"}:
+        assert f'stage="{stage}"' in text
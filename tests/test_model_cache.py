@@ -0,0 +1,112 @@
+from api_session import ApiSession
+from model_cache import ModelCache
+
+from unittest.mock import patch
+import hashlib
+import os
+
+import pytest
+
+
+class StreamedResponse:
+    def __init__(self, content, status_code=200, content_length=None, etag=None):
+        self.content = content
+        self.status_code = status_code
+        length = len(content) if content_length is None else content_length
+        self.headers = {"Content-Length": str(length)}
+        if etag:
+            self.headers["ETag"] = etag
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeMediaServer:
+    # Serves one file, answering conditional GETs with 304 while it is unchanged.
+
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+
+    @property
+    def etag(self):
+        return f'"{hashlib.md5(self.content).hexdigest()}"'
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, dict(headers or {}), kwargs))
+        if (headers or {}).get("If-None-Match") == self.etag:
+            return StreamedResponse(b"", status_code=304)
+        return StreamedResponse(self.content, etag=self.etag)
+
+
+def test_model_downloaded_once_and_reused(tmp_path):
+    content = b"model bytes" * 1000
+    sha256 = hashlib.sha256(content).hexdigest()
+    url = "https://example.com/media/Custom_Classifier.tflite"
+
+    server = FakeMediaServer(content)
+
+    with patch("api_session.requests.Session.request", side_effect=server.request):
+        cache = ModelCache(str(tmp_path), ApiSession(), chunk_size=1024)
+        path = cache.fetch(url, suffix=".tflite")
+        assert os.path.basename(path) == f"{sha256}.tflite"
+        with open(path, "rb") as f:
+            assert f.read() == content
+        assert server.requests[0][3]["stream"] == True
+
+        # A second cache on the same directory (another runner, or a restart)
+        # only revalidates the file.
+        other = ModelCache(str(tmp_path), ApiSession())
+        assert other.fetch(url, suffix=".tflite") == path
+        assert server.requests[1][2]["If-None-Match"] == server.etag
+        assert other.downloads == 0
+        assert other.hits == 1
+
+        # A pinned sha256 needs no request at all.
+        assert other.fetch(url, expected_sha256=sha256, suffix=".tflite") == path
+        assert len(server.requests) == 2
+
+    # Nothing is left behind in the temporary directory.
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_incomplete_or_mismatched_downloads_are_rejected(tmp_path):
+    url = "https://example.com/media/Custom_Classifier_Labels.txt"
+    cache = ModelCache(str(tmp_path), ApiSession())
+
+    with patch(
+        "api_session.requests.Session.request",
+        return_value=StreamedResponse(b"labels", content_length=100),
+    ):
+        with pytest.raises(ConnectionError):
+            cache.fetch(url)
+
+    with patch(
+        "api_session.requests.Session.request",
+        return_value=StreamedResponse(b"labels"),
+    ):
+        with pytest.raises(ValueError):
+            cache.fetch(url, expected_sha256="0" * 64)
+
+    assert os.listdir(tmp_path / "blobs") == []
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_model_replaced_at_the_same_url_is_downloaded_again(tmp_path):
+    url = "https://example.com/media/Custom_Classifier.tflite"
+    server = FakeMediaServer(b"first model")
+
+    with patch("api_session.requests.Session.request", side_effect=server.request):
+        cache = ModelCache(str(tmp_path), ApiSession())
+        first_path = cache.fetch(url, suffix=".tflite")
+        server.content = b"retrained model"
+        path = cache.fetch(url, suffix=".tflite")
+
+    assert path != first_path
+    with open(path, "rb") as f:
+        assert f.read() == b"retrained model"
+    assert cache.downloads == 2
@@ -0,0 +1,71 @@
+from remote import Remote
+from parallel_extraction import return_pool_size, split_tasks
+
+from unittest.mock import patch
+import numpy as np
+import os
+
+from .test_extraction import FakeRecording, make_detection
+
+
+class DenseRecording(FakeRecording):
+    # 60 seconds with a detection in every chunk.
+    def __init__(self):
+        super().__init__()
+        self.ndarray = np.sin(np.arange(48000 * 60) / 10).astype("float32") / 2
+        self.duration = 60.0
+        self.detection_list = []
+        for start in range(0, 60, 3):
+            self.detection_list.append(make_detection(start, start + 3, "Robin", 0.9))
+            self.detection_list.append(
+                make_detection(start, start + 3, "Wren", 0.4 + (start % 2) / 5)
+            )
+
+
+def test_pool_size_and_chunks():
+    assert return_pool_size(runner_count=4, cpu_count=16) == 4
+    assert return_pool_size(runner_count="4", cpu_count=2) == 1
+    tasks = list(range(50))
+    assert [len(chunk) for chunk in split_tasks(tasks, processes=2)] == [13] * 3 + [11]
+    assert [len(chunk) for chunk in split_tasks(tasks, processes=8)] == [8] * 6 + [2]
+
+
+def extract(directory, processes):
+    # ({detection: paths}, {file name: contents}) of a dense recording.
+    directory.mkdir()
+    remote = Remote(
+        extraction_audio_directory=str(directory),
+        extraction_spectrogram_directory=str(directory),
+        spectrogram_engine="stft",
+        extraction_processes=processes,
+    )
+    remote.audio_filepath = str(directory / "recording.wav")
+    remote.recording = DenseRecording()
+    remote.min_conf_audio_extraction = 0.5
+    remote.min_conf_spectrogram_extraction = 0.8
+    remote._extract_detections()
+    if remote.extraction_pool:
+        assert remote.extraction_pool.chunks_submitted == 5
+        remote.extraction_pool.close()
+    remote._cleanup_files()  # Removes the waveform written for the workers.
+    detections = [
+        {k: v.replace(str(directory), "") for k, v in d.items() if "path" in k}
+        for d in remote.recording.detections
+    ]
+    files = {name: (directory / name).read_bytes() for name in os.listdir(directory)}
+    return detections, files
+
+
+def test_pool_extraction_matches_serial(tmp_path):
+    serial = extract(tmp_path / "serial", processes=0)
+    with patch.object(
+        Remote, "_extract_detections_as_audio", side_effect=AssertionError
+    ):
+        parallel = extract(tmp_path / "parallel", processes=3)
+
+    # Same detections, in the same order, with the same files.
+    assert parallel == serial
+    detections, files = serial
+    assert len(detections) == 40
+    assert len([name for name in files if name.endswith(".flac")]) == 20
+    assert len([name for name in files if name.endswith(".png")]) == 20
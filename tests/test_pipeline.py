@@ -0,0 +1,100 @@
+from remote import Remote
+from pipeline import Pipeline
+
+from unittest.mock import patch
+import threading
+import os
+
+
+def make_item(item_id):
+    return {
+        "id": item_id,
+        "audio": {
+            "file_path": f"PROJECT/GROUP/file_{item_id}.wav",
+            "file_source": {"s3_bucket": "non-existant-bucket"},
+        },
+        "group": {"analyzer_config": {"id": 2, "analyzer": {}}},
+    }
+
+
+class FakeRecording:
+    def __init__(self):
+        self.ndarray = [0.0] * 10
+        self.chunks = [[0.0]]
+
+
+def test_pipeline_overlaps_download_with_analysis(tmp_path):
+    items = [make_item(1), make_item(2), make_item(3)]
+    events = []
+    second_download_started = threading.Event()
+
+    def request_queue_item(self):
+        if items:
+            return items.pop(0)
+        return {"safe_to_shutdown": True}
+
+    def retrieve_file(self):
+        item_id = self.queued_audio_dict["id"]
+        events.append(("download", item_id))
+        self.audio_filepath = os.path.join(self.audio_directory, "file.wav")
+        with open(self.audio_filepath, "wb") as f:
+            f.write(b"audio")
+        if item_id == 2:
+            second_download_started.set()
+
+    def analyze_file(self):
+        item_id = self.queued_audio_dict["id"]
+        if item_id == 1:
+            # The next item should be leased and downloaded during inference.
+            assert second_download_started.wait(timeout=5)
+        events.append(("analyze", item_id))
+        self.recording = FakeRecording()
+
+    def save_results(self):
+        events.append(("saved", self.queued_audio_dict["id"]))
+
+    def cleanup_files(self):
+        os.remove(self.audio_filepath)
+
+    remote = Remote(
+        audio_directory=str(tmp_path),
+        extraction_audio_directory=str(tmp_path),
+        extraction_spectrogram_directory=str(tmp_path),
+        sleep_secs_on_empty_queue=0,
+        shutdown_on_empty_processing_queue=True,
+        pipeline_depth=1,
+    )
+    remote._client = object()
+
+    with patch.object(Remote, "_request_queue_item", request_queue_item), patch.object(
+        Remote, "_retrieve_file", retrieve_file
+    ), patch.object(Remote, "_analyze_file", analyze_file), patch.object(
+        Remote, "_extract_detections_as_audio", lambda self: None
+    ), patch.object(
+        Remote, "_extract_detections_as_spectrogram", lambda self: None
+    ), patch.object(
+        Remote, "_upload_extractions", lambda self: None
+    ), patch.object(
+        Remote, "_upload_json", lambda self: None
+    ), patch.object(
+        Remote, "_cleanup_files", cleanup_files
+    ), patch.object(
+        Remote, "_save_results_to_server", save_results
+    ), patch.object(
+        Remote, "_shutdown"
+    ) as mocked_shutdown:
+        pipeline = Pipeline(remote, depth=1)
+        pipeline.run()
+
+    assert pipeline.jobs_completed == 3
+    assert pipeline.jobs_failed == 0
+    assert events.index(("download", 2)) < events.index(("analyze", 1))
+    assert [e for e in events if e[0] == "saved"] == [
+        ("saved", 1),
+        ("saved", 2),
+        ("saved", 3),
+    ]
+    # The instance is only shut down once every job has been saved.
+    mocked_shutdown.assert_called_once()
+    # Per-job directories are removed.
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,67 @@
+from remote import Remote
+from polling import EmptyQueueBackoff
+from benchmarks.fakes import FakeQueueServer
+
+from unittest.mock import patch
+import time
+
+from .test_result_cache import make_item
+from .utils import FakeQueueAPI
+
+
+def test_backoff_grows_with_jitter_and_resets():
+    backoff = EmptyQueueBackoff(1, 30)
+    for limit in (1, 2, 4, 8, 16, 30, 30, 30):
+        assert limit / 2 <= backoff.next_delay() <= limit
+    # Time already spent waiting on a long poll is not slept again.
+    assert backoff.next_delay(elapsed_seconds=30) == 0
+    backoff.reset()
+    assert backoff.next_delay() <= 1
+
+    # Without a minimum the sleep is always the same.
+    fixed = EmptyQueueBackoff(30, 30)
+    assert [fixed.next_delay() for _ in range(3)] == [30, 30, 30]
+
+
+def test_run_queue_resets_backoff_when_work_arrives():
+    api = FakeQueueAPI(items=[])
+    remote = Remote(
+        api_endpoint="http://example.com",
+        sleep_secs_on_empty_queue=8,
+        empty_queue_min_sleep_seconds=1,
+    )
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 4:
+            api.items.append(make_item(1))
+        if len(sleeps) == 6:
+            remote.stop()
+
+    def process(self):
+        self.queued_audio_dict = self._return_queue_item()
+
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(Remote, "process", process), patch("remote.time.sleep", sleep):
+        remote.run_queue()
+
+    assert len(sleeps) == 6
+    assert sleeps[0] <= 1 and 2 <= sleeps[3] <= 8
+    # The leased item reset the backoff.
+    assert sleeps[4] <= 1
+
+
+def test_long_poll_waits_for_work():
+    queue = FakeQueueServer().start()
+    try:
+        remote = Remote(api_endpoint=queue.url, long_poll_seconds=5)
+        queue.enqueue(make_item(1), time.time() + 0.3)
+        start = time.monotonic()
+        item = remote._return_queue_item()
+        elapsed = time.monotonic() - start
+    finally:
+        queue.close()
+    assert item["id"] == 1
+    assert 0.2 < elapsed < 3
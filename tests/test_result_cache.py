@@ -0,0 +1,167 @@
+from remote import Remote
+from result_cache import ResultCache
+
+from unittest.mock import MagicMock, patch
+import os
+
+from .utils import FakeQueueAPI
+
+
+def make_item(item_id, file_path="PROJECT/GROUP/file.wav"):
+    return {
+        "id": item_id,
+        "audio": {
+            "file_path": file_path,
+            "file_source": {"s3_bucket": "audio-bucket"},
+        },
+        "group": {
+            "analyzer_config": {
+                "id": item_id,
+                "analyzer": {},
+                "minimum_detection_confidence": 0.5,
+                "extraction_audio_file_destination": {"s3_bucket": "clip-bucket"},
+                "extraction_spectrogram_file_destination": {"s3_bucket": "spec-bucket"},
+                "analysis_json_file_destination": {"s3_bucket": "json-bucket"},
+            }
+        },
+    }
+
+
+class FakeRecording:
+    duration = 60.0
+
+    def __init__(self, clip_path):
+        self.detections = [
+            {
+                "common_name": "American Robin",
+                "confidence": 0.9,
+                "start_time": 3.0,
+                "end_time": 6.0,
+                "extracted_audio_path": clip_path,
+            }
+        ]
+
+
+def test_result_cache_lookup_by_checksum_and_source(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"))
+    detections = [{"confidence": 0.9, "extracted_audio_path": "/tmp/clip.flac"}]
+    cache.put("checksum-key", "source-key", "abc", detections, 60.0, "2.4", 12.5)
+
+    for result in (
+        cache.get(checksum_key="checksum-key"),
+        cache.get(source_key="source-key"),
+    ):
+        assert result.detections == [{"confidence": 0.9}]
+        assert result.duration == 60.0
+        assert result.analyzer_version == "2.4"
+        assert result.file_checksum == "abc"
+    assert cache.get(checksum_key="other") is None
+
+    # Shared with other runners through the database file.
+    other = ResultCache(str(tmp_path / "results.sqlite3"))
+    other.record_lookup(other.get(checksum_key="checksum-key"), elapsed_seconds=0.5)
+    other.record_lookup(None)
+    assert other.stats == {
+        "lookups": 2,
+        "hits": 1,
+        "hit_rate": 0.5,
+        "seconds_saved": 12.0,
+    }
+
+
+def test_duplicate_audio_reuses_detections_and_urls(tmp_path):
+    items = [
+        make_item(1),
+        make_item(2),
+        make_item(3, file_path="OTHER/GROUP/copy.wav"),
+        make_item(4, file_path="OTHER/GROUP/different.wav"),
+    ]
+    api = FakeQueueAPI(items=items)
+    remote = Remote(
+        api_endpoint="http://example.com",
+        audio_directory=str(tmp_path),
+        extraction_audio_directory=str(tmp_path),
+        result_cache_path=str(tmp_path / "cache" / "results.sqlite3"),
+    )
+    remote.analyzer = MagicMock(version="2.4")
+    remote._client = MagicMock()
+    remote._client.head_object.side_effect = lambda Bucket, Key: {"ETag": f'"{Key}"'}
+    analyzed = []
+
+    def retrieve_file(self):
+        # The copy has the same contents as the original; "different" doesn't.
+        path = self.queued_audio_dict["audio"]["file_path"]
+        self.file_checksum = "checksum-2" if "different" in path else "checksum-1"
+        self.audio_filepath = str(tmp_path / "download.wav")
+        with open(self.audio_filepath, "wb") as f:
+            f.write(b"audio")
+
+    def analyze_file(self):
+        analyzed.append(self.queued_audio_dict["id"])
+        clip_path = str(tmp_path / f"clip_{self.queued_audio_dict['id']}.flac")
+        with open(clip_path, "wb") as f:
+            f.write(b"clip")
+        self.recording = FakeRecording(clip_path)
+
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(Remote, "_retrieve_file", retrieve_file), patch.object(
+        Remote, "_analyze_file", analyze_file
+    ), patch.object(
+        Remote, "_extract_detections_as_audio"
+    ), patch.object(
+        Remote, "_extract_detections_as_spectrogram"
+    ), patch.object(
+        Remote, "_upload_file_to_s3", return_value=True
+    ), patch.object(
+        Remote, "_upload_json"
+    ):
+        for _ in items:
+            remote.process()
+
+    # Item 2 is found by ETag before downloading, item 3 by checksum after.
+    assert analyzed == [1, 4]
+    assert remote._client.head_object.call_count == 4
+
+    url = "https://clip-bucket.s3.amazonaws.com/PROJECT/GROUP/clip_1.flac"
+    first, second, third, fourth = (api.results[i] for i in (1, 2, 3, 4))
+    assert first["detections"][0]["extracted_audio_url"] == url
+    assert first["result_cache"]["hit"] is False
+    # The local clip path is dropped; the url is reused.
+    cached_detections = [
+        {k: v for k, v in d.items() if k != "extracted_audio_path"}
+        for d in first["detections"]
+    ]
+    assert second["detections"] == cached_detections
+    assert second["file_checksum"] == "checksum-1"
+    assert second["duration_seconds"] == 60.0
+    assert second["analyzer_version"] == "2.4"
+    assert second["result_cache"]["hit"] is True
+    assert third["detections"] == cached_detections
+    assert third["result_cache"] == {
+        "hit": True,
+        "lookups": 3,
+        "hits": 2,
+        "hit_rate": 0.667,
+        "seconds_saved": third["result_cache"]["seconds_saved"],
+    }
+    assert fourth["result_cache"]["hit"] is False
+    assert not os.path.exists(str(tmp_path / "download.wav"))
+
+
+def test_result_cache_keys_include_analyzer_package_version(tmp_path):
+    remote = Remote(
+        api_endpoint="http://example.com",
+        result_cache_path=str(tmp_path / "results.sqlite3"),
+    )
+    remote.queued_audio_dict = make_item(1)
+    remote.file_checksum = "checksum-1"
+    remote._source_etag = '"etag"'
+    with patch("remote.return_analyzer_package_version", return_value="0.18.1"):
+        keys = remote._result_cache_keys()
+        assert remote._result_cache_keys() == keys
+    with patch("remote.return_analyzer_package_version", return_value="0.19.0"):
+        upgraded = remote._result_cache_keys()
+    # An upgraded birdnetlib misses both the checksum and the ETag entries.
+    assert upgraded[0] != keys[0]
+    assert upgraded[1] != keys[1]
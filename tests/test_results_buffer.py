@@ -0,0 +1,114 @@
+from remote import Remote
+from results_buffer import DeadlineFlusher, ResultBuffer
+
+from unittest.mock import patch
+import os
+import time
+
+from .utils import FakeQueueAPI
+
+
+class FakeRecording:
+    duration = 60.0
+
+
+class FakeAnalyzer:
+    version = "2.4"
+
+
+def queue_item(audio_id):
+    return {"id": audio_id, "group": {"analyzer_config": {"id": 2}}}
+
+
+def make_remote(directory, **kwargs):
+    remote = Remote(
+        api_endpoint="http://example.com",
+        result_buffer_directory=directory,
+        **kwargs,
+    )
+    remote.recording = FakeRecording()
+    remote.analyzer = FakeAnalyzer()
+    return remote
+
+
+def test_results_are_batched_and_persisted(tmp_path):
+    api = FakeQueueAPI()
+    remote = make_remote(str(tmp_path), result_buffer_max_results=3)
+
+    with patch("api_session.requests.Session.request", side_effect=api.request):
+        for audio_id in (1, 2):
+            remote.queued_audio_dict = queue_item(audio_id)
+            remote.detections = [{"confidence": 0.9}]
+            remote._save_results_to_server()
+
+        # Below the threshold; kept on disk, nothing posted.
+        assert api.results == {}
+        assert len(remote.result_buffer.pending()) == 2
+
+        # A new Remote (e.g. after a crash) still sees the pending results.
+        restarted = make_remote(str(tmp_path), result_buffer_max_results=3)
+        restarted.queued_audio_dict = queue_item(3)
+        restarted.detections = []
+        restarted._save_results_to_server()
+
+    assert sorted(api.results.keys()) == [1, 2, 3]
+    assert len(api.result_requests) == 1
+    path, headers, data = api.result_requests[0]
+    assert path == "/queues/audio/results/"
+    assert data["results"][0]["config_id"] == 2
+    assert restarted.result_buffer.pending() == []
+    assert len(restarted.result_buffer.flush_latencies) == 1
+
+
+def test_large_single_result_is_gzipped(tmp_path):
+    api = FakeQueueAPI()
+    remote = make_remote(
+        str(tmp_path), result_buffer_max_results=1, result_gzip_min_bytes=100
+    )
+    remote.queued_audio_dict = queue_item(7)
+    remote.detections = [{"confidence": 0.9, "label": "x" * 200}]
+
+    with patch("api_session.requests.Session.request", side_effect=api.request):
+        result = remote._save_results_to_server()
+
+    assert result == {"id": 7}
+    path, headers, data = api.result_requests[0]
+    assert path == "/queues/audio/7/results/"
+    assert headers["Content-Encoding"] == "gzip"
+    assert data["detections"][0]["label"] == "x" * 200
+
+
+def test_failed_submission_keeps_results(tmp_path):
+    remote = make_remote(str(tmp_path), result_buffer_max_results=1, api_max_retries=0)
+    remote.queued_audio_dict = queue_item(8)
+    remote.detections = []
+    remote.result_buffer.last_response = {"id": 7}
+
+    with patch("api_session.requests.Session.request") as mocked_post:
+        mocked_post.return_value.status_code = 500
+        assert remote._save_results_to_server() is None
+
+    assert [audio_id for audio_id, _ in remote.result_buffer.pending()] == ["8"]
+    assert os.path.exists(os.path.join(str(tmp_path), "8.json"))
+    # No response from an earlier flush is passed off as this one's.
+    assert remote.result_buffer.last_response is None
+
+
+def test_results_are_flushed_by_their_deadline(tmp_path):
+    buffer = ResultBuffer(str(tmp_path), max_age_seconds=0.2)
+    submitted = []
+
+    def flush():
+        return buffer.flush(lambda results: submitted.extend(results))
+
+    flusher = DeadlineFlusher(buffer, flush, min_interval_seconds=0.05).start()
+    try:
+        buffer.add(1, {"detections": []})
+        # Nothing else is added or flushed, as while a long job runs.
+        deadline = time.monotonic() + 5
+        while not submitted and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        flusher.stop()
+    assert submitted == [(1, {"detections": []})]
+    assert buffer.pending() == []
@@ -0,0 +1,60 @@
+from remote import Remote
+from spectrogram import SpectrogramEngine
+
+from io import BytesIO
+from PIL import Image
+from unittest.mock import patch
+import numpy as np
+import os
+
+from .test_extraction import FakeRecording
+
+
+def test_images_are_cropped_from_one_stft():
+    recording = FakeRecording()
+    # A 6kHz tone from 4s to 5s on top of the recording.
+    t = np.arange(48000) / 48000
+    recording.ndarray[48000 * 4 : 48000 * 5] += np.sin(2 * np.pi * 6000 * t) / 2
+
+    whole = SpectrogramEngine(recording)
+    tiled = SpectrogramEngine(recording, tile_seconds=2, max_tiles=2)
+    for start_sec, end_sec in ((0, 3), (3, 6), (1, 10)):
+        assert np.allclose(
+            whole.power_db(start_sec, end_sec), tiled.power_db(start_sec, end_sec)
+        )
+    assert whole.tiles_computed == 1
+    assert len(tiled._tiles) == 2
+
+    image = Image.open(BytesIO(whole.render(3, 6)))
+    assert image.format == "PNG"
+    pixels = np.asarray(image.convert("RGB"))
+    # 150 rows up to 14kHz, a column every 256 samples.
+    assert pixels.shape == (150, 561, 3)
+    # The tone is the brightest row (rows run from 14kHz down to 0).
+    row = 149 - round(6000 * 512 / 48000)
+    brightest = pixels[:, 187:374].astype(int).sum(axis=(1, 2)).argmax()
+    assert brightest == row
+
+
+def test_remote_writes_stft_spectrograms(tmp_path):
+    remote = Remote(
+        extraction_spectrogram_directory=str(tmp_path), spectrogram_engine="stft"
+    )
+    remote.recording = FakeRecording()
+    remote.min_conf_spectrogram_extraction = 0.5
+
+    with patch.object(
+        FakeRecording, "extract_detections_as_spectrogram", side_effect=AssertionError
+    ):
+        remote._extract_detections_as_spectrogram()
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "recording_0s-3s.png",
+        "recording_9s-10s.png",
+    ]
+    paths = {
+        d["extracted_spectrogram_path"]
+        for d in remote.recording.detections
+        if d["confidence"] >= 0.5
+    }
+    assert paths == {str(tmp_path / name) for name in os.listdir(tmp_path)}
@@ -0,0 +1,81 @@
+from remote import Remote
+from startup import StartupTimer
+import instance_metadata
+
+from unittest.mock import patch
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import requests
+
+from .utils import FakeQueueAPI, FakeResponse
+
+
+def test_heavy_imports_wait_for_first_use():
+    code = (
+        "import sys, remote, runner; "
+        "print(sorted(m for m in ('birdnetlib', 'boto3', 'matplotlib', 'tensorflow')"
+        " if m in sys.modules))"
+    )
+    env = dict(
+        os.environ,
+        API_ENDPOINT="http://127.0.0.1:9",
+        INSTANCE_METADATA_CACHE_PATH=os.devnull,
+    )
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        cwd=os.path.dirname(os.path.dirname(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_instance_metadata_cached_for_the_boot(tmp_path):
+    cache_path = str(tmp_path / "metadata" / "instance-metadata.json")
+    keys = ["instance-type", "instance-id"]
+    responses = {"instance-type": "m5.large", "instance-id": "i-0123"}
+
+    def get(url, timeout):
+        assert timeout[0] < 1
+        return FakeResponse(200, None, text=responses[url.rsplit("/", 1)[1]])
+
+    with patch("instance_metadata.return_boot_id", return_value="boot-1"), patch(
+        "instance_metadata.requests.get", side_effect=get
+    ) as mocked_get:
+        assert instance_metadata.return_instance_metadata(keys, cache_path) == responses
+        assert instance_metadata.return_instance_metadata(keys, cache_path) == responses
+    assert mocked_get.call_count == 2
+    with open(cache_path) as f:
+        assert json.load(f)["boot_id"] == "boot-1"
+
+    # After a reboot (maybe as another instance) the cache is stale.
+    with patch("instance_metadata.return_boot_id", return_value="boot-2"), patch(
+        "instance_metadata.requests.get", side_effect=requests.exceptions.ConnectTimeout
+    ) as mocked_get:
+        metadata = instance_metadata.return_instance_metadata(keys, cache_path)
+    assert metadata == {"instance-type": None, "instance-id": None}
+    # Unreachable once is enough.
+    assert mocked_get.call_count == 1
+
+
+def test_startup_timer_reports_first_poll_once(capsys):
+    timer = StartupTimer()
+    timer.phase("imports")
+    api = FakeQueueAPI(items=[])
+    remote = Remote(api_endpoint="http://example.com", startup_timer=timer)
+    with patch("api_session.requests.Session.request", side_effect=api.request):
+        remote._return_queue_item()
+        remote._return_queue_item()
+    assert [name for name, _ in timer.phases] == [
+        "interpreter",
+        "imports",
+        "first_poll",
+    ]
+    assert timer.total_seconds == pytest.approx(sum(s for _, s in timer.phases))
+    assert capsys.readouterr().out.count("first queue poll after") == 1
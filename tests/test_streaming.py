@@ -0,0 +1,147 @@
+from remote import Remote
+from streaming import StreamingRecording
+
+from birdnetlib import Recording
+from birdnetlib.analyzer import Analyzer
+from unittest.mock import patch
+import numpy as np
+import os
+import pytest
+import soundfile
+
+
+class FakeAnalyzer(Analyzer):
+    # Runs birdnetlib's analyze_recording, with a "model" whose confidence is
+    # the loudest sample in the chunk.
+    def __init__(self):
+        self.labels = ["Turdus migratorius_American Robin", "Noise_Noise"]
+        self.custom_species_list = []
+        self.has_custom_species_list = False
+        self.use_custom_classifier = False
+        self.classifier_model_path = None
+        self.chunk_counts = []
+
+    def analyze_recording(self, recording):
+        self.chunk_counts.append(len(recording.chunks))
+        super().analyze_recording(recording)
+
+    def predict(self, sample, sensitivity=1.0):
+        loudest = float(np.max(np.abs(sample)))
+        return [[loudest, 1.0 - loudest]]
+
+
+def write_recording(path, sample_rate=48000, seconds=41.0):
+    # Silence with tones of different loudness, some straddling chunk edges.
+    audio = np.zeros(int(sample_rate * seconds), dtype="float32")
+    t = np.arange(sample_rate) / sample_rate
+    for start, amplitude in ((1.0, 0.9), (5.5, 0.5), (17.8, 0.7), (39.5, 0.8)):
+        i = int(start * sample_rate)
+        audio[i : i + sample_rate] = (
+            amplitude * np.sin(2 * np.pi * 1000 * t)[: len(audio[i : i + sample_rate])]
+        )
+    soundfile.write(path, audio, sample_rate, subtype="FLOAT")
+
+
+def as_tuples(detections):
+    return [
+        (d["start_time"], d["end_time"], d["common_name"], round(d["confidence"], 4))
+        for d in detections
+    ]
+
+
+def test_streaming_matches_whole_file_analysis(tmp_path):
+    path = str(tmp_path / "recording.wav")
+    write_recording(path)
+
+    for overlap in (0.0, 1.0):
+        whole = Recording(FakeAnalyzer(), path, min_conf=0.25, overlap=overlap)
+        whole.analyze()
+
+        analyzer = FakeAnalyzer()
+        streaming = StreamingRecording(
+            analyzer, path, window_seconds=7, min_conf=0.25, overlap=overlap
+        )
+        streaming.analyze()
+
+        assert len(analyzer.chunk_counts) > 1
+        assert max(analyzer.chunk_counts) <= 3
+        assert as_tuples(streaming.detections) == as_tuples(whole.detections)
+        assert streaming.duration == whole.duration
+        assert streaming.chunks == []
+
+
+def test_streaming_resampled_input_is_close_to_whole_file_analysis(tmp_path):
+    # birdnetlib resamples with librosa's kaiser_fast (resampy), streaming
+    # with soxr.
+    pytest.importorskip("resampy")
+    for sample_rate in (44100, 32000):
+        path = str(tmp_path / f"recording_{sample_rate}.wav")
+        write_recording(path, sample_rate=sample_rate)
+        whole = Recording(FakeAnalyzer(), path, min_conf=0.25)
+        whole.analyze()
+        streaming = StreamingRecording(
+            FakeAnalyzer(), path, window_seconds=7, min_conf=0.25
+        )
+        streaming.analyze()
+
+        expected = as_tuples(whole.detections)
+        detections = as_tuples(streaming.detections)
+        assert [d[:3] for d in detections] == [d[:3] for d in expected]
+        # Peak amplitudes (this analyzer's confidences) differ by under 0.5%.
+        for detection, whole_detection in zip(detections, expected):
+            assert detection[3] == pytest.approx(whole_detection[3], abs=0.005)
+        assert streaming.duration == pytest.approx(whole.duration, abs=0.001)
+
+
+def test_streaming_extract_array_and_resampling(tmp_path):
+    path = str(tmp_path / "recording.wav")
+    write_recording(path, sample_rate=44100)
+
+    recording = StreamingRecording(FakeAnalyzer(), path, window_seconds=10)
+    recording.analyze()
+    assert abs(recording.duration - 41.0) < 0.01
+    # 13 full chunks plus a zero padded 2 second tail.
+    assert sum(recording.analyzer.chunk_counts) == 14
+
+    segment = recording.get_extract_array(1, 2)
+    assert len(segment) == 48000
+    assert np.max(np.abs(segment)) > 0.85
+
+
+def test_remote_streams_long_recordings(tmp_path):
+    path = str(tmp_path / "recording.wav")
+    write_recording(path, seconds=10)
+
+    remote = Remote(streaming_min_duration_seconds=60)
+    remote.audio_filepath = path
+    remote.analyzer = FakeAnalyzer()
+    assert isinstance(remote._create_recording(0.1), Recording)
+
+    remote.streaming_min_duration_seconds = 5
+    recording = remote._create_recording(0.1)
+    assert isinstance(recording, StreamingRecording)
+    assert recording.window_seconds == remote.streaming_window_seconds
+
+    # Files soundfile can't read fall back to birdnetlib's reader.
+    remote.audio_filepath = str(tmp_path / "recording.mp3")
+    (tmp_path / "recording.mp3").write_bytes(b"not audio")
+    with patch("remote.Recording") as mocked_recording:
+        remote._create_recording(0.1)
+    assert mocked_recording.called
+
+
+def test_streaming_keeps_a_memory_mapped_waveform(tmp_path):
+    path = str(tmp_path / "recording.wav")
+    write_recording(path, seconds=20)
+    waveform_path = str(tmp_path / "recording.wav.waveform.f32")
+
+    recording = StreamingRecording(
+        FakeAnalyzer(), path, window_seconds=6, waveform_path=waveform_path
+    )
+    recording.analyze()
+    expected, _ = soundfile.read(path, dtype="float32")
+    assert np.array_equal(recording.ndarray, expected)
+
+    # Clips come from the decoded copy, not the source file.
+    os.remove(path)
+    assert np.array_equal(recording.get_extract_array(1, 2), expected[48000:96000])
@@ -0,0 +1,107 @@
+from remote import Remote
+from supervisor import ShutdownCoordinator, Supervisor
+
+from unittest.mock import patch
+import multiprocessing
+import os
+import threading
+import time
+
+from .utils import FakeQueueAPI
+
+
+class FakeRemote:
+    def __init__(self, shutdown_coordinator):
+        self.shutdown_coordinator = shutdown_coordinator
+        self.stop_requested = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def run_queue(self):
+        while not self.stop_requested:
+            self.shutdown_coordinator.report_idle()
+            time.sleep(0.05)
+
+
+def create_fake_remote(audio_directory, pid=None, shutdown_coordinator=None, **kwargs):
+    return FakeRemote(shutdown_coordinator)
+
+
+def test_supervisor_shuts_down_once_every_worker_is_idle():
+    supervisor = Supervisor(3, create_fake_remote)
+    with patch.object(Supervisor, "preload"), patch.object(
+        Supervisor, "shutdown_instance"
+    ) as mocked_shutdown_instance:
+        supervisor.run(poll_seconds=0.05)
+    mocked_shutdown_instance.assert_called_once()
+    assert supervisor.workers == {}
+
+
+def test_all_workers_idle():
+    supervisor = Supervisor(2, create_fake_remote, idle_report_window_seconds=60)
+    first = ShutdownCoordinator(supervisor.idle_since, 0)
+    second = ShutdownCoordinator(supervisor.idle_since, 1)
+    first.report_idle()
+    assert not supervisor.all_workers_idle()
+    second.report_idle()
+    assert supervisor.all_workers_idle()
+    second.report_busy()
+    assert not supervisor.all_workers_idle()
+
+
+def test_worker_remote_defers_shutdown_to_coordinator():
+    idle_since = multiprocessing.Array("d", 1, lock=False)
+    api = FakeQueueAPI(items=[], safe_to_shutdown=True)
+    remote = Remote(
+        api_endpoint="http://example.com",
+        shutdown_on_empty_processing_queue=True,
+        shutdown_coordinator=ShutdownCoordinator(idle_since, 0),
+    )
+    with patch(
+        "api_session.requests.Session.request", side_effect=api.request
+    ), patch.object(Remote, "_shutdown") as mocked_shutdown:
+        assert remote._return_queue_item() is None
+    mocked_shutdown.assert_not_called()
+    assert idle_since[0] > 0
+
+
+def create_crashing_remote(marker_path):
+    # Crashes the first worker started; restarted workers run normally.
+    def create_remote(audio_directory, shutdown_coordinator=None, **kwargs):
+        if not os.path.exists(marker_path):
+            open(marker_path, "w").close()
+            raise RuntimeError("crashed")
+        return FakeRemote(shutdown_coordinator)
+
+    return create_remote
+
+
+def test_supervisor_restarts_crashed_worker(tmp_path):
+    supervisor = Supervisor(1, create_crashing_remote(str(tmp_path / "crashed")))
+    with patch("supervisor.RESTART_DELAY_SECONDS", 0.1), patch.object(
+        Supervisor, "preload"
+    ), patch.object(Supervisor, "shutdown_instance") as mocked_shutdown_instance:
+        supervisor.run(poll_seconds=0.05)
+    assert supervisor.restarts == [1]
+    mocked_shutdown_instance.assert_called_once()
+
+
+def test_stop_during_restart_backoff_cancels_restart(tmp_path):
+    def create_remote(audio_directory, **kwargs):
+        raise RuntimeError("crashed")
+
+    supervisor = Supervisor(1, create_remote)
+    timer = threading.Timer(0.5, supervisor.stop)
+    start = time.monotonic()
+    with patch("supervisor.RESTART_DELAY_SECONDS", 60), patch.object(
+        Supervisor, "preload"
+    ), patch.object(Supervisor, "shutdown_instance") as mocked_shutdown_instance:
+        timer.start()
+        supervisor.run(poll_seconds=0.05)
+    # The supervisor returned without waiting out the backoff or re-forking.
+    assert time.monotonic() - start < 5
+    assert supervisor.restarts == [1]
+    assert supervisor.workers == {}
+    assert supervisor.restart_at == {}
+    mocked_shutdown_instance.assert_not_called()
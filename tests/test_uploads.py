@@ -0,0 +1,121 @@
+from remote import Remote
+from uploads import ExtractionUploader, UploadTask
+
+from unittest.mock import patch
+
+
+def test_upload_extractions_concurrently(tmp_path):
+    detections = []
+    for i in range(20):
+        audio_path = tmp_path / f"file_{i}s-{i + 3}s.flac"
+        audio_path.write_bytes(b"a" * 10)
+        spectrogram_path = tmp_path / f"file_{i}s-{i + 3}s.jpg"
+        spectrogram_path.write_bytes(b"s" * 5)
+        detections.append(
+            {
+                "start_time": i,
+                "end_time": i + 3,
+                "extracted_audio_path": str(audio_path),
+                "extracted_spectrogram_path": str(spectrogram_path),
+            }
+        )
+
+    class FakeRecording:
+        pass
+
+    remote = Remote(upload_workers=4)
+    remote.recording = FakeRecording()
+    remote.recording.detections = detections
+    remote.queued_audio_dict = {
+        "audio": {"file_path": "PROJECT/GROUP/file.wav"},
+        "group": {
+            "analyzer_config": {
+                "extraction_audio_file_destination": {"s3_bucket": "audio-bucket"},
+                "extraction_spectrogram_file_destination": {
+                    "s3_bucket": "spectro-bucket"
+                },
+            }
+        },
+    }
+
+    def upload_file_to_s3(self, filepath, bucket, key):
+        # One failed upload should not affect the others.
+        return key != "PROJECT/GROUP/file_5s-8s.jpg"
+
+    with patch.object(Remote, "_upload_file_to_s3", upload_file_to_s3):
+        remote._upload_extractions()
+
+    assert len(remote.uploaded_extractions) == 40
+    assert remote.uploaded_extractions["PROJECT/GROUP/file_5s-8s.jpg"] == False
+    assert (
+        remote.detections[0]["extracted_audio_url"]
+        == "https://audio-bucket.s3.amazonaws.com/PROJECT/GROUP/file_0s-3s.flac"
+    )
+    assert (
+        remote.detections[0]["extracted_spectrogram_url"]
+        == "https://spectro-bucket.s3.amazonaws.com/PROJECT/GROUP/file_0s-3s.jpg"
+    )
+    assert "extracted_spectrogram_url" not in remote.detections[5]
+    assert "extracted_audio_url" in remote.detections[5]
+    assert remote.upload_stats["files_uploaded"] == 39
+    assert remote.upload_stats["files_failed"] == 1
+    assert remote.upload_stats["bytes_uploaded"] == 20 * 10 + 19 * 5
+
+
+def test_uploader_records_exceptions_as_failures(tmp_path):
+    def upload_function(filepath, bucket, key):
+        if key == "bad":
+            raise ValueError("upload failed")
+        return True
+
+    uploader = ExtractionUploader(upload_function, max_workers=2)
+    tasks = uploader.upload(
+        [
+            UploadTask(str(tmp_path / "a"), "bucket", "good"),
+            UploadTask(str(tmp_path / "b"), "bucket", "bad"),
+        ]
+    )
+    assert [t.success for t in tasks] == [True, False]
+    assert uploader.stats["files_failed"] == 1
+
+
+def test_detections_sharing_a_window_upload_its_files_once(tmp_path):
+    audio_path = tmp_path / "file_0s-3s.flac"
+    audio_path.write_bytes(b"a" * 10)
+    detections = [
+        {
+            "start_time": 0,
+            "end_time": 3,
+            "common_name": name,
+            "extracted_audio_path": str(audio_path),
+        }
+        for name in ("Robin", "Wren")
+    ]
+
+    class FakeRecording:
+        pass
+
+    remote = Remote()
+    remote.recording = FakeRecording()
+    remote.recording.detections = detections
+    remote.queued_audio_dict = {
+        "audio": {"file_path": "PROJECT/GROUP/file.wav"},
+        "group": {
+            "analyzer_config": {
+                "extraction_audio_file_destination": {"s3_bucket": "audio-bucket"},
+                "extraction_spectrogram_file_destination": {
+                    "s3_bucket": "spectro-bucket"
+                },
+            }
+        },
+    }
+
+    with patch.object(Remote, "_upload_file_to_s3", return_value=True) as mocked:
+        remote._upload_extractions()
+
+    mocked.assert_called_once_with(
+        str(audio_path), "audio-bucket", "PROJECT/GROUP/file_0s-3s.flac"
+    )
+    url = "https://audio-bucket.s3.amazonaws.com/PROJECT/GROUP/file_0s-3s.flac"
+    assert [d["extracted_audio_url"] for d in remote.detections] == [url, url]
+    assert remote.upload_stats["files_uploaded"] == 1
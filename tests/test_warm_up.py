@@ -0,0 +1,90 @@
+from remote import Remote
+
+from unittest.mock import patch
+import json
+
+from .utils import FakeQueueAPI, FakeResponse
+
+
+class FakeAnalyzer:
+    use_custom_classifier = False
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.predictions = []
+
+    def predict(self, sample):
+        self.predictions.append(len(sample))
+
+
+ANALYZER_CONFIG_24 = {"id": 1, "analyzer": {"base_version": "2.4"}}
+ANALYZER_CONFIG_23 = {"id": 2, "analyzer": {"base_version": "2.3"}}
+
+
+def test_warm_up_from_file(tmp_path):
+    path = tmp_path / "warm_up.json"
+    # Bare analyzer configs and queue items are both accepted.
+    path.write_text(
+        json.dumps(
+            [ANALYZER_CONFIG_24, {"group": {"analyzer_config": ANALYZER_CONFIG_23}}]
+        )
+    )
+    remote = Remote(warm_up_configs_path=str(path))
+
+    with patch("remote.Analyzer", FakeAnalyzer):
+        remote.warm_up()
+
+    assert remote._analyzers_init_count == 2
+    assert len(remote.warm_up_timings) == 2
+    assert remote.warm_up_duration_seconds >= 0
+    for _, analyzer in remote._analyzers.items():
+        # One dummy 3 second chunk at 48kHz.
+        assert analyzer.predictions == [144000]
+
+    # The first job for a warmed config reuses the analyzer.
+    remote.queued_audio_dict = {"group": {"analyzer_config": ANALYZER_CONFIG_24}}
+    with patch("remote.Recording"), patch.object(Remote, "_set_checksum"), patch(
+        "remote.pprint"
+    ):
+        remote._analyze_file()
+    assert remote._analyzers_init_count == 2
+    assert remote.analyzer.kwargs == {"version": "2.4"}
+
+    # Warm-up time is reported in the metrics and the results, not the job's.
+    assert remote.metrics.totals["warm_up"][0] == 1
+    assert remote.metrics.totals["warm_up"][2] == 2
+    remote.analyzer.version = "2.4"
+    remote.api_endpoint = "http://example.com"
+    api = FakeQueueAPI()
+    with patch("api_session.requests.Session.request", side_effect=api.request):
+        for audio_id in (1, 2):
+            remote.queued_audio_dict["id"] = audio_id
+            remote._save_results_to_server()
+    # Only with the first result submitted.
+    assert api.results[1]["warm_up"] == {
+        "duration_seconds": remote.warm_up_duration_seconds,
+        "analyzer_seconds": remote.warm_up_timings,
+    }
+    assert "warm_up" not in api.results[2]
+    assert 'audiospotter_stage_seconds_total{stage="warm_up"}' in (
+        remote.metrics.render()
+    )
+
+
+def test_warm_up_from_api():
+    remote = Remote(
+        api_endpoint="https://example.com", api_key="secret", warm_up_from_api=True
+    )
+    with patch(
+        "api_session.requests.Session.request",
+        return_value=FakeResponse(200, [ANALYZER_CONFIG_23]),
+    ) as mocked_request, patch("remote.Analyzer", FakeAnalyzer):
+        remote.warm_up()
+    assert mocked_request.call_args.args[:2] == (
+        "GET",
+        "https://example.com/analyzer-configs/active/",
+    )
+    # The api key is sent as a header, never in the url.
+    assert "params" not in mocked_request.call_args.kwargs
+    assert mocked_request.call_args.kwargs["headers"]["BNL_APIKEY"] == "secret"
+    assert remote._analyzers_init_count == 1
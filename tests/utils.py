@@ -1,6 +1,8 @@
 import boto3
 from botocore.stub import Stubber
 from io import BytesIO
+import gzip
+import json as jsonlib
 
 
 def return_stubber_client_for_filedownload(bucket_name, key, bcontents=None):
@@ -58,3 +60,89 @@ def return_stubber_client_for_filedownload_404(bucket_name, key):
     stubber.activate()
 
     return s3_client
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, text=""):
+        self.status_code = status_code
+        self._data = data if data is not None else {}
+        self.text = text
+
+    def json(self):
+        return self._data
+
+
+class FakeQueueAPI:
+    # Offline stand-in for the audiospotter-api queue endpoints.
+    # Use as the side_effect of a patched requests.Session.request.
+
+    def __init__(self, items=None, lease_seconds=900, safe_to_shutdown=False):
+        self.items = list(items or [])
+        self.lease_seconds = lease_seconds
+        self.safe_to_shutdown = safe_to_shutdown
+        self.leased = {}
+        self.released = []
+        self.results = {}
+        self.result_requests = []
+        self.lease_requests = []
+        self.shutdown_requests = []
+        self.heartbeats = []
+
+    def request(self, method, url, **kwargs):
+        if method == "POST":
+            return self.post(url, **kwargs)
+        return FakeResponse(405)
+
+    def post(self, url, json=None, data=None, headers=None, verify=None, **kwargs):
+        path = "/" + url.split("://", 1)[-1].split("/", 1)[-1]
+        if data is not None:
+            if (headers or {}).get("Content-Encoding") == "gzip":
+                data = gzip.decompress(data)
+            json = jsonlib.loads(data)
+        if path.endswith("/queues/audio/"):
+            return self._lease(json or {})
+        if path.endswith("/release/"):
+            audio_id = int(path.rstrip("/").split("/")[-2])
+            item = self.leased.pop(audio_id)
+            self.released.append(audio_id)
+            self.items.insert(0, item)
+            return FakeResponse(200, {})
+        if path.endswith("/heartbeat/"):
+            audio_id = int(path.rstrip("/").split("/")[-2])
+            self.heartbeats.append(audio_id)
+            return FakeResponse(200 if audio_id in self.leased else 404, {})
+        if path.endswith("/queues/audio/results/"):
+            self.result_requests.append((path, headers, json))
+            for result in json["results"]:
+                self.leased.pop(result["id"], None)
+                self.results[result["id"]] = result
+            return FakeResponse(201, {"count": len(json["results"])})
+        if path.endswith("/results/"):
+            self.result_requests.append((path, headers, json))
+            audio_id = int(path.rstrip("/").split("/")[-2])
+            self.leased.pop(audio_id, None)
+            self.results[audio_id] = json
+            return FakeResponse(201, {"id": audio_id})
+        if path.endswith("/shutdown-instance/"):
+            self.shutdown_requests.append(json)
+            return FakeResponse(200, {})
+        return FakeResponse(404)
+
+    def _lease(self, data):
+        self.lease_requests.append(data)
+        count = data.get("count", None)
+        leased = self.items[: count or 1]
+        self.items = self.items[len(leased) :]
+        for item in leased:
+            self.leased[item["id"]] = item
+
+        if count is None:
+            # Original single item shape.
+            if leased:
+                return FakeResponse(200, leased[0])
+            return FakeResponse(200, {"safe_to_shutdown": self.safe_to_shutdown})
+
+        data = {"items": leased, "lease_seconds": self.lease_seconds}
+        if not leased:
+            data["safe_to_shutdown"] = self.safe_to_shutdown
+        return FakeResponse(200, data)
@@ -0,0 +1,79 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadTask:
+    # Uploads the file at filepath, or the bytes returned by render (called on
+    # the upload worker, just before the upload).
+    def __init__(self, filepath, bucket, key, render=None):
+        self.filepath = filepath
+        self.bucket = bucket
+        self.key = key
+        self.render = render
+        self.bytes = 0
+        self.success = False
+
+    @property
+    def url(self):
+        return f"https://{self.bucket}.s3.amazonaws.com/{self.key}"
+
+
+class ExtractionUploader:
+    # Uploads many small files in parallel through a single upload function
+    # (normally Remote._upload_file_to_s3, which shares one S3 client).
+
+    def __init__(self, upload_function, max_workers=8, upload_fileobj_function=None):
+        self.upload_function = upload_function
+        self.upload_fileobj_function = upload_fileobj_function
+        self.max_workers = max(1, int(max_workers))
+        self.bytes_uploaded = 0
+        self.files_uploaded = 0
+        self.files_failed = 0
+        self.seconds = 0
+
+    def _upload(self, task):
+        if task.filepath and os.path.exists(task.filepath):
+            task.bytes = os.path.getsize(task.filepath)
+        try:
+            if task.render:
+                body = task.render()
+                task.bytes = len(body)
+                task.success = bool(
+                    self.upload_fileobj_function(
+                        io.BytesIO(body), task.bucket, task.key
+                    )
+                )
+            else:
+                task.success = bool(
+                    self.upload_function(task.filepath, task.bucket, task.key)
+                )
+        except Exception as e:
+            # Record the failure for this file and let the other uploads continue.
+            print(e)
+            task.success = False
+        return task
+
+    def upload(self, tasks):
+        start = time.monotonic()
+        if tasks:
+            workers = min(self.max_workers, len(tasks))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # map keeps the results in task order.
+                tasks = list(executor.map(self._upload, tasks))
+        self.seconds = round(time.monotonic() - start, 3)
+
+        self.bytes_uploaded = sum(t.bytes for t in tasks if t.success)
+        self.files_uploaded = len([t for t in tasks if t.success])
+        self.files_failed = len(tasks) - self.files_uploaded
+        return tasks
+
+    @property
+    def stats(self):
+        return {
+            "files_uploaded": self.files_uploaded,
+            "files_failed": self.files_failed,
+            "bytes_uploaded": self.bytes_uploaded,
+            "seconds": self.seconds,
+        }